@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+'''
+This script benchmarks the ``larpix.bitarrayhelper`` conversions and the
+code built on them: ``fromuint``/``touint``, packet field access,
+``Chip.get_configuration_packets`` (for all registers and for a single
+register) and ``Configuration_v2.all_data``.
+Each benchmark is run with the ``bitarrayhelper`` conversions and with
+the previous conversions through binary strings. To use:
+python bench_bitarrayhelper.py --n_iter <iterations>
+
+'''
+import argparse
+import time
+
+from larpix import Chip, Packet_v1, Packet_v2, Configuration_v2
+import larpix.bitarrayhelper as bah
+
+parser = argparse.ArgumentParser(usage=__doc__)
+parser.add_argument('--n_iter', '-n', type=int, default=1000, help='''
+    number of iterations of each benchmark (default: %(default)s)
+    ''')
+
+def string_fromuint(val, nbits, endian='big'):
+    try:
+        if isinstance(nbits, slice):
+            nbits = abs(nbits.stop - nbits.start)
+        return bah._fromuint_str(val, nbits, endian)
+    except TypeError:
+        return val
+
+def string_touint(bits, endian='big'):
+    bin_string = bits.to01()
+    if endian[0] == 'b':
+        return int(bin_string, 2)
+    return int(bin_string[::-1], 2)
+
+def timed(func, n, engine):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    t = time.perf_counter() - start
+    print('{:<36s}{:<8s}{:>10.3f}s{:>12.3f}us/iter'.format(func.__name__,
+        engine, t, t / n * 1e6))
+
+def main(n_iter):
+    chip = Chip('1-1-1')
+    config = Configuration_v2()
+    packet_v1 = Packet_v1()
+    packet_v2 = Packet_v2()
+    bits = bah.fromuint(123456, 32, endian='little')
+
+    def fromuint():
+        for val in range(64):
+            bah.fromuint(val, 8, endian='little')
+    def touint():
+        for _ in range(64):
+            bah.touint(bits, endian='little')
+    def packet_v1_fields():
+        packet_v1.chipid = 12
+        packet_v1.channel_id = 3
+        packet_v1.timestamp = 123456
+        (packet_v1.chipid, packet_v1.channel_id, packet_v1.timestamp,
+            packet_v1.dataword)
+    def packet_v2_fields():
+        packet_v2.chip_id = 12
+        packet_v2.channel_id = 3
+        packet_v2.timestamp = 123456
+        (packet_v2.chip_id, packet_v2.channel_id, packet_v2.timestamp,
+            packet_v2.dataword)
+    def get_configuration_packets():
+        chip.get_configuration_write_packets()
+    def get_configuration_packets_subset():
+        chip.get_configuration_write_packets(registers=[64])
+    def all_data():
+        config.all_data()
+
+    engines = [('bah', (bah.fromuint, bah.touint)),
+        ('string', (string_fromuint, string_touint))]
+    for engine, (bah.fromuint, bah.touint) in engines:
+        for func, n in ((fromuint, n_iter), (touint, n_iter),
+                (packet_v1_fields, n_iter), (packet_v2_fields, n_iter),
+                (get_configuration_packets, max(n_iter // 100, 1)),
+                (get_configuration_packets_subset, n_iter),
+                (all_data, max(n_iter // 100, 1))):
+            timed(func, n, engine)
+    bah.fromuint, bah.touint = engines[0][1]
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.n_iter)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''
+This script benchmarks writing ``Packet_v2`` data with
+``hdf5format.to_file``. It compares writing a list of packet objects using the
+per-packet formatting of the v2.2 format, a list of packet objects using the
+v2.3 format, and columns of raw packet words (``packet_array_from_payload``).
+To use:
+python bench_hdf5format.py --n_packets <packets>
+
+'''
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from larpix import Packet_v2
+from larpix.format import hdf5format
+
+parser = argparse.ArgumentParser(usage=__doc__)
+parser.add_argument('--n_packets', '-n', type=int, default=100000, help='''
+    number of packets to write (default: %(default)s)
+    ''')
+
+def generate_packets(n):
+    rng = np.random.RandomState(0)
+    payload = rng.randint(0, 2**63, size=n, dtype='u8')
+    io_channel = rng.randint(1, 33, size=n, dtype='u1')
+    receipt_timestamp = rng.randint(0, 2**32, size=n, dtype='u4')
+    packets = list()
+    for i in range(n):
+        packet = Packet_v2(int(payload[i]).to_bytes(8, 'little'))
+        packet.io_group = 1
+        packet.io_channel = int(io_channel[i])
+        packet.receipt_timestamp = int(receipt_timestamp[i])
+        packets.append(packet)
+    columns = dict(payload=payload, io_group=np.ones(n, dtype='u1'),
+        io_channel=io_channel, receipt_timestamp=receipt_timestamp)
+    return packets, columns
+
+def main(n_packets):
+    packets, columns = generate_packets(n_packets)
+    tests = [
+        ('to_file(packets, v2.2)', lambda f: hdf5format.to_file(f, packets, version='2.2')),
+        ('to_file(packets, v2.3)', lambda f: hdf5format.to_file(f, packets, version='2.3')),
+        ('to_file(columns, v2.3)', lambda f: hdf5format.to_file(f, columns, version='2.3')),
+        ]
+    print('{} packets'.format(n_packets))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i, (name, func) in enumerate(tests):
+            filename = os.path.join(tmpdir, 'bench_{}.h5'.format(i))
+            start = time.time()
+            func(filename)
+            t = time.time() - start
+            print('{:<28s}{:>10.3f}s{:>12.2f}Mpkt/s'.format(name, t, n_packets/t/1e6))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.n_packets)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+'''
+This script compares selecting and grouping packets with a
+``PacketCollection`` and with a ``PacketArray``. To use:
+python bench_packet_array.py --n_packets <packets>
+
+'''
+import argparse
+import time
+
+import numpy as np
+
+from larpix import Packet_v2, PacketCollection, PacketArray
+
+parser = argparse.ArgumentParser(usage=__doc__)
+parser.add_argument('--n_packets', '-n', type=int, default=100000, help='''
+    number of packets to test (default: %(default)s)
+    ''')
+
+def generate_packets(n):
+    rng = np.random.RandomState(0)
+    payload = rng.randint(0, 2**63, size=n, dtype='u8')
+    io_channel = rng.randint(1, 33, size=n)
+    packets = list()
+    for i in range(n):
+        packet = Packet_v2(int(payload[i]).to_bytes(8, 'little'))
+        packet.io_group = 1
+        packet.io_channel = int(io_channel[i])
+        packets.append(packet)
+    return packets
+
+def main(n_packets):
+    packets = generate_packets(n_packets)
+    tests = [
+        ('create', lambda cls: cls(packets)),
+        ('extract', lambda c: c.extract('dataword', packet_type=0, chip_id=12)),
+        ('extract 3 attrs', lambda c: c.extract('chip_id', 'channel_id', 'timestamp')),
+        ('by_chipid', lambda c: c.by_chipid()),
+        ('by_chip_key', lambda c: c.by_chip_key()),
+        ]
+    print('{} packets'.format(n_packets))
+    print('{:<20s}{:>18s}{:>18s}'.format('', 'PacketCollection', 'PacketArray'))
+    collections = dict()
+    for name, test in tests:
+        times = list()
+        for cls in (PacketCollection, PacketArray):
+            arg = cls if name == 'create' else collections[cls]
+            start = time.perf_counter()
+            result = test(arg)
+            times.append(time.perf_counter() - start)
+            if name == 'create':
+                collections[cls] = result
+        print('{:<20s}{:>17.4f}s{:>17.4f}s'.format(name, *times))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.n_packets)
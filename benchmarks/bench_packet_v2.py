@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+'''
+This script benchmarks ``Packet_v2`` objects: creating packets from bytes,
+reading and setting fields, computing the parity, and converting back to
+bytes, along with the memory used by each packet. To use:
+python bench_packet_v2.py --n_packets <packets>
+
+'''
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from larpix import Packet_v2
+
+parser = argparse.ArgumentParser(usage=__doc__)
+parser.add_argument('--n_packets', '-n', type=int, default=100000, help='''
+    number of packets to test (default: %(default)s)
+    ''')
+
+def timed(func, n):
+    start = time.perf_counter()
+    func()
+    t = time.perf_counter() - start
+    print('{:<24s}{:>10.3f}s{:>10.3f}us/pkt'.format(func.__name__, t, t / n * 1e6))
+
+def main(n_packets):
+    rng = np.random.RandomState(0)
+    words = [int(word).to_bytes(8, 'little')
+        for word in rng.randint(0, 2**63, size=n_packets, dtype='u8')]
+    packets = []
+
+    def decode():
+        packets.extend([Packet_v2(word) for word in words])
+    def read_fields():
+        for p in packets:
+            (p.packet_type, p.chip_id, p.channel_id, p.timestamp, p.dataword,
+                p.trigger_type, p.local_fifo, p.shared_fifo)
+    def set_fields():
+        for p in packets:
+            p.chip_id = 12
+            p.channel_id = 3
+            p.timestamp = 123456
+            p.io_group = 1
+            p.io_channel = 2
+    def chip_key():
+        for p in packets:
+            p.chip_key
+    def parity():
+        for p in packets:
+            p.assign_parity()
+            p.has_valid_parity()
+    def to_bytes():
+        for p in packets:
+            p.bytes()
+
+    print('{} packets'.format(n_packets))
+    for func in (decode, read_fields, set_fields, chip_key, parity, to_bytes):
+        timed(func, n_packets)
+
+    del packets[:]
+    tracemalloc.start()
+    decode()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<24s}{:>10.1f}B/pkt'.format('memory', size / n_packets))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.n_packets)
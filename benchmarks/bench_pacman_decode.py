@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+'''
+This script benchmarks the parsing of PACMAN data messages within
+``PACMAN_IO.empty_queue`` as a function of the number of decode worker
+processes (``PACMAN_IO.decode_workers``). To use:
+python bench_pacman_decode.py --n_msgs <messages> --n_packets <packets per message> --workers 0 1 2 4
+
+'''
+import argparse
+import json
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+from larpix import Packet_v2
+from larpix.io.pacman_io import PACMAN_IO
+import larpix.format.pacman_msg_format as pacman_msg_format
+
+parser = argparse.ArgumentParser(usage=__doc__)
+parser.add_argument('--n_msgs', '-m', type=int, default=512, help='''
+    number of messages to decode (default: %(default)s)
+    ''')
+parser.add_argument('--n_packets', '-n', type=int, default=512, help='''
+    number of packets per message (default: %(default)s)
+    ''')
+parser.add_argument('--workers', '-w', type=int, nargs='+', default=None, help='''
+    decode worker counts to test (default: 0 and powers of 2 up to the cpu count)
+    ''')
+parser.add_argument('--batch_size', '-b', type=int, default=PACMAN_IO.decode_batch_size, help='''
+    messages per decode batch (default: %(default)s)
+    ''')
+parser.add_argument('--repeat', '-r', type=int, default=3, help='''
+    number of repetitions for each test (default: %(default)s)
+    ''')
+
+def generate_messages(n_msgs, n_packets):
+    rng = np.random.RandomState(0)
+    messages = list()
+    for _ in range(n_msgs):
+        payloads = rng.randint(0, 2**63, size=n_packets, dtype='u8')
+        packets = list()
+        for payload in payloads:
+            packet = Packet_v2(int(payload).to_bytes(8, 'little'))
+            packet.io_channel = int(rng.randint(1, 33))
+            packets.append(packet)
+        messages.append(pacman_msg_format.format(packets, msg_type='DATA'))
+    return messages
+
+def main(n_msgs, n_packets, workers, batch_size, repeat):
+    if workers is None:
+        workers = [0] + [2**i for i in range(int(np.log2(os.cpu_count()))+1)]
+    messages = generate_messages(n_msgs, n_packets)
+    io_groups = [i % 4 + 1 for i in range(n_msgs)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config_filepath = os.path.join(tmpdir, 'io.json')
+        with open(config_filepath, 'w') as of:
+            json.dump(dict(_config_type='io', io_class='PACMAN_IO',
+                io_group=[[1, '127.0.0.1']]), of)
+        io = PACMAN_IO(config_filepath=config_filepath)
+
+    io.decode_batch_size = batch_size
+    print('{} msgs, {} packets/msg, {} msgs/batch'.format(n_msgs, n_packets, batch_size))
+    print('{:<10s}{:>14s}{:>14s}'.format('workers', 'packets', 'array'))
+    for n_workers in workers:
+        io.decode_workers = n_workers
+        # start up worker pool
+        io._parse_messages(io_groups, messages, as_array=True)
+        times = list()
+        for as_array in (False, True):
+            t = min(timeit.repeat(
+                lambda: io._parse_messages(io_groups, messages, as_array=as_array),
+                number=1, repeat=repeat))
+            times.append(n_msgs * n_packets / t / 1e6)
+        print('{:<10d}{:>9.2f}Mpkt/s{:>8.2f}Mpkt/s'.format(n_workers, *times))
+    io.cleanup()
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.n_msgs, args.n_packets, args.workers, args.batch_size, args.repeat)
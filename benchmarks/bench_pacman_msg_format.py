@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''
+This script benchmarks encoding of PACMAN request messages. It compares the
+per-word ``pacman_msg_format.format`` with the bulk ``format_tx`` encoder, for
+both lists of ``Packet_v2`` objects and numpy arrays of (io_channel, payload)
+rows. To use:
+python bench_pacman_msg_format.py --n_packets <packets per message> --repeat <n>
+
+'''
+import argparse
+import timeit
+
+import numpy as np
+
+from larpix import Packet_v2
+import larpix.format.pacman_msg_format as pacman_msg_format
+
+parser = argparse.ArgumentParser(usage=__doc__)
+parser.add_argument('--n_packets', '-n', type=int, default=10000, help='''
+    number of packets per message (default: %(default)s)
+    ''')
+parser.add_argument('--repeat', '-r', type=int, default=10, help='''
+    number of messages to format for each method (default: %(default)s)
+    ''')
+
+def generate_packets(n):
+    rng = np.random.RandomState(0)
+    packets = list()
+    for i in range(n):
+        packet = Packet_v2()
+        packet.io_channel = int(rng.randint(1, 33))
+        packet.chip_id = int(rng.randint(0, 256))
+        packet.packet_type = Packet_v2.CONFIG_WRITE_PACKET
+        packet.register_address = int(rng.randint(0, 237))
+        packet.register_data = int(rng.randint(0, 256))
+        packet.assign_parity()
+        packets.append(packet)
+    return packets
+
+def main(n_packets, repeat):
+    packets = generate_packets(n_packets)
+    array = np.zeros((n_packets,), dtype=pacman_msg_format.tx_dtype)
+    array['io_channel'] = [packet.io_channel for packet in packets]
+    array['payload'] = np.frombuffer(b''.join([packet.bytes() for packet in packets]), dtype='<u8')
+    buffer = bytearray(pacman_msg_format.HEADER_LEN + pacman_msg_format.WORD_LEN * n_packets)
+
+    assert pacman_msg_format.format(packets)[8:] == pacman_msg_format.format_tx(array)[8:]
+
+    tests = [
+        ('format(packets)', lambda: pacman_msg_format.format(packets, msg_type='REQ')),
+        ('format_tx(packets)', lambda: pacman_msg_format.format_tx(packets)),
+        ('format_tx(array)', lambda: pacman_msg_format.format_tx(array)),
+        ('format_tx(array, buffer)', lambda: pacman_msg_format.format_tx(array, buffer=buffer)),
+        ]
+    print('{} packets/msg, {} msgs'.format(n_packets, repeat))
+    for name, func in tests:
+        t = timeit.timeit(func, number=repeat) / repeat
+        print('{:<28s}{:>10.3f}ms/msg{:>12.2f}Mpkt/s'.format(
+            name, t*1e3, n_packets/t/1e6))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.n_packets, args.repeat)
@@ -1,23 +1,69 @@
 '''
 A module with convenience functions for bitarray.
 
+``endian`` only sets the order of the bits by index (``'big'``: the most
+significant bit first). The bitarrays returned by ``fromuint`` always
+have the default (big) endianness, and ``touint`` gives the same result
+for any endianness of ``bits``.
+
+Values of up to 8 bits (i.e. single registers) are converted by copying
+bitarrays from a lookup table, and ``touint`` works on the bytes of the
+bitarray, reversing the bits of each byte with a precomputed table when
+needed.
+
 '''
 from bitarray import bitarray
 
+_reversed_bits = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+_table_bits = 8
+_tables = {}
+
+# bitarray.endian is a method before bitarray 3.0 and a property after
+if callable(bitarray().endian):
+    def _is_big(bits):
+        return bits.endian() == 'big'
+else:
+    def _is_big(bits):
+        return bits.endian == 'big'
+
+def _fromuint_str(val, nbits, endian):
+    if endian[0] == 'b':
+        return bitarray(bin(val)[2:].zfill(nbits))
+    return bitarray(bin(val)[-1:1:-1].ljust(nbits, '0'))
+
+def _table(nbits, endian):
+    key = (nbits, endian[0] == 'b')
+    if key not in _tables:
+        _tables[key] = [_fromuint_str(val, nbits, endian) for val in range(2**nbits)]
+    return _tables[key]
+
 def fromuint(val, nbits, endian='big'):
+    '''
+    Convert an unsigned integer to a bitarray of (at least) ``nbits``
+    bits. Values that do not fit are not truncated, and values that are
+    not integers (e.g. bitarrays) are returned unchanged.
+
+    :param nbits: the number of bits, or a slice spanning them
+
+    '''
     try:
         if isinstance(nbits, slice):
             nbits = abs(nbits.stop - nbits.start)
-        if endian[0] == 'b':
-            string = bin(val)[2:].zfill(nbits)
-            return bitarray(string)
-        string = bin(val)[-1:1:-1].ljust(nbits,'0')
-        return bitarray(string)
+        if 0 < nbits <= _table_bits and 0 <= val < 2**nbits:
+            return _table(nbits, endian)[val].copy()
+        return _fromuint_str(val, nbits, endian)
     except TypeError:
         return val
 
 def touint(bits, endian='big'):
-    bin_string = bits.to01()
+    '''
+    Convert a bitarray to an unsigned integer
+
+    '''
+    if not len(bits):
+        raise ValueError('cannot convert an empty bitarray')
     if endian[0] == 'b':
-        return int(bin_string, 2)
-    return int(bin_string[::-1], 2)
+        data = bits.tobytes() if _is_big(bits) else bits.tobytes().translate(_reversed_bits)
+        return int.from_bytes(data, 'big') >> (-len(bits) % 8)
+    data = bits.tobytes().translate(_reversed_bits) if _is_big(bits) else bits.tobytes()
+    return int.from_bytes(data, 'little')
@@ -1,12 +1,20 @@
 from .key import Key
 from .configuration import Configuration_v1, Configuration_v2, Configuration_Lightpix_v1
 from .packet import Packet_v1, Packet_v2
+from . import bitarrayhelper as bah
 
 class Chip(object):
     '''
     Represents one LArPix chip and helps with configuration and packet
     generation.
 
+    The last known value of each configuration register on the ASIC (i.e.
+    the value that was last written to it or read back from it by a
+    ``Controller``) is kept in the ``asic_registers`` dict, by register
+    address. ``get_changed_registers`` compares it to ``config`` to find
+    the registers that need to be written. Clear ``asic_registers`` if the
+    state of the ASIC is no longer known, e.g. after a reset.
+
     '''
 
     def __init__(self, chip_key, version=2):
@@ -31,6 +39,7 @@ class Chip(object):
         self.chip_id = chip_key.chip_id
         self.reads = []
         self.new_reads_index = 0
+        self.asic_registers = {}
 
     def __str__(self):
         return 'Chip (key: {}, version: {})'.format(str(self.chip_key), self.asic_version)
@@ -72,11 +81,15 @@ class Chip(object):
         conf = self.config
         if registers is None:
             registers = range(conf.num_registers)
+        else:
+            registers = sorted(set(i for i in registers if 0 <= i < conf.num_registers))
         packets = []
-        packet_register_data = conf.all_data()
-        for i, data in enumerate(packet_register_data):
-            if i not in registers:
-                continue
+        if self.asic_version == 1:
+            packet_register_data = conf.all_data()
+        else:
+            packet_register_data = conf.register_image
+        for i in registers:
+            data = packet_register_data[i]
             if self.asic_version == 1:
                 packet = Packet_v1()
             else:
@@ -95,6 +108,26 @@ class Chip(object):
             packets.append(packet)
         return packets
 
+    def get_changed_registers(self, registers=None):
+        '''
+        Return the (sorted) addresses of the configuration registers whose
+        value in ``config`` differs from the last known value on the ASIC
+        (see ``asic_registers``), including any register without a known
+        value. Only the specified registers (all by default) are checked.
+
+        '''
+        conf = self.config
+        if self.asic_version == 1:
+            values = [bah.touint(bits) for bits in conf.all_data()]
+        else:
+            values = conf.register_image
+        if registers is None:
+            registers = range(conf.num_registers)
+        else:
+            registers = sorted(set(i for i in registers if 0 <= i < conf.num_registers))
+        known = self.asic_registers
+        return [i for i in registers if known.get(i) != values[i]]
+
     def get_configuration_write_packets(self, registers=None):
         '''
         Return a list of Packet objects to write corresponding to the specified
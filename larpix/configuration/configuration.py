@@ -18,9 +18,12 @@ class _Smart_List(list):
     Used for Configuration attributes where there's a distinct value for
     each LArPix channel.
 
+    If ``on_change`` is given, it is called after an element is set, with
+    the index of the element (or ``None`` if a slice is set).
+
     '''
 
-    def __init__(self, values, low, high):
+    def __init__(self, values, low, high, on_change=None):
         if not (type(values) == list or type(values) == _Smart_List):
             raise ValueError("_Smart_List is not list")
         if any([value > high or value < low for value in values]):
@@ -28,6 +31,7 @@ class _Smart_List(list):
         list.__init__(self, values)
         self.low = low
         self.high = high
+        self.on_change = on_change
 
     def __setitem__(self, key, value):
         if isinstance(key, int):
@@ -39,6 +43,9 @@ class _Smart_List(list):
                 if num > self.high or num < self.low:
                     raise ValueError("value out of bounds")
             list.__setitem__(self, key, value)
+            key = None
+        if getattr(self, 'on_change', None) is not None:
+            self.on_change(key)
 
     def __setslice__(self, i, j, value):
         '''
@@ -41,6 +41,20 @@ class Configuration_v2(BaseConfiguration):
         >>> conf.register_map['enable_min_delta_adc']  # Shares register 170
         range(170, 171)
 
+    The configuration also keeps the value of each physical register in a
+    packed register image (``register_image``), which is updated as the
+    registers are set. Registers whose value changes are marked as dirty
+    until ``clear_dirty`` is called, e.g.::
+
+        >>> conf.clear_dirty()
+        >>> conf.threshold_global = 40
+        >>> conf.dirty_registers
+        [64]
+        >>> conf.register_image[64]
+        40
+
+    A newly created configuration has all of its registers marked as dirty.
+
     '''
 
     asic_version = 2
@@ -54,20 +68,80 @@ class Configuration_v2(BaseConfiguration):
 
     def __init__(self):
         # Note: properties, getters and setters are constructed after this class definition at the bottom of the file.
+        self._register_image = bytearray(self.num_registers)
+        self._dirty_registers = 0
         super(Configuration_v2, self).__init__()
+        self._dirty_registers = (1 << self.num_registers) - 1
         return
 
     def all_data(self, endian='little'):
-        bits = []
-        for register_name in self.register_names:
-            register_data =  getattr(self, register_name+'_data')
-            for register_addr, register_bits in register_data:
-                if len(bits) == register_addr:
-                    if endian[0] == 'l':
-                        bits += [register_bits]
-                    else:
-                        bits += [register_bits[::-1]]
-        return bits
+        return [bah.fromuint(value, 8, endian=endian) for value in self._register_image]
+
+    @property
+    def register_image(self):
+        '''
+        The value of each physical register, as ``bytes``
+
+        '''
+        return bytes(self._register_image)
+
+    @property
+    def dirty_registers(self):
+        '''
+        The (sorted) addresses of the registers that have changed since
+        ``clear_dirty`` was last called
+
+        '''
+        dirty = self._dirty_registers
+        return [addr for addr in range(self.num_registers) if dirty >> addr & 1]
+
+    def clear_dirty(self, registers=None):
+        '''
+        Unmark registers as dirty
+
+        :param registers: the register addresses to unmark (default: all registers)
+
+        '''
+        if registers is None:
+            self._dirty_registers = 0
+        else:
+            for addr in registers:
+                self._dirty_registers &= ~(1 << addr)
+
+    def _update_register_image(self, register_name, index=None):
+        '''
+        Update the register image with the current value of a named
+        register (or of one element of a list-like register)
+
+        '''
+        value = getattr(self, '_'+register_name)
+        start_bit, end_bit = self.bit_map[register_name]
+        if isinstance(value, list):
+            n_bits = (end_bit - start_bit) // len(value)
+            if index is None:
+                items = enumerate(value)
+            else:
+                index %= len(value)
+                items = [(index, value[index])]
+        else:
+            n_bits = end_bit - start_bit
+            items = [(0, value)]
+        image = self._register_image
+        for idx, item_value in items:
+            bit = start_bit + idx * n_bits
+            item_value = int(item_value)
+            remaining = n_bits
+            while remaining > 0:
+                addr, shift = divmod(bit, 8)
+                width = min(remaining, 8 - shift)
+                mask = ((1 << width) - 1) << shift
+                register_value = (image[addr] & ~mask) | ((item_value << shift) & mask)
+                if register_value != image[addr]:
+                    image[addr] = register_value
+                    self._dirty_registers |= 1 << addr
+                item_value >>= width
+                remaining -= width
+                bit += width
 
     def from_dict_registers(self, d, endian='little'):
         '''
@@ -115,6 +189,7 @@ def _basic_setter(register_name):
     '''
     def basic_setter_func(self, value):
         setattr(self, '_'+register_name, value)
+        self._update_register_image(register_name)
     return basic_setter_func
 
 def _list_setter(register_name, min_value, max_value):
@@ -123,7 +198,9 @@ def _list_setter(register_name, min_value, max_value):
 
     '''
     def list_setter_func(self, value):
-        setattr(self, '_'+register_name, _Smart_List(value, min_value, max_value))
+        setattr(self, '_'+register_name, _Smart_List(value, min_value, max_value,
+            on_change=functools.partial(self._update_register_image, register_name)))
+        self._update_register_image(register_name)
     return list_setter_func
 
 # /Setter function formulas
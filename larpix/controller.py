@@ -1,18 +1,80 @@
 from collections import OrderedDict
 import warnings
 import time
+import asyncio
+import inspect
 import json
 import math
+import os
 import networkx as nx
+import numpy as np
 from copy import copy
 
 from . import configs
 from .key import Key
 from .chip import Chip
 from .configuration import Configuration_v1, Configuration_v2, Configuration_Lightpix_v1
-from .packet import Packet_v1, Packet_v2, PacketCollection
+from .packet import Packet_v1, Packet_v2, PacketCollection, PacketArray
+from .packet.packet_array import packet_array_dtype
 from . import bitarrayhelper as bah
 
+class _ConfigReadTracker(object):
+    '''
+    Keeps track of the outstanding (chip key, register) configuration
+    read requests and the latency of each received reply
+
+    '''
+    def __init__(self, packets):
+        self.start_time = time.time()
+        self.outstanding = set([
+            (packet.chip_key, packet.register_address) for packet in packets
+            if self._is_config_read(packet)])
+        self.n_requested = len(self.outstanding)
+        self.latency = dict()
+
+    @staticmethod
+    def _is_config_read(packet):
+        return hasattr(packet,'CONFIG_READ_PACKET') and packet.packet_type == packet.CONFIG_READ_PACKET
+
+    def update(self, packets):
+        '''
+        Mark the requests with a reply in ``packets`` as received
+
+        '''
+        now = time.time()
+        for packet in packets:
+            if not self._is_config_read(packet):
+                continue
+            request = (packet.chip_key, packet.register_address)
+            if request in self.outstanding:
+                self.outstanding.remove(request)
+                self.latency[request] = now - self.start_time
+
+    def is_complete(self):
+        return not self.outstanding
+
+    def stats(self):
+        '''
+        :returns: ``dict`` of the number of requests and received replies,
+            a ``list`` of the missing (chip key, register) replies, the
+            total elapsed time, and the reply latency statistics (min,
+            mean, median, and max) in seconds
+
+        '''
+        latency = np.array(list(self.latency.values()))
+        return dict(
+            requested=self.n_requested,
+            received=len(self.latency),
+            missing=list(self.outstanding),
+            elapsed=time.time() - self.start_time,
+            latency=dict(
+                min=latency.min(),
+                mean=latency.mean(),
+                median=np.median(latency),
+                max=latency.max()
+                ) if len(latency) else None
+            )
+
 class Controller(object):
     '''
     Controls a collection of LArPix Chip objects.
@@ -126,6 +188,19 @@ class Controller(object):
             for io_channel in io_channels:
                 controller.init_network(io_group, io_channel) # update configurations and write to chips
 
+    Asynchronous communications:
+
+    When used with an asynchronous io object (e.g. ``AsyncPACMAN_IO``), use the
+    ``async_send``, ``async_read``, ``async_multi_read_configuration``, and
+    ``async_verify_registers`` coroutines in place of their synchronous
+    counterparts. These wait using ``asyncio.sleep`` rather than ``time.sleep``,
+    so a single event loop can drive many io groups and run monitoring tasks
+    alongside data-taking.::
+
+        async def configure_and_verify(controller):
+            await controller.async_send(packets)
+            ok, diff = await controller.async_verify_registers(chip_key_register_pairs)
+
     Properties and attributes:
 
     - ``chips``: the ``Chip`` objects that the controller controls
@@ -137,9 +212,16 @@ class Controller(object):
     - ``network``: a collection of networkx directed graph objects representing
       the miso_us, miso_ds, and mosi connections between chips (not applicable
       for v1 asics)
+    - ``config_read_stats``: reply statistics of the most recent configuration
+      read with ``return_early=True`` (see ``multi_read_configuration``)
+    - ``config_write_stats``: the number of registers requested, the number
+      of packets sent, and the number of packets saved by only sending
+      changed registers, for the most recent configuration write (see
+      ``write_configuration``)
 
     '''
     network_names = ('miso_us', 'miso_ds', 'mosi')
+    _config_read_poll_interval = 0.01
 
     def __init__(self):
         self.chips = OrderedDict()
@@ -148,6 +230,8 @@ class Controller(object):
         self.nreads = 0
         self.io = None
         self.logger = None
+        self.config_read_stats = None
+        self.config_write_stats = None
 
     def __getitem__(self, key):
         '''
@@ -271,7 +355,8 @@ class Controller(object):
 
     def get_network_ids(self, io_group, io_channel, root_first_traversal=True):
         '''
-        Returns a list of chip ids in order of depth within the miso_us network
+        Returns a list of chip ids in order of depth within the miso_us
+        network (i.e. the flattened ``get_network_layers``)
 
         :param io_group: io group of network
 
@@ -280,18 +365,7 @@ class Controller(object):
         :param root_first_traversal: ``True`` to traverse network starting from root nodes then increasing in network depth, ``False`` to traverse network starting from nodes furthest from root nodes and then decreasing in network depth
 
         '''
-        subnetwork = self.network[io_group][io_channel]['miso_us']
-        ordered_ids = []
-
-        chip_ids = [chip_id for chip_id in subnetwork.nodes() if subnetwork.nodes[chip_id]['root']]
-
-        collected_chips = set(chip_ids)
-
-        while chip_ids:
-            for chip_id in chip_ids:
-                ordered_ids.append(chip_id)
-                collected_chips.add(chip_id)
-            chip_ids = [link[1] for link in subnetwork.out_edges(chip_ids) if not link[1] in collected_chips]
+        ordered_ids = [chip_id for layer in self.get_network_layers(io_group, io_channel) for chip_id in layer]
         if root_first_traversal:
             return ordered_ids
         return ordered_ids[::-1]
@@ -582,6 +656,65 @@ class Controller(object):
 
         return system_info['name']
 
+    def save_network(self, filename, name=None, networks=None, version=None):
+        '''
+        Saves the hydra io networks to the specified file using the hydra io
+        network configuration format with a
+        miso_us_uart_map/miso_ds_uart_map/mosi_uart_map specification. Each
+        node lists all of its links explicitly, so the file can be reloaded
+        with ``load_network`` regardless of the network geometry.
+
+        :param filename: File path to save configuration to
+
+        :param name: name of the configuration (optional, default is the file name)
+
+        :param networks: ``list`` of ``(io_group, io_channel)`` networks to save (optional, default is all networks)
+
+        :param version: asic version of the chips (optional, default is the version of the first chip)
+
+        '''
+        if name is None:
+            name = os.path.splitext(os.path.basename(filename))[0]
+        if version is None:
+            version = next(iter(self.chips.values())).asic_version if self.chips else 2
+        if networks is None:
+            networks = [(io_group, io_channel) for io_group in self.network for io_channel in self.network[io_group]]
+
+        network_spec = OrderedDict([
+            ('miso_us_uart_map', [0,1,2,3]),
+            ('miso_ds_uart_map', [0,1,2,3]),
+            ('mosi_uart_map', [0,1,2,3])
+            ])
+        for io_group, io_channel in networks:
+            subnetwork = self.network[io_group][io_channel]
+            chip_ids = self.get_network_ids(io_group, io_channel)
+            chip_ids += [chip_id for chip_id in subnetwork['miso_us'].nodes() if not chip_id in chip_ids]
+            nodes = list()
+            for chip_id in chip_ids:
+                node = OrderedDict(chip_id=chip_id)
+                if subnetwork['miso_us'].nodes[chip_id].get('root', False):
+                    node['root'] = True
+                us_links = list(subnetwork['miso_us'].out_edges(chip_id, data='uart'))
+                node['miso_us'] = [link[1] for link in us_links]
+                node['miso_us_uart_map'] = [link[2] for link in us_links]
+                ds_links = list(subnetwork['miso_ds'].out_edges(chip_id, data='uart'))
+                node['miso_ds'] = [link[1] for link in ds_links]
+                node['miso_ds_uart_map'] = [link[2] for link in ds_links]
+                mosi_links = list(subnetwork['mosi'].in_edges(chip_id, data='uart'))
+                node['mosi'] = [link[0] for link in mosi_links]
+                node['mosi_uart_map'] = [link[2] for link in mosi_links]
+                nodes.append(node)
+            network_spec.setdefault(str(io_group), OrderedDict())[str(io_channel)] = OrderedDict(nodes=nodes)
+
+        system_info = OrderedDict([
+            ('_config_type', 'controller'),
+            ('name', name),
+            ('asic_version', version),
+            ('network', network_spec)
+            ])
+        with open(filename, 'w') as of:
+            json.dump(system_info, of, indent=4)
+
     def load_controller(self, filename):
         '''
         Loads the specified file using the basic key, chip format
@@ -633,7 +766,9 @@ class Controller(object):
             controller.grow_network(io_group, io_channel, 'ext')
 
         This algorithim is limited to a regular geometry defined by the same
-        miso_uart_map/mosi_uart_map/usds_link_map for each chip.
+        miso_uart_map/mosi_uart_map/usds_link_map for each chip. See
+        ``grow_network_layers`` for a faster version that probes all links at
+        the same network depth at once.
 
         :param io_group: the io group designation for the network
 
@@ -668,13 +803,9 @@ class Controller(object):
                 continue
 
             # attempt to create next link
-            next_chip_id = chip_id_generator(self, io_group, io_channel)
+            next_chip_id = self._add_network_candidate(io_group, io_channel, curr_chip_id, idx,
+                miso_uart_map, mosi_uart_map, usds_link_map, chip_id_generator, version)
             next_chip_key = Key(io_group, io_channel, next_chip_id)
-            self.add_chip(next_chip_key, version=version)
-            self.add_network_link(io_group, io_channel, 'miso_us', (curr_chip_id, next_chip_id), miso_uart_map[idx])
-            self.add_network_link(io_group, io_channel, 'miso_ds', (next_chip_id, curr_chip_id), miso_uart_map[usds_link_map[idx]])
-            self.add_network_link(io_group, io_channel, 'mosi', (next_chip_id, curr_chip_id), mosi_uart_map[idx])
-            self.add_network_link(io_group, io_channel, 'mosi', (curr_chip_id, next_chip_id), mosi_uart_map[usds_link_map[idx]])
 
             # configure link and verify
             ok,diff = self.init_network_and_verify(io_group, io_channel, next_chip_id, retries=0, timeout=timeout, modify_mosi=modify_mosi, differential=differential)
@@ -690,6 +821,120 @@ class Controller(object):
 
         return network
 
+    def _add_network_candidate(self, io_group, io_channel, chip_id, idx,
+        miso_uart_map, mosi_uart_map, usds_link_map, chip_id_generator, version):
+        '''
+        Adds a new chip at position ``idx`` relative to ``chip_id`` and links
+        it into the network (see ``grow_network``)
+
+        :returns: the chip id of the new chip
+
+        '''
+        next_chip_id = chip_id_generator(self, io_group, io_channel)
+        next_chip_key = Key(io_group, io_channel, next_chip_id)
+        self.add_chip(next_chip_key, version=version)
+        self.add_network_link(io_group, io_channel, 'miso_us', (chip_id, next_chip_id), miso_uart_map[idx])
+        self.add_network_link(io_group, io_channel, 'miso_ds', (next_chip_id, chip_id), miso_uart_map[usds_link_map[idx]])
+        self.add_network_link(io_group, io_channel, 'mosi', (next_chip_id, chip_id), mosi_uart_map[idx])
+        self.add_network_link(io_group, io_channel, 'mosi', (chip_id, next_chip_id), mosi_uart_map[usds_link_map[idx]])
+        return next_chip_id
+
+    def grow_network_layers(self, io_group, io_channel, chip_id,
+        miso_uart_map=[3,0,1,2], mosi_uart_map=[0,1,2,3], usds_link_map=[2,3,0,1],
+        chip_id_generator=_default_chip_id_generator, timeout=0.01,
+        modify_mosi=False, differential=True, version=2, network_file=None
+        ):
+        '''
+        Batched version of ``grow_network``. Rather than probing one link at
+        a time, all available links of the current frontier of the network
+        are probed at once: each candidate is assigned a distinct chip id,
+        the initialization packets of all candidates are sent with a single
+        ``send`` and then verified with a single read back. Candidates that do
+        not respond are reset and removed, and the verified candidates form
+        the next frontier. Discovery time then scales with the depth of the
+        network rather than the number of possible links.
+
+        Candidates are initialized in the same order as ``grow_network``
+        would probe them, so if a chip can be reached from more than one
+        candidate link, it is assigned the id of the first.
+
+        If ``network_file`` is specified and exists, the ``io_group``,
+        ``io_channel`` network is loaded from the file (see
+        ``load_network``) rather than discovered. Only the chips and network
+        of this io channel are replaced, any other networks are kept.
+        Otherwise the discovered network is saved to ``network_file`` (see
+        ``save_network``) so that it can be reused later.
+
+        :param network_file: path to a hydra io network configuration file used to cache the discovered network (optional, one file per io channel)
+
+        See ``grow_network`` for a description of the other parameters.
+
+        :returns: the generated 'miso_us', 'miso_ds', and 'mosi' networks as a `dict`
+
+        '''
+        if network_file is not None and os.path.isfile(network_file):
+            self._load_subnetwork(network_file, io_group, io_channel, version=version)
+            return self.network[io_group][io_channel]
+
+        network = self.network[io_group][io_channel]
+        frontier = [chip_id]
+        while frontier:
+            candidates = list()
+            for curr_chip_id in frontier:
+                existing_uarts = [network['miso_us'].edges[edge]['uart'] for edge in network['miso_us'].out_edges(curr_chip_id)]
+                for idx in range(4):
+                    # don't try existing links
+                    if miso_uart_map[idx] in existing_uarts:
+                        continue
+                    candidates.append(self._add_network_candidate(io_group, io_channel, curr_chip_id, idx,
+                        miso_uart_map, mosi_uart_map, usds_link_map, chip_id_generator, version))
+            if not candidates:
+                break
+
+            # configure all candidate links and verify
+            packets = list()
+            keys_to_verify = OrderedDict()
+            for next_chip_id in candidates:
+                packets += self._init_network_packets(io_group, io_channel, next_chip_id, modify_mosi=modify_mosi, differential=differential)
+                keys_to_verify.update([(key, None) for key in self._init_network_keys(io_group, io_channel, next_chip_id)])
+            self.send(packets)
+            ok,diff = self.verify_network(list(keys_to_verify), timeout=timeout, return_early=True)
+
+            # remove candidates that did not respond
+            failed = [next_chip_id for next_chip_id in candidates if Key(io_group, io_channel, next_chip_id) in diff]
+            packets = list()
+            for next_chip_id in failed:
+                packets += self._reset_network_packets(io_group, io_channel, next_chip_id)
+            if packets:
+                self.send(packets)
+            for next_chip_id in failed:
+                self.remove_chip(Key(io_group, io_channel, next_chip_id))
+            frontier = [next_chip_id for next_chip_id in candidates if not next_chip_id in failed]
+
+        if network_file is not None:
+            self.save_network(network_file, networks=[(io_group, io_channel)])
+        return network
+
+    def _load_subnetwork(self, filename, io_group, io_channel, version=2):
+        '''
+        Loads the ``io_group``, ``io_channel`` network from a hydra io
+        network configuration file (see ``load_network``), replacing the
+        chips and network of this io channel only
+
+        '''
+        loaded = Controller()
+        loaded.load_network(filename, version=version)
+        if not io_channel in loaded.network.get(io_group, dict()):
+            raise RuntimeError('no network for io group {} io channel {} in {}'.format(io_group, io_channel, filename))
+        for chip_key in list(self.chips.keys()):
+            if chip_key.io_group == io_group and chip_key.io_channel == io_channel:
+                del self.chips[chip_key]
+        for chip_key, chip in loaded.chips.items():
+            if chip_key.io_group == io_group and chip_key.io_channel == io_channel:
+                self.chips[chip_key] = chip
+        self._create_network(io_group, io_channel, self.network_names)
+        self.network[io_group][io_channel] = loaded.network[io_group][io_channel]
+
     def init_network_and_verify(self, io_group=1, io_channel=1, chip_id=None, timeout=0.2, retries=10, modify_mosi=True, differential=True):
         '''
         Runs init network, verifying that registers are updated properly at each step
@@ -705,15 +950,7 @@ class Controller(object):
                     return ok,diff
             return ok,dict()
 
-        keys_to_verify = list()
-        if isinstance(chip_id,int):
-            keys_to_verify.append(Key(io_group,io_channel,chip_id))
-        for us_link in self.network[io_group][io_channel]['miso_us'].in_edges(chip_id):
-            if not isinstance(us_link[0], int):
-                continue
-            parent_chip_id = us_link[0]
-            keys_to_verify.append(Key(io_group, io_channel, parent_chip_id))
-
+        keys_to_verify = self._init_network_keys(io_group, io_channel, chip_id)
         if not keys_to_verify:
             return True,dict()
         print('init',io_group,io_channel,chip_id)
@@ -730,6 +967,102 @@ class Controller(object):
             print('Failed to verify network nodes {}'.format(diff.keys()))
         return ok,diff
 
+    def _init_network_keys(self, io_group, io_channel, chip_id):
+        '''
+        Returns the chip keys that are modified when initializing the
+        network node ``chip_id`` (i.e. the chip itself and its parents)
+
+        '''
+        keys = list()
+        if isinstance(chip_id,int):
+            keys.append(Key(io_group,io_channel,chip_id))
+        for us_link in self.network[io_group][io_channel]['miso_us'].in_edges(chip_id):
+            if not isinstance(us_link[0], int):
+                continue
+            parent_chip_id = us_link[0]
+            keys.append(Key(io_group, io_channel, parent_chip_id))
+        return keys
+
+    def get_network_layers(self, io_group, io_channel):
+        '''
+        Returns a list of the chip ids at each depth within the miso_us
+        network, starting with the root nodes. Each chip id appears once, at
+        its shallowest depth.
+
+        :param io_group: io group of network
+
+        :param io_channel: io channel of network
+
+        '''
+        subnetwork = self.network[io_group][io_channel]['miso_us']
+        layers = []
+
+        chip_ids = [chip_id for chip_id in subnetwork.nodes() if subnetwork.nodes[chip_id]['root']]
+        collected_chips = set(chip_ids)
+
+        while chip_ids:
+            layers.append(chip_ids)
+            chip_ids = [link[1] for link in subnetwork.out_edges(chip_ids) if not link[1] in collected_chips]
+            chip_ids = list(OrderedDict.fromkeys(chip_ids))
+            collected_chips.update(chip_ids)
+        return layers
+
+    def init_network_layers(self, networks=None, timeout=0.2, retries=10, modify_mosi=True, differential=True, verify=True):
+        '''
+        Initializes multiple Hydra io networks in parallel, one network depth
+        at a time. Each step initializes the chips at the same depth (see
+        ``get_network_layers``) of all of the specified networks with a
+        single ``send``, and then (if ``verify``) verifies the network
+        configuration of the whole layer with a single read back, retrying
+        the registers that do not match up to ``retries`` times. Bring-up time
+        then scales with the depth of the networks rather than the number of
+        chips.
+
+        Within a network, the packets for each chip are sent in the same
+        order as ``init_network``, so chips that still have the default
+        chip id are configured one after another.
+
+        :param networks: ``list`` of ``(io_group, io_channel)`` networks to initialize (optional, default is all networks)
+
+        :param timeout: how long to wait for the read back of each layer in seconds
+
+        :param retries: number of times to rewrite and verify registers that do not match
+
+        :param verify: ``True`` to verify each layer before initializing the next
+
+        :returns: 2-``tuple`` with same format as ``controller.verify_registers``, exits after the first layer that fails to verify
+
+        '''
+        if networks is None:
+            networks = [(io_group, io_channel) for io_group in self.network for io_channel in self.network[io_group]]
+        network_layers = [self.get_network_layers(io_group, io_channel) for io_group, io_channel in networks]
+        n_layers = max([len(layers) for layers in network_layers] + [0])
+        for depth in range(n_layers):
+            packets = []
+            keys_to_verify = OrderedDict()
+            for (io_group, io_channel), layers in zip(networks, network_layers):
+                if depth >= len(layers):
+                    continue
+                for chip_id in layers[depth]:
+                    packets += self._init_network_packets(io_group, io_channel, chip_id, modify_mosi=modify_mosi, differential=differential)
+                    keys_to_verify.update([(key, None) for key in self._init_network_keys(io_group, io_channel, chip_id)])
+            if packets:
+                self.send(packets)
+            if not verify or not keys_to_verify:
+                continue
+
+            ok,diff = self.verify_network(list(keys_to_verify), timeout=timeout, return_early=True)
+            for _ in range(retries):
+                if ok: break
+                self.multi_write_configuration([(chip_key, list(diff[chip_key].keys())) for chip_key in diff])
+                ok,diff = self.verify_registers([
+                    (chip_key, list(diff[chip_key].keys())) for chip_key in diff
+                ], timeout=timeout, return_early=True)
+            if not ok:
+                print('Failed to verify network nodes {}'.format(diff.keys()))
+                return ok,diff
+        return True,dict()
+
     def init_network(self, io_group=1, io_channel=1, chip_id=None, modify_mosi=True, differential=True):
         '''
         Configure a Hydra io node specified by chip_id, if none are specified,
@@ -743,13 +1076,20 @@ class Controller(object):
          - Write enable_mosi to chip chip_id (optional)
 
         '''
-        subnetwork = self.network[io_group][io_channel]
         if chip_id is None:
             chip_ids = self.get_network_ids(io_group, io_channel, root_first_traversal=True)
             for chip_id in chip_ids:
                 self.init_network(io_group, io_channel, chip_id=chip_id, modify_mosi=modify_mosi, differential=differential)
             return
+        self.send(self._init_network_packets(io_group, io_channel, chip_id, modify_mosi=modify_mosi, differential=differential))
 
+    def _init_network_packets(self, io_group, io_channel, chip_id, modify_mosi=True, differential=True):
+        '''
+        Updates the chip configurations to initialize the network node
+        ``chip_id`` and returns the packets to send (see ``init_network``)
+
+        '''
+        subnetwork = self.network[io_group][io_channel]
         packets = []
         chip_key = None
         if isinstance(chip_id, int):
@@ -796,7 +1136,7 @@ class Controller(object):
                     self[chip_key].config.enable_mosi[mosi_uart] = 1
                 packets += self[chip_key].get_configuration_write_packets(registers=self[chip_key].config.register_map['enable_mosi'])
 
-        self.send(packets)
+        return packets
 
     def reset_network(self, io_group=1, io_channel=1, chip_id=None):
         '''
@@ -812,14 +1152,27 @@ class Controller(object):
         from chips with no outgoing miso_us connections, working up the miso_us
         tree)
 
+        The last known register values of a reset chip (see
+        ``Chip.asic_registers``) are cleared, since the ASIC no longer
+        responds to its chip id.
+
         '''
-        subnetwork = self.network[io_group][io_channel]
         if chip_id is None:
             chip_keys = self.get_network_keys(io_group, io_channel, root_first_traversal=False)
             for chip_key in chip_keys:
                 self.reset_network(io_group, io_channel, chip_id=chip_key.chip_id)
             return
+        self.send(self._reset_network_packets(io_group, io_channel, chip_id))
+        if isinstance(chip_id, int) and Key(io_group, io_channel, chip_id) in self.chips:
+            self[Key(io_group, io_channel, chip_id)].asic_registers.clear()
+
+    def _reset_network_packets(self, io_group, io_channel, chip_id):
+        '''
+        Updates the chip configurations to reset the network node ``chip_id``
+        and returns the packets to send (see ``reset_network``)
 
+        '''
+        subnetwork = self.network[io_group][io_channel]
         packets = []
         chip_key = None
         if isinstance(chip_id, int):
@@ -846,9 +1199,9 @@ class Controller(object):
             parent_chip_key = Key(io_group, io_channel, parent_chip_id)
             parent_uart = subnetwork['miso_us'].edges[us_link]['uart']
             self[parent_chip_key].config.enable_miso_upstream[parent_uart] = 0
-            packets += self[parent_chip_key].get_configuration_write_packets(registers=self[chip_key].config.register_map['enable_miso_upstream'])
+            packets += self[parent_chip_key].get_configuration_write_packets(registers=self[parent_chip_key].config.register_map['enable_miso_upstream'])
 
-        self.send(packets)
+        return packets
 
 
     def send(self, packets):
@@ -859,11 +1212,48 @@ class Controller(object):
         timestamp = time.time()
         if self.io:
             self.io.send(packets)
+            self._update_asic_registers(packets, 'CONFIG_WRITE_PACKET')
+        else:
+            warnings.warn('no IO object exists, no packets sent', RuntimeWarning)
+        if self.logger:
+            self.logger.record(packets, direction=self.logger.WRITE)
+
+    async def async_send(self, packets):
+        '''
+        Asynchronous version of ``send``. The io object's ``send`` method is
+        awaited if it is a coroutine (e.g. ``AsyncPACMAN_IO``).
+
+        '''
+        if self.io:
+            await self._maybe_await(self.io.send(packets))
+            self._update_asic_registers(packets, 'CONFIG_WRITE_PACKET')
         else:
             warnings.warn('no IO object exists, no packets sent', RuntimeWarning)
         if self.logger:
             self.logger.record(packets, direction=self.logger.WRITE)
 
+    def _update_asic_registers(self, packets, packet_type):
+        '''
+        Record the register values of the configuration write (or read)
+        ``packets`` as the last known values on the ASICs of the chips in
+        the controller (see ``Chip.asic_registers``)
+
+        :param packet_type: ``'CONFIG_WRITE_PACKET'`` or ``'CONFIG_READ_PACKET'``
+
+        '''
+        for packet in packets:
+            if not (hasattr(packet, packet_type) and packet.packet_type == getattr(packet, packet_type)):
+                continue
+            chip = self.chips.get(packet.chip_key)
+            if chip is not None:
+                chip.asic_registers[packet.register_address] = packet.register_data
+
+    @staticmethod
+    async def _maybe_await(value):
+        if inspect.isawaitable(value):
+            return await value
+        return value
+
     def start_listening(self):
         '''
         Listen for packets to arrive.
@@ -884,7 +1274,7 @@ class Controller(object):
         else:
             warnings.warn('no IO object exists, you have done nothing', RuntimeWarning)
 
-    def read(self):
+    def read(self, as_array=False, raw=False, return_payload=False):
         '''
         Read any packets that have arrived and return (packets,
         bytestream) where bytestream is the bytes that were received.
@@ -893,20 +1283,101 @@ class Controller(object):
         last call to ``read`` or ``start_listening``, whichever was most
         recent.
 
+        If ``as_array`` is ``True``, the packets are instead returned as a
+        numpy structured array with the LArPix+HDF5 v2.3 ``packets`` dtype
+        (one row per packet, including the ``io_group``). This avoids
+        creating a python object for each packet, but requires an io
+        object that supports it (e.g. ``PACMAN_IO``). With
+        ``return_payload``, the raw packet word of each row is also
+        returned, as ``(packets, bytestream, payload)`` (see
+        ``PACMAN_IO.empty_queue``).
+
+        If ``raw`` is ``True``, the received messages are not parsed at all,
+        and a list of ``(io_group, message)`` tuples is returned (and
+        logged) in place of the packets. Use this together with an
+        ``HDF5Logger`` to store the raw messages at high rates, and convert
+        them to packets later (see ``hdf5format.convert_raw_file``).
+        Requires an io object that supports it (e.g. ``PACMAN_IO``).
+
         '''
         timestamp = time.time()
         packets = []
         bytestream = b''
+        payload = np.empty((0,), dtype='<u8')
+        if as_array:
+            packets = self._empty_packet_array()
+        if self.io:
+            if raw:
+                packets, bytestream = self.io.empty_queue(raw=True)
+            elif as_array and return_payload:
+                packets, bytestream, payload = self.io.empty_queue(as_array=True, return_payload=True)
+            elif as_array:
+                packets, bytestream = self.io.empty_queue(as_array=True)
+            else:
+                packets, bytestream = self.io.empty_queue()
+        else:
+            warnings.warn('no IO object exists, no packets will be received', RuntimeWarning)
+        if self.logger:
+            self.logger.record(packets, direction=self.logger.READ)
+        if return_payload:
+            return packets, bytestream, payload
+        return packets, bytestream
+
+    async def async_read(self, as_array=False, raw=False, return_payload=False):
+        '''
+        Asynchronous version of ``read``. The io object's ``empty_queue``
+        method is awaited if it is a coroutine (e.g. ``AsyncPACMAN_IO``).
+
+        '''
+        packets = []
+        bytestream = b''
+        payload = np.empty((0,), dtype='<u8')
+        if as_array:
+            packets = self._empty_packet_array()
         if self.io:
-            packets, bytestream = self.io.empty_queue()
+            if raw:
+                packets, bytestream = await self._maybe_await(self.io.empty_queue(raw=True))
+            elif as_array and return_payload:
+                packets, bytestream, payload = await self._maybe_await(
+                    self.io.empty_queue(as_array=True, return_payload=True))
+            elif as_array:
+                packets, bytestream = await self._maybe_await(self.io.empty_queue(as_array=True))
+            else:
+                packets, bytestream = await self._maybe_await(self.io.empty_queue())
         else:
             warnings.warn('no IO object exists, no packets will be received', RuntimeWarning)
         if self.logger:
             self.logger.record(packets, direction=self.logger.READ)
+        if return_payload:
+            return packets, bytestream, payload
         return packets, bytestream
 
+    @staticmethod
+    def _empty_packet_array():
+        # imported here since larpix.format depends on the larpix package
+        from .format.hdf5format import dtypes
+        return np.empty((0,), dtype=dtypes['2.3']['packets'])
+
+    @staticmethod
+    def _packet_array_data(rows, payload):
+        '''
+        Convert the ``Packet_v2`` rows of a LArPix+HDF5 v2.3 ``packets``
+        array and their raw packet words to ``PacketArray`` data
+
+        '''
+        mask = np.isin(rows['packet_type'], (Packet_v2.DATA_PACKET,
+            Packet_v2.TEST_PACKET, Packet_v2.CONFIG_WRITE_PACKET,
+            Packet_v2.CONFIG_READ_PACKET))
+        rows = rows[mask]
+        data = np.zeros(rows.shape, dtype=packet_array_dtype)
+        data['word'] = np.asarray(payload, dtype='<u8')[mask]
+        for name in ('io_group', 'io_channel', 'receipt_timestamp', 'direction'):
+            data[name] = rows[name]
+        return data
+
     def write_configuration(self, chip_key, registers=None, write_read=0,
-                            message=None, connection_delay=0.2):
+                            message=None, connection_delay=0.2,
+                            only_changed=False):
         '''
         Send the configurations stored in chip.config to the LArPix
         ASIC.
@@ -929,21 +1400,28 @@ class Controller(object):
         lot of data is expected, you should handle the reads manually
         and set write_read to 0 (default).
 
+        If ``only_changed`` is ``True``, only the registers whose value
+        differs from the last value written to (or read back from) the
+        ASIC are sent (see ``Chip.get_changed_registers``). The number of
+        packets saved is stored in ``config_write_stats``::
+
+            >>> controller.write_configuration(chip_key) # sends all registers
+            >>> chip.config.threshold_global = 40
+            >>> controller.write_configuration(chip_key, only_changed=True) # sends 1 register
+            >>> controller.config_write_stats
+            {'requested': 237, 'sent': 1, 'saved': 236}
+
         '''
         chip = self[chip_key]
-        if registers is None:
-            registers = list(range(chip.config.num_registers))
-        elif isinstance(registers, int):
-            registers = [registers]
-        elif isinstance(registers, str):
-            registers = list(chip.config.register_map[registers])
-        else:
-            pass
         if message is None:
             message = 'configuration write'
         else:
             message = 'configuration write: ' + message
+        registers, n_requested = self._write_configuration_registers(chip,
+            registers, only_changed)
         packets = chip.get_configuration_write_packets(registers)
+        self.config_write_stats = dict(requested=n_requested, sent=len(packets),
+            saved=n_requested - len(packets))
         already_listening = False
         if self.io:
             already_listening = self.io.is_listening
@@ -962,7 +1440,7 @@ class Controller(object):
             self.store_packets(packets, bytestream, message)
 
     def read_configuration(self, chip_key, registers=None, timeout=1,
-                           message=None, connection_delay=0.2):
+                           message=None, connection_delay=0.2, return_early=False):
         '''
         Send "configuration read" requests to the LArPix ASIC.
 
@@ -978,6 +1456,11 @@ class Controller(object):
         packet is sent out, and will save any received packets in the
         ``reads`` data member.
 
+        If ``return_early`` is ``True``, the io queue is polled and the
+        method returns as soon as a reply has been received for each
+        requested register, or after ``timeout`` seconds (also if the
+        controller is already listening). See ``multi_read_configuration``.
+
         '''
         chip = self[chip_key]
         if registers is None:
@@ -993,24 +1476,101 @@ class Controller(object):
         else:
             message = 'configuration read: ' + message
         packets = chip.get_configuration_read_packets(registers)
+        self._configuration_read(packets, timeout, message, connection_delay,
+            return_early)
+
+    def _configuration_read_steps(self, packets, timeout, message,
+                                  connection_delay, return_early):
+        '''
+        The steps of a configuration read (see ``multi_read_configuration``),
+        shared by ``_configuration_read`` and ``_async_configuration_read``.
+
+        This generator yields the io steps to run as ``('sleep', seconds)``,
+        ``('send', packets)``, or ``('read', None)``, and is sent the
+        ``(packets, bytestream)`` result of each ``'read'`` step. The
+        received packets are stored once all steps are done.
+
+        '''
         already_listening = False
         if self.io:
             already_listening = self.io.is_listening
         if not already_listening:
             self.start_listening()
-            time.sleep(connection_delay)
-            stop_time = time.time() + timeout
-        self.send(packets)
-        if not already_listening:
-            sleep_time = stop_time - time.time()
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-        packets, bytestream = self.read()
+            yield 'sleep', connection_delay
+        stop_time = time.time() + timeout
+        yield 'send', packets
+        if return_early:
+            tracker = _ConfigReadTracker(packets)
+            read_packets, bytestreams = list(), list()
+            while True:
+                new_packets, bytestream = yield 'read', None
+                tracker.update(new_packets)
+                read_packets.extend(new_packets)
+                bytestreams.append(bytestream)
+                sleep_time = stop_time - time.time()
+                if tracker.is_complete() or sleep_time <= 0:
+                    break
+                yield 'sleep', min(self._config_read_poll_interval, sleep_time)
+            packets, bytestream = read_packets, b''.join(bytestreams)
+            self.config_read_stats = tracker.stats()
+        else:
+            if not already_listening:
+                sleep_time = stop_time - time.time()
+                if sleep_time > 0:
+                    yield 'sleep', sleep_time
+            packets, bytestream = yield 'read', None
         self.stop_listening()
+        self._update_asic_registers(packets, 'CONFIG_READ_PACKET')
         self.store_packets(packets, bytestream, message)
 
+    def _configuration_read(self, packets, timeout, message, connection_delay,
+                            return_early):
+        '''
+        Send configuration read ``packets`` and store the replies (see
+        ``multi_read_configuration``)
+
+        '''
+        steps = self._configuration_read_steps(packets, timeout, message,
+            connection_delay, return_early)
+        result = None
+        while True:
+            try:
+                step, value = steps.send(result)
+            except StopIteration:
+                break
+            result = None
+            if step == 'sleep':
+                time.sleep(value)
+            elif step == 'send':
+                self.send(value)
+            else:
+                result = self.read()
+
+    async def _async_configuration_read(self, packets, timeout, message,
+                                        connection_delay, return_early):
+        '''
+        Asynchronous version of ``_configuration_read``
+
+        '''
+        steps = self._configuration_read_steps(packets, timeout, message,
+            connection_delay, return_early)
+        result = None
+        while True:
+            try:
+                step, value = steps.send(result)
+            except StopIteration:
+                break
+            result = None
+            if step == 'sleep':
+                await asyncio.sleep(value)
+            elif step == 'send':
+                await self.async_send(value)
+            else:
+                result = await self.async_read()
+
     def multi_write_configuration(self, chip_reg_pairs, write_read=0,
-                                  message=None, connection_delay=0.2):
+                                  message=None, connection_delay=0.2,
+                                  only_changed=False):
         '''
         Send multiple write configuration commands at once.
 
@@ -1034,25 +1594,31 @@ class Controller(object):
         >>> controller.multi_write_configuration([(chip_key1, 1), (chip_key2, 2), ...])
         >>> controller.multi_write_configuration([(chip_key1, range(10)), chip_key2, ...])
 
+        If ``only_changed`` is ``True``, only the registers that have
+        changed are sent to each chip (see ``write_configuration``).
+
+        >>> controller.multi_write_configuration(controller.chips, only_changed=True)
+        >>> controller.config_write_stats['saved'] # number of packets not sent
+
         '''
         if message is None:
             message = 'multi configuration write'
         else:
             message = 'multi configuration write: ' + message
         packets = []
+        n_requested = 0
         for chip_reg_pair in chip_reg_pairs:
             if not isinstance(chip_reg_pair, tuple):
                 chip_reg_pair = (chip_reg_pair, None)
             chip_key, registers = chip_reg_pair
             chip = self[chip_key]
-            if registers is None:
-                registers = list(range(chip.config.num_registers))
-            elif isinstance(registers, int):
-                registers = [registers]
-            else:
-                pass
+            registers, n_chip_requested = self._write_configuration_registers(
+                chip, registers, only_changed)
             one_chip_packets = chip.get_configuration_write_packets(registers)
             packets.extend(one_chip_packets)
+            n_requested += n_chip_requested
+        self.config_write_stats = dict(requested=n_requested, sent=len(packets),
+            saved=n_requested - len(packets))
         already_listening = False
         if self.io:
             already_listening = self.io.is_listening
@@ -1071,8 +1637,30 @@ class Controller(object):
             self.stop_listening()
             self.store_packets(packets, bytestream, message)
 
+    @staticmethod
+    def _write_configuration_registers(chip, registers, only_changed):
+        '''
+        Returns the registers of ``chip`` to write and the number of
+        registers requested (see ``write_configuration``)
+
+        '''
+        num_registers = chip.config.num_registers
+        if registers is None:
+            registers = list(range(num_registers))
+        elif isinstance(registers, int):
+            registers = [registers]
+        elif isinstance(registers, str):
+            registers = list(chip.config.register_map[registers])
+        else:
+            registers = list(registers)
+        n_requested = len(set(i for i in registers if 0 <= i < num_registers))
+        if only_changed:
+            registers = chip.get_changed_registers(registers)
+        return registers, n_requested
+
     def multi_read_configuration(self, chip_reg_pairs, timeout=1,
-                                 message=None, connection_delay=0.2):
+                                 message=None, connection_delay=0.2,
+                                 return_early=False):
         '''
         Send multiple read configuration commands at once.
 
@@ -1095,11 +1683,46 @@ class Controller(object):
         >>> controller.multi_read_configuration([(chip_key1, 1), (chip_key2, 2), ...])
         >>> controller.multi_read_configuration([(chip_key1, range(10)), chip_key2, ...])
 
+        By default, the controller waits for the full ``timeout`` before
+        reading the replies. If ``return_early`` is ``True``, the io queue is
+        instead polled and the method returns as soon as a reply has been
+        received for each requested (chip key, register), or after
+        ``timeout`` seconds (also if the controller is already listening).
+        Statistics on the replies (number received, missing requests, and
+        latency) are then stored in ``config_read_stats``.
+
+        >>> controller.multi_read_configuration([chip_key1, chip_key2], return_early=True)
+        >>> controller.config_read_stats['missing'] # [] if all replies were received
+
+        '''
+        if message is None:
+            message = 'multi configuration read'
+        else:
+            message = 'multi configuration read: ' + message
+        packets = self._multi_read_configuration_packets(chip_reg_pairs)
+        self._configuration_read(packets, timeout, message, connection_delay,
+            return_early)
+
+    async def async_multi_read_configuration(self, chip_reg_pairs, timeout=1,
+                                             message=None, connection_delay=0.2,
+                                             return_early=False):
+        '''
+        Asynchronous version of ``multi_read_configuration``.
+
         '''
         if message is None:
             message = 'multi configuration read'
         else:
             message = 'multi configuration read: ' + message
+        packets = self._multi_read_configuration_packets(chip_reg_pairs)
+        await self._async_configuration_read(packets, timeout, message,
+            connection_delay, return_early)
+
+    def _multi_read_configuration_packets(self, chip_reg_pairs):
+        '''
+        Returns the configuration read packets for ``multi_read_configuration``
+
+        '''
         packets = []
         for chip_reg_pair in chip_reg_pairs:
             if not isinstance(chip_reg_pair, tuple):
@@ -1114,43 +1737,45 @@ class Controller(object):
                 pass
             one_chip_packets = chip.get_configuration_read_packets(registers)
             packets += one_chip_packets
-        already_listening = False
-        if self.io:
-            already_listening = self.io.is_listening
-        if not already_listening:
-            self.start_listening()
-            time.sleep(connection_delay)
-            stop_time = time.time() + timeout
-        self.send(packets)
-        if not already_listening:
-            sleep_time = stop_time - time.time()
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-        packets, bytestream = self.read()
-        self.stop_listening()
-        self.store_packets(packets, bytestream, message)
+        return packets
 
-    def run(self, timelimit, message):
+    def run(self, timelimit, message, as_array=False):
         '''
         Read data from the LArPix ASICs for the given ``timelimit`` and
         associate the received Packets with the given ``message``.
 
+        If ``as_array`` is ``True``, data is read using
+        ``read(as_array=True)`` and the packets are stored as a
+        ``PacketArray`` rather than a ``PacketCollection`` of packet
+        objects (see ``store_packets``).
+
         '''
         sleeptime = min(0.1, timelimit)
         self.start_listening()
         start_time = time.time()
         packets = []
+        payloads = []
         bytestreams = []
         while time.time() - start_time < timelimit:
             time.sleep(sleeptime)
-            read_packets, read_bytestream = self.read()
-            packets.extend(read_packets)
+            if as_array:
+                read_packets, read_bytestream, read_payload = self.read(
+                    as_array=True, return_payload=True)
+                packets.append(read_packets)
+                payloads.append(read_payload)
+            else:
+                read_packets, read_bytestream = self.read()
+                packets.extend(read_packets)
             bytestreams.append(read_bytestream)
         self.stop_listening()
+        payload = None
+        if as_array:
+            packets = np.concatenate(packets) if packets else self._empty_packet_array()
+            payload = np.concatenate(payloads) if payloads else np.empty((0,), dtype='<u8')
         data = b''.join(bytestreams)
-        self.store_packets(packets, data, message)
+        self.store_packets(packets, data, message, payload=payload)
 
-    def verify_registers(self, chip_key_register_pairs, timeout=1, connection_delay=0.02):
+    def verify_registers(self, chip_key_register_pairs, timeout=1, connection_delay=0.02, return_early=False):
         '''
         Read chip configuration from specified chip and registers and return ``True`` if the
         read chip configuration matches the current configuration stored in chip instance.
@@ -1160,11 +1785,31 @@ class Controller(object):
 
         :param timeout: set how long to wait for response in seconds (optional)
 
+        :param return_early: return as soon as all registers have been read back (optional, see ``controller.multi_read_configuration``)
+
         :returns: 2-``tuple`` of a ``bool`` representing if all registers match and a ``dict`` representing all differences. Differences are specified as ``{<chip_key>: {<register>: (<expected>, <read>)}}``
 
         '''
-        return_value = True
-        different_fields = {}
+        registers = self._verify_registers_requested(chip_key_register_pairs)
+        self.multi_read_configuration(chip_key_register_pairs, timeout=timeout, connection_delay=connection_delay, return_early=return_early)
+        return self._verify_registers_compare(registers, self.reads[-1])
+
+    async def async_verify_registers(self, chip_key_register_pairs, timeout=1, connection_delay=0.02, return_early=False):
+        '''
+        Asynchronous version of ``verify_registers``.
+
+        '''
+        registers = self._verify_registers_requested(chip_key_register_pairs)
+        await self.async_multi_read_configuration(chip_key_register_pairs, timeout=timeout, connection_delay=connection_delay, return_early=return_early)
+        return self._verify_registers_compare(registers, self.reads[-1])
+
+    @staticmethod
+    def _verify_registers_requested(chip_key_register_pairs):
+        '''
+        Returns a ``dict`` of ``<chip_key>: [<register>, ...]`` from a list of
+        key register pairs
+
+        '''
         registers = {}
         for chip_key, chip_registers in chip_key_register_pairs:
             if not isinstance(chip_registers, (list,tuple,range)):
@@ -1177,13 +1822,21 @@ class Controller(object):
                     registers[chip_key] += list(chip_registers)
                 else:
                     registers[chip_key] = list(chip_registers)
-        self.multi_read_configuration(chip_key_register_pairs, timeout=timeout, connection_delay=connection_delay)
+        return registers
+
+    def _verify_registers_compare(self, registers, packets):
+        '''
+        Compares the configuration read ``packets`` to the expected value of
+        the requested ``registers`` (see ``verify_registers``)
+
+        '''
+        return_value = True
         configuration_data = dict([
             (chip_key, dict([
                 (register,(None, None))
                 for register in chip_registers]))
             for chip_key, chip_registers in registers.items()])
-        for packet in self.reads[-1]:
+        for packet in packets:
             packet_key = packet.chip_key
             if (hasattr(packet,'CONFIG_READ_PACKET') and packet.packet_type == packet.CONFIG_READ_PACKET):
                 register_address = packet.register_address
@@ -1207,7 +1860,7 @@ class Controller(object):
                 del configuration_data[chip_key]
         return (return_value, configuration_data)
 
-    def verify_configuration(self, chip_keys=None, timeout=1):
+    def verify_configuration(self, chip_keys=None, timeout=1, return_early=False):
         '''
         Read chip configuration from specified chip(s) and return ``True`` if the
         read chip configuration matches the current configuration stored in chip instance.
@@ -1221,6 +1874,8 @@ class Controller(object):
 
         :param timeout: how long to wait for response in seconds
 
+        :param return_early: return as soon as all registers have been read back (see ``controller.multi_read_configuration``)
+
         :returns: 2-``tuple`` with same format as ``controller.verify_registers``
 
         '''
@@ -1229,9 +1884,9 @@ class Controller(object):
         if isinstance(chip_keys,(str,Key)):
             chip_keys = [chip_keys]
         chip_key_register_pairs = [(chip_key, range(self[chip_key].config.num_registers)) for chip_key in chip_keys]
-        return self.verify_registers(chip_key_register_pairs, timeout=timeout)
+        return self.verify_registers(chip_key_register_pairs, timeout=timeout, return_early=return_early)
 
-    def verify_network(self, chip_keys=None, timeout=1):
+    def verify_network(self, chip_keys=None, timeout=1, return_early=False):
         '''
         Read chip network configuration from specified chip(s) and return ``True``
         if the read chip configurations matches
@@ -1241,6 +1896,8 @@ class Controller(object):
 
         :param timeout: how long to wait for response in seconds
 
+        :param return_early: return as soon as all registers have been read back (see ``controller.multi_read_configuration``)
+
         :returns: 2-``tuple`` with same format as ``controller.verify_registers``
 
         '''
@@ -1255,7 +1912,7 @@ class Controller(object):
             list(self[chip_key].config.register_map['enable_miso_downstream']) + \
             list(self[chip_key].config.register_map['enable_miso_differential']))
             for chip_key in chip_keys]
-        return self.verify_registers(chip_key_register_pairs)
+        return self.verify_registers(chip_key_register_pairs, timeout=timeout, return_early=return_early)
 
     def enable_analog_monitor(self, chip_key, channel):
         '''
@@ -1412,12 +2069,27 @@ class Controller(object):
             else:
                 raise RuntimeError('chip has invalid asic version')
 
-    def store_packets(self, packets, data, message):
+    def store_packets(self, packets, data, message, payload=None):
         '''
         Store the packets in ``self`` and in ``self.chips``
 
+        ``packets`` may also be a numpy structured array with the
+        LArPix+HDF5 v2.3 ``packets`` dtype (e.g. from
+        ``read(as_array=True, return_payload=True)``), which is stored as a
+        ``PacketArray`` of its ``Packet_v2`` rows. The timestamp, sync, and
+        trigger rows are not stored (but are still logged by ``read``).
+
+        :param payload: the raw packet word of each row of a ``packets``
+            array (required for arrays)
+
         '''
-        new_packets = PacketCollection(packets, data, message)
+        if isinstance(packets, np.ndarray):
+            if payload is None or len(payload) != len(packets):
+                raise ValueError('the raw packet words of each row are required'
+                    ' to store a packets array')
+            new_packets = PacketArray(self._packet_array_data(packets, payload), data, message)
+        else:
+            new_packets = PacketCollection(packets, data, message)
         new_packets.read_id = self.nreads
         self.nreads += 1
         self.reads.append(new_packets)
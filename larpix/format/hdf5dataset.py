@@ -0,0 +1,316 @@
+'''
+This module presents a set of LArPix+HDF5 files (e.g. the files of a
+long run written by ``HDF5Logger``) as a single ``packets`` table.
+
+The files are given as a list of filenames or glob patterns::
+
+    from larpix.format.hdf5dataset import HDF5Dataset
+
+    dataset = HDF5Dataset('run_1/datalog_*.h5')
+    print(len(dataset), dataset.headers[0]['created'])
+    rows = dataset[1000:2000] # rows may span several files
+
+    for rows in dataset.iter_chunks(packet_type=0):
+        ...
+
+The ``_header`` of each file, and the number of rows in its ``packets``
+dataset, is only read when it is needed. Iterating over the dataset
+only opens one file at a time, while indexing the dataset reads the
+headers of all of the files.
+
+The chunks of all of the files can also be read, or processed, by a
+pool of worker processes (see ``HDF5Dataset.iter_chunks`` and
+``HDF5Dataset.map``), and ``HDF5Dataset.to_virtual_file`` creates a
+LArPix+HDF5 file with an HDF5 virtual ``packets`` dataset that maps to
+the ``packets`` datasets of all of the files, which can be read by any
+HDF5 tool (or by ``larpix.format.hdf5format.from_file``).
+
+'''
+import glob
+import itertools
+import json
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+from larpix.format import hdf5format
+
+def _read_chunk(filename, start, end, version, selection):
+    '''
+    Read the (selected) ``packets`` rows between ``start`` and ``end`` of
+    a file
+
+    '''
+    chunks = list(hdf5format.iter_file(filename, chunk_size=end - start,
+        version=version, start=start, end=end, **selection))
+    with h5py.File(filename, 'r') as f:
+        return np.concatenate([np.empty((0,), dtype=f['packets'].dtype)] + chunks)
+
+def _map_chunk(func, filename, start, end, version, selection):
+    '''
+    Apply a function to the (selected) ``packets`` rows between ``start``
+    and ``end`` of a file
+
+    '''
+    return func(_read_chunk(filename, start, end, version, selection))
+
+class HDF5Dataset(object):
+    '''
+    A read-only view of the ``packets`` datasets of several LArPix+HDF5
+    files as a single table. Rows are numbered across all of the files,
+    in the order of ``filenames``.
+
+    Only version 2 files are supported, and all of the files must have
+    the same format version (or a version compatible with ``version``, see
+    ``larpix.format.hdf5format.from_file``).
+
+    :param files: a filename or glob pattern, or a list of filenames or
+        glob patterns. The filenames matched by each pattern are sorted.
+        An ``HDF5Logger`` run manifest (a ``.json`` file) is replaced by
+        the files that it lists.
+    :param version: the format version, with the same semantics as
+        ``larpix.format.hdf5format.from_file``
+
+    '''
+    def __init__(self, files, version=None):
+        if isinstance(files, str):
+            files = [files]
+        self.filenames = []
+        for pattern in files:
+            filenames = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    with open(filename) as f:
+                        manifest = json.load(f)
+                    self.filenames.extend([os.path.join(os.path.dirname(filename),
+                        entry['filename']) for entry in manifest['files']])
+                else:
+                    self.filenames.append(filename)
+        if not self.filenames:
+            raise FileNotFoundError('no files match {}'.format(files))
+        self.version = version
+        self._headers = [None] * len(self.filenames)
+        self._offsets = None
+
+    def __repr__(self):
+        return 'HDF5Dataset({!r})'.format(self.filenames)
+
+    def header(self, i):
+        '''
+        Read the header of a file (if it has not been read already)
+
+        :param i: the index of the file in ``filenames``
+        :returns: ``dict`` with the ``version``, ``created``, and
+            ``modified`` header attributes, the number of ``packets`` rows
+            (``'n_rows'``), and the HDF5 chunk size of the ``packets``
+            dataset (``'chunk_size'``, ``None`` if contiguous)
+
+        '''
+        if self._headers[i] is None:
+            with h5py.File(self.filenames[i], 'r') as f:
+                attrs = f['_header'].attrs
+                version = attrs['version']
+                if self.version is None:
+                    self.version = version
+                else:
+                    self.version = hdf5format._check_version(version, self.version)
+                if version[0] != '2':
+                    raise RuntimeError('HDF5Dataset requires LArPix+HDF5 v2 files')
+                dset = f['packets']
+                self._headers[i] = dict(
+                    version=version,
+                    created=attrs['created'],
+                    modified=attrs['modified'],
+                    n_rows=hdf5format._dset_length(dset),
+                    chunk_size=dset.chunks[0] if dset.chunks else None,
+                    )
+        return self._headers[i]
+
+    @property
+    def headers(self):
+        '''
+        The headers of all of the files (see ``header``)
+
+        '''
+        return [self.header(i) for i in range(len(self.filenames))]
+
+    @property
+    def offsets(self):
+        '''
+        The index of the first row of each file, followed by the total
+        number of rows
+
+        '''
+        if self._offsets is None:
+            self._offsets = np.cumsum([0] + [header['n_rows'] for header in self.headers])
+        return self._offsets
+
+    @property
+    def dtype(self):
+        '''
+        The dtype of the ``packets`` rows
+
+        '''
+        return np.dtype(hdf5format.dtypes[self.header(0)['version']]['packets'])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, key):
+        '''
+        Read rows of the table, by index or by slice (with a step of 1)
+
+        '''
+        if isinstance(key, slice):
+            start, end, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('HDF5Dataset only supports slices with a step of 1')
+            return self._read(start, end)
+        index = int(key)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('index {} out of range'.format(key))
+        return self._read(index, index + 1)[0]
+
+    def _read(self, start, end):
+        offsets = self.offsets
+        rows = [np.empty((0,), dtype=self.dtype)]
+        first = max(np.searchsorted(offsets, start, side='right') - 1, 0)
+        for i in range(first, len(self.filenames)):
+            if offsets[i] >= end:
+                break
+            file_start = max(start - offsets[i], 0)
+            file_end = min(end, offsets[i+1]) - offsets[i]
+            if file_end <= file_start:
+                continue
+            with h5py.File(self.filenames[i], 'r') as f:
+                rows.append(f['packets'][file_start:file_end])
+        return np.concatenate(rows)
+
+    def _chunk_ranges(self, chunk_size):
+        '''
+        Generate ``(file index, start, end)`` ranges of ``chunk_size``
+        rows, aligned to the HDF5 chunks of each file, reading each file
+        header as it is reached
+
+        '''
+        for i in range(len(self.filenames)):
+            header = self.header(i)
+            hdf5_chunk_size = header['chunk_size'] or 1
+            size = chunk_size or header['chunk_size'] or 2**16
+            size = int(math.ceil(size / hdf5_chunk_size)) * hdf5_chunk_size
+            for start in range(0, header['n_rows'], size):
+                yield i, start, min(start + size, header['n_rows'])
+
+    def iter_chunks(self, chunk_size=None, workers=None, **selection):
+        '''
+        Iterate over the rows of all of the files in chunks, in order.
+
+        :param chunk_size: the maximum number of rows in each chunk,
+            rounded up to a multiple of the HDF5 chunk size of each file
+            (default: the HDF5 chunk size or 65536 rows for contiguous
+            datasets). Chunks do not span files.
+        :param workers: the number of worker processes that read the
+            chunks in parallel, up to ``2 * workers`` chunks are read
+            ahead (default: ``None``, read in this process)
+        :param selection: selections of the rows to read, e.g.
+            ``packet_type`` or ``timestamp`` (see
+            ``larpix.format.hdf5format.iter_file``). Chunks without any
+            selected rows are skipped.
+        :yields: numpy structured arrays of rows
+
+        '''
+        if not workers:
+            for i, start, end in self._chunk_ranges(chunk_size):
+                rows = _read_chunk(self.filenames[i], start, end, self.version, selection)
+                if len(rows):
+                    yield rows
+            return
+        for rows in self._run(_read_chunk, chunk_size, workers, selection):
+            if len(rows):
+                yield rows
+
+    def map(self, func, chunk_size=None, workers=None, **selection):
+        '''
+        Apply a function to each chunk of rows of all of the files (see
+        ``iter_chunks``), e.g. to histogram the data of a run with one
+        worker process per core. Only the results are sent back from the
+        worker processes.
+
+        :param func: the function to apply to each numpy structured array
+            of rows. This must be picklable (e.g. a function defined at the
+            top level of a module) if ``workers`` is used.
+        :param workers: the number of worker processes (default: ``None``,
+            process the chunks in this process)
+        :yields: the result of ``func`` for each chunk, in order
+
+        See ``iter_chunks`` for the other parameters.
+
+        '''
+        if not workers:
+            for rows in self.iter_chunks(chunk_size=chunk_size, **selection):
+                yield func(rows)
+            return
+        for result in self._run(_map_chunk, chunk_size, workers, selection, func):
+            yield result
+
+    def _run(self, task, chunk_size, workers, selection, *args):
+        '''
+        Run a task on each chunk in a pool of worker processes, keeping at
+        most ``2 * workers`` chunks in flight
+
+        '''
+        # spawn workers, so that no HDF5 library state is shared with the
+        # worker processes
+        with ProcessPoolExecutor(max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn')) as pool:
+            ranges = self._chunk_ranges(chunk_size)
+            futures = [pool.submit(task, *(args + (self.filenames[i], start,
+                end, self.version, selection)))
+                for i, start, end in itertools.islice(ranges, 2 * workers)]
+            while futures:
+                result = futures.pop(0).result()
+                for i, start, end in itertools.islice(ranges, 1):
+                    futures.append(pool.submit(task, *(args + (self.filenames[i],
+                        start, end, self.version, selection))))
+                yield result
+
+    def to_virtual_file(self, filename):
+        '''
+        Create a LArPix+HDF5 file with a virtual ``packets`` dataset that
+        maps to the valid rows of the ``packets`` datasets of all of the
+        files (an HDF5 virtual dataset, which requires HDF5 1.10 or later).
+        No packet data is copied, so the files must stay in the same
+        location (relative to the virtual file). The ``created`` and
+        ``modified`` header attributes are the earliest creation and latest
+        modification times of the files, and the ``messages`` dataset is
+        left empty.
+
+        :param filename: the name of the file to create
+
+        '''
+        headers = self.headers
+        layout = h5py.VirtualLayout(shape=(len(self),), dtype=self.dtype)
+        directory = os.path.dirname(os.path.abspath(filename))
+        for i, header in enumerate(headers):
+            if not header['n_rows']:
+                continue
+            with h5py.File(self.filenames[i], 'r') as f:
+                shape = f['packets'].shape
+            source = h5py.VirtualSource(
+                os.path.relpath(os.path.abspath(self.filenames[i]), directory),
+                'packets', shape=shape, dtype=self.dtype)
+            layout[self.offsets[i]:self.offsets[i+1]] = source[:header['n_rows']]
+        with h5py.File(filename, 'w') as f:
+            file_header = f.create_group('_header')
+            file_header.attrs['version'] = self.version
+            file_header.attrs['created'] = min([header['created'] for header in headers])
+            file_header.attrs['modified'] = max([header['modified'] for header in headers])
+            f.create_virtual_dataset('packets', layout)
+            f.create_dataset('messages', shape=(0,),
+                dtype=hdf5format.dtypes[self.version]['messages'])
@@ -13,7 +13,11 @@ Packet-like objects and an HDF5 data file. ``from_file`` can be used to
 load up the full file all at once or just a subset of rows (supposing
 the full file was too big to fit in memory). To access the data most
 efficiently, do not rely on ``from_file`` and instead perform analysis
-directly on the HDF5 data file.
+directly on the HDF5 data file, or use ``iter_file`` to process the
+file one chunk of rows at a time. When the raw packet words are already
+available (e.g. from a PACMAN data stream), ``packet_array_from_payload``
+builds the ``packets`` dataset rows for many packets at once, and
+``to_file`` accepts these columns directly.
 
 File Header
 -----------
@@ -57,6 +61,51 @@ File Data
 The file data is saved in HDF5 datasets, and the specific data format
 depends on the LArPix+HDF5 version.
 
+The datasets can be written with any HDF5 chunk shape and compression
+filters (see ``to_file``), which are transparent to the reader. To avoid
+resizing a dataset on each write, it can also be allocated with more rows
+than it contains. In that case the number of valid rows is stored in the
+``n_rows`` attribute of the dataset, and any rows beyond it should be
+ignored. ``trim_file`` shrinks the datasets back to their valid rows.
+
+Raw messages
+^^^^^^^^^^^^
+
+Files of any version 2 format may also contain undecoded PACMAN data
+messages (e.g. written by ``HDF5Logger`` from ``Controller.read(raw=True)``).
+These are stored in two datasets:
+
+    - ``raw_messages``: the bytes (``u1``) of all messages, back-to-back
+
+    - ``raw_message_index``: one row per message (see
+      ``raw_message_dtype``) with the ``io_group`` of the message, the
+      ``receipt_time`` (``f8``, Unix time) at which it was logged, and the
+      ``start`` and ``length`` of the message within ``raw_messages``
+
+``convert_raw_file`` decodes the raw messages into the ``packets``
+dataset. The number of messages decoded so far is stored in the
+``decoded_raw_messages`` attribute of the ``packets`` dataset, so that
+converting the same file again only decodes messages that were added
+since.
+
+Packet index
+^^^^^^^^^^^^
+
+Files of any version 2 format may also contain a ``packet_index``
+dataset (written when ``to_file`` or ``HDF5Logger`` is given an
+``index_block_size``) so that the packets of specific chips or channels
+can be found without reading the full ``packets`` dataset. The
+``packets`` rows are split into blocks of ``block_size`` rows (an
+attribute of the ``packet_index`` dataset) and the index has one row
+(see ``packet_index_dtype``) for each combination of ``block``,
+``io_group``, ``io_channel``, ``chip_id``, and ``channel_id`` found in
+the block, with the number of matching packets (``count``) and their
+``timestamp_min`` and ``timestamp_max``. The same combination may appear
+more than once for a block if the block was written in several parts.
+The ``indexed_rows`` attribute gives the number of ``packets`` rows that
+are covered by the index. ``iter_file``, ``from_file``, and ``query_file``
+use the index to read only the blocks that contain selected packets.
+
 Version 2.3 description
 ^^^^^^^^^^^^^^^^^^^^^^^
 
@@ -307,6 +356,8 @@ MessagePacket packets to the console
 
 
 '''
+import contextlib
+import math
 import time
 
 import h5py
@@ -315,6 +366,7 @@ import struct
 
 from larpix.larpix import Packet_v1, Packet_v2, TimestampPacket, MessagePacket, SyncPacket, TriggerPacket
 from larpix.logger import Logger
+from larpix.key import Key
 
 #: The most recent / up-to-date LArPix+HDF5 format version
 latest_version = '2.3'
@@ -487,6 +539,29 @@ dtypes = {
             }
         }
 
+#: The dtype of the ``raw_message_index`` dataset (see "Raw messages")
+raw_message_dtype = np.dtype([
+        ('io_group', 'u1'),
+        ('receipt_time', 'f8'),
+        ('start', 'u8'),
+        ('length', 'u4'),
+        ])
+
+#: The dtype of the ``packet_index`` dataset (see "Packet index")
+packet_index_dtype = np.dtype([
+        ('block', 'u8'),
+        ('io_group', 'u1'),
+        ('io_channel', 'u1'),
+        ('chip_id', 'u1'),
+        ('channel_id', 'u1'),
+        ('count', 'u4'),
+        ('timestamp_min', 'u8'),
+        ('timestamp_max', 'u8'),
+        ])
+
+#: The ``packets`` columns used as keys of the ``packet_index`` dataset
+packet_index_keys = ('io_group', 'io_channel', 'chip_id', 'channel_id')
+
 #: A map between attribute name and "column index" in the structured
 #: dtypes.
 #:
@@ -764,8 +839,8 @@ def _parse_packets_v2_0(row, message_dset, *args, **kwargs):
             p.shared_fifo = row['shared_fifo']
             if row['fifo_diagnostics_enabled'] != 0:
                 p.fifo_diagnostics_enabled = True
-                p.local_fifo = row['local_fifo_events']
-                p.shared_fifo = row['shared_fifo_events']
+                p.local_fifo_events = row['local_fifo_events']
+                p.shared_fifo_events = row['shared_fifo_events']
                 p.timestamp = row['timestamp']
         elif p.packet_type in (Packet_v2.CONFIG_READ_PACKET, Packet_v2.CONFIG_WRITE_PACKET):
             p.register_address = row['register_address']
@@ -833,7 +908,144 @@ def _parse_packets_v2_3(row, message_dset, *args, **kwargs):
     if isinstance(p, Packet_v2):
         p.receipt_timestamp = row['receipt_timestamp']
     return p
-    
+
+def _payload_field(payload, bit_slice):
+    mask = np.uint64((1 << (bit_slice.stop - bit_slice.start)) - 1)
+    return (payload >> np.uint64(bit_slice.start)) & mask
+
+def _fill_packets_from_payload_v2_3(rows, payload, fifo_diagnostics_enabled=None):
+    '''
+    Fill the ``Packet_v2`` columns of a v2.3 ``packets`` array using the
+    raw 64-bit packet words, in the same way as ``_format_packets_packet_v2_3``
+    would for each individual packet
+
+    :param rows: v2.3 ``packets`` structured array to fill (modified in-place)
+    :param payload: ``u8`` array of little-endian packet words, same length as ``rows``
+    :param fifo_diagnostics_enabled: interpret data packets in FIFO diagnostics mode (default: ``Packet_v2.fifo_diagnostics_enabled``)
+
+    '''
+    if fifo_diagnostics_enabled is None:
+        fifo_diagnostics_enabled = Packet_v2.fifo_diagnostics_enabled
+    payload = np.asarray(payload, dtype='<u8')
+    for name in ('packet_type', 'chip_id', 'downstream_marker', 'parity',
+                 'channel_id', 'first_packet', 'dataword', 'trigger_type',
+                 'local_fifo', 'shared_fifo', 'register_address',
+                 'register_data'):
+        rows[name] = _payload_field(payload, getattr(Packet_v2, name + '_bits'))
+    if np.ndim(fifo_diagnostics_enabled):
+        # per-packet interpretation
+        fifo_diagnostics_enabled = np.asarray(fifo_diagnostics_enabled, dtype=bool)
+        rows['timestamp'] = np.where(fifo_diagnostics_enabled,
+            _payload_field(payload, Packet_v2.fifo_diagnostics_timestamp_bits),
+            _payload_field(payload, Packet_v2.timestamp_bits))
+        rows['local_fifo_events'] = np.where(fifo_diagnostics_enabled,
+            _payload_field(payload, Packet_v2.local_fifo_events_bits), 0)
+        rows['shared_fifo_events'] = np.where(fifo_diagnostics_enabled,
+            _payload_field(payload, Packet_v2.shared_fifo_events_bits), 0).astype('u1')
+        rows['fifo_diagnostics_enabled'] = fifo_diagnostics_enabled
+    elif fifo_diagnostics_enabled:
+        rows['timestamp'] = _payload_field(payload, Packet_v2.fifo_diagnostics_timestamp_bits)
+        rows['local_fifo_events'] = _payload_field(payload, Packet_v2.local_fifo_events_bits)
+        rows['shared_fifo_events'] = _payload_field(payload, Packet_v2.shared_fifo_events_bits).astype('u1')
+        rows['fifo_diagnostics_enabled'] = 1
+    else:
+        rows['timestamp'] = _payload_field(payload, Packet_v2.timestamp_bits)
+    # a packet has valid (odd) parity if the full 64-bit word has an odd number of set bits
+    parity = payload.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        parity ^= parity >> np.uint64(shift)
+    rows['valid_parity'] = parity & np.uint64(1)
+    return rows
+
+def _payload_array(payload):
+    '''
+    Interpret ``payload`` as an array of little-endian 64-bit packet words.
+    Accepts integer arrays, 8-byte ``S8``/``V8`` arrays, or raw bytes.
+
+    '''
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return np.frombuffer(payload, dtype='<u8')
+    payload = np.asarray(payload)
+    if payload.dtype.kind in ('S', 'V'):
+        if payload.dtype.itemsize != 8:
+            raise ValueError('packet payloads must be 8 bytes')
+        return np.ascontiguousarray(payload).view('<u8')
+    return payload.astype('<u8', copy=False)
+
+def packet_array_from_payload(payload, io_group=0, io_channel=0,
+        receipt_timestamp=0, direction=0, fifo_diagnostics_enabled=None):
+    '''
+    Build a LArPix+HDF5 v2.3 ``packets`` array directly from raw
+    ``Packet_v2`` words, without creating any packet objects. The packet
+    fields are extracted from the words using bit masks, and the result is
+    identical to formatting the equivalent ``Packet_v2`` objects with
+    ``to_file``.
+
+    The additional columns may be given as scalars (applied to every
+    packet) or as arrays with the same length as ``payload``.
+
+    :param payload: the 64-bit packet words, either as an integer array, an ``S8``/``V8`` array of little-endian packet bytes (e.g. ``Packet_v2.bytes()``), or a ``bytes`` object of concatenated packet bytes
+    :param io_group: io group of each packet (default: ``0``)
+    :param io_channel: io channel of each packet (default: ``0``)
+    :param receipt_timestamp: PACMAN receipt timestamp of each packet (default: ``0``)
+    :param direction: direction of each packet (default: ``0``)
+    :param fifo_diagnostics_enabled: interpret data packets in FIFO diagnostics mode, either for all or per packet (default: ``Packet_v2.fifo_diagnostics_enabled``)
+    :returns: numpy structured array with the v2.3 ``packets`` dtype
+
+    '''
+    payload = _payload_array(payload)
+    packets = np.zeros(payload.shape, dtype=dtypes['2.3']['packets'])
+    _fill_packets_from_payload_v2_3(packets, payload, fifo_diagnostics_enabled)
+    packets['io_group'] = io_group
+    packets['io_channel'] = io_channel
+    packets['receipt_timestamp'] = receipt_timestamp
+    packets['direction'] = direction
+    return packets
+
+def _packet_array_from_columns(columns, version):
+    '''
+    Build a ``packets`` array from a columnar representation, i.e. a
+    ``dict`` of equal length arrays or a structured array. If a
+    ``'payload'`` column is present, the packet fields are decoded from the
+    raw words (see ``packet_array_from_payload``). Any other columns with a
+    name from the ``packets`` dtype are copied as-is.
+
+    '''
+    if isinstance(columns, np.ndarray):
+        names = columns.dtype.names
+    else:
+        names = tuple(columns.keys())
+    packet_dtype = np.dtype(dtypes[version]['packets'])
+    unknown = [name for name in names if name != 'payload'
+        and name not in packet_dtype.names]
+    if unknown:
+        raise ValueError('unknown LArPix+HDF5 v%s packets columns %s' %
+            (version, unknown))
+    if 'payload' in names:
+        if version != '2.3':
+            raise ValueError('packets can only be built from payloads for '
+                'LArPix+HDF5 v2.3')
+        packets = packet_array_from_payload(columns['payload'])
+    else:
+        length = len(columns[names[0]]) if names else 0
+        packets = np.zeros((length,), dtype=packet_dtype)
+    for name in names:
+        if name in packet_dtype.names:
+            packets[name] = columns[name]
+    return packets
+
+def _packet_v2_array(packets):
+    '''
+    Format a list of ``Packet_v2`` objects into a v2.3 ``packets`` array
+    from their raw words
+
+    '''
+    return packet_array_from_payload(b''.join([packet.bytes() for packet in packets]),
+        io_group=[packet.io_group or 0 for packet in packets],
+        io_channel=[packet.io_channel or 0 for packet in packets],
+        receipt_timestamp=[getattr(packet, 'receipt_timestamp', 0) or 0 for packet in packets],
+        direction=[getattr(packet, 'direction', 0) or 0 for packet in packets],
+        fifo_diagnostics_enabled=[packet.fifo_diagnostics_enabled for packet in packets])
 
 # A map between packet class and the formatting method used to convert to structured
 # dtypes.
@@ -927,15 +1139,26 @@ _parse_method_lookup = {
     }    
 }
 
-def to_file(filename, packet_list, mode='a', version=None):
+def to_file(filename, packet_list, mode='a', version=None, chunks=None,
+        compression=None, compression_opts=None, shuffle=False,
+        capacity=None, growth_factor=None, index_block_size=None):
     '''
     Save the given packets to the given file.
 
     This method can be used to update an existing file.
 
-    :param filename: the name of the file to save to
+    :param filename: the name of the file to save to, or an ``h5py.File``
+        opened for writing (which is left open)
     :param packet_list: any iterable of objects of type ``Packet`` or
-        ``TimestampPacket``.
+        ``TimestampPacket``. Numpy structured arrays with the same dtype
+        as the ``packets`` dataset (e.g. from
+        ``pacman_msg_format.parse_to_array``) may also be given, either
+        directly or as elements of the iterable, and are written as-is.
+        Columnar data (a ``dict`` of arrays or a structured array) with a
+        ``'payload'`` column of raw packet words and, optionally, other
+        ``packets`` columns such as ``io_group``, ``io_channel``, and
+        ``receipt_timestamp`` is converted in bulk (see
+        ``packet_array_from_payload``).
     :param mode: optional, the "file mode" to open the data file
         (default: ``'a'``)
     :param version: optional, the LArPix+HDF5 format version to use. If
@@ -945,9 +1168,76 @@ def to_file(filename, packet_list, mode='a', version=None):
         version will be used. If writing an existing file and version
         is specified and does not exactly match the existing file's
         version, a ``RuntimeError`` will be raised. (default: ``None``)
+    :param chunks: optional, the HDF5 chunk shape (number of rows) of
+        new datasets (default: ``None``, chosen by h5py)
+    :param compression: optional, the compression filter of new datasets,
+        e.g. ``'gzip'`` or ``'lzf'`` (default: ``None``)
+    :param compression_opts: optional, the compression filter settings of
+        new datasets, e.g. the ``'gzip'`` level (default: ``None``)
+    :param shuffle: optional, ``True`` to apply the HDF5 shuffle filter to
+        new datasets, which usually improves the compression ratio
+        (default: ``False``)
+    :param capacity: optional, the number of rows to allocate when
+        creating a new ``packets`` dataset (default: ``None``)
+    :param growth_factor: optional, when the datasets need to be resized,
+        grow them to at least ``growth_factor`` times their current size
+        rather than to the exact size needed. The number of valid rows is
+        kept in the ``n_rows`` dataset attribute until the file is trimmed
+        with ``trim_file`` (default: ``None``, resize exactly)
+    :param index_block_size: optional, create a ``packet_index`` dataset
+        (see "Packet index") with blocks of this many rows, or ``True``
+        to use the HDF5 chunk size of the ``packets`` dataset. The rows
+        already in the file are indexed when the index is created. If
+        the file already has an index, it is always updated and this
+        parameter is ignored. Only supported for version 2 files
+        (default: ``None``, no index)
 
     '''
-    with h5py.File(filename, mode) as f:
+    with FileWriter(filename, mode=mode, version=version, chunks=chunks,
+            compression=compression, compression_opts=compression_opts,
+            shuffle=shuffle, capacity=capacity,
+            growth_factor=growth_factor,
+            index_block_size=index_block_size) as writer:
+        writer.write(packet_list)
+
+class FileWriter(object):
+    '''
+    Appends packets to a LArPix+HDF5 file that is kept open between
+    writes. The file header is checked, and the datasets and formatting
+    methods are looked up, once when the writer is created, so that each
+    ``write`` only formats and appends the new rows. ``to_file`` is
+    equivalent to creating a writer, writing once, and closing it.
+
+    Data is handed to the HDF5 library on each ``write``, but is only
+    guaranteed to be on disk after ``flush`` or ``close``. The writer can
+    be used as a context manager, which closes the writer on exit.
+
+    :param filename: the name of the file to write to, or an ``h5py.File``
+        opened for writing (which is left open by ``close``)
+
+    See ``to_file`` for a description of the other parameters.
+
+    '''
+    def __init__(self, filename, mode='a', version=None, chunks=None,
+            compression=None, compression_opts=None, shuffle=False,
+            capacity=None, growth_factor=None, index_block_size=None):
+        if isinstance(filename, h5py.File):
+            self.file = filename
+            self._owns_file = False
+        else:
+            self.file = h5py.File(filename, mode)
+            self._owns_file = True
+        self.growth_factor = growth_factor
+        try:
+            self._setup(version, _dataset_options(chunks, compression,
+                compression_opts, shuffle), capacity)
+            self._setup_index(index_block_size)
+        except Exception:
+            self.close()
+            raise
+
+    def _setup(self, version, dset_options, capacity):
+        f = self.file
         # Create header
         if '_header' not in f.keys():
             header = f.create_group('_header')
@@ -964,32 +1254,21 @@ def to_file(filename, packet_list, mode='a', version=None):
                 raise RuntimeError('Incompatible versions: existing: %s, '
                     'specified: %s' % (file_version, version))
         header.attrs['modified'] = time.time()
+        self.header = header
+        self.version = version
 
         # Create datasets
         if version == '0.0':
             packet_dset_name = 'raw_packet'
         else:
             packet_dset_name = 'packets'
-            direction_index = (
-                    dtype_property_index_lookup[version]['packets']
-                    ['direction'])
-            if version[0] == '2':
-                packet_type_index = (
-                        dtype_property_index_lookup[version]['packets']
-                        ['packet_type'])
-                fifo_diagnostics_enabled_index = (
-                        dtype_property_index_lookup[version]['packets']
-                        ['fifo_diagnostics_enabled'])
-                trigger_type_index = (
-                        dtype_property_index_lookup[version]['packets']
-                        ['trigger_type'])
-                dataword_index = (
-                        dtype_property_index_lookup[version]['packets']
-                        ['dataword'])
         packet_dtype = dtypes[version][packet_dset_name]
         if packet_dset_name not in f.keys():
-            packet_dset = f.create_dataset(packet_dset_name, shape=(len(packet_list),),
-                    maxshape=(None,), dtype=packet_dtype)
+            packet_dset = f.create_dataset(packet_dset_name,
+                    shape=(capacity or 0,), maxshape=(None,),
+                    dtype=packet_dtype, **dset_options)
+            if capacity:
+                packet_dset.attrs['n_rows'] = 0
             if version[0] == '1' or version[0] == '2':
                 if version[-1] == '2' and version[0] == '2':
                     packet_dset.attrs['packet_types'] = '''
@@ -1011,44 +1290,615 @@ def to_file(filename, packet_list, mode='a', version=None):
 4: 'timestamp',
 5: 'message',
 '''
-            start_index = 0
         else:
             packet_dset = f[packet_dset_name]
-            start_index = packet_dset.shape[0]
-            packet_dset.resize(start_index + len(packet_list), axis=0)
+        self.packet_dset = packet_dset
+        self.packet_dtype = np.dtype(packet_dtype)
+        self.n_packets = _dset_length(packet_dset)
+        self._packet_format_methods = _format_method_lookup[version].get(packet_dset_name, dict())
+        self._packet_dset_name = packet_dset_name
+
+        self._dset_options = dset_options
+        self.raw_dset = f.get('raw_messages')
+        self.raw_index_dset = f.get('raw_message_index')
+        self.n_raw_messages = _dset_length(self.raw_index_dset) if self.raw_index_dset is not None else 0
+        self.n_raw_bytes = _dset_length(self.raw_dset) if self.raw_dset is not None else 0
+
+        self.message_dset = None
+        self.n_messages = 0
+        self._message_format_methods = dict()
         if version != '0.0':
             message_dset_name = 'messages'
             message_dtype = dtypes[version][message_dset_name]
             if message_dset_name not in f.keys():
-                message_dset = f.create_dataset(message_dset_name,
+                self.message_dset = f.create_dataset(message_dset_name,
                         shape=(0,), maxshape=(None,),
-                        dtype=message_dtype)
-                message_start_index = 0
+                        dtype=message_dtype, **dset_options)
             else:
-                message_dset = f[message_dset_name]
-                message_start_index = message_dset.shape[0]
-
-        # Fill dataset
+                self.message_dset = f[message_dset_name]
+            self.n_messages = _dset_length(self.message_dset)
+            self._message_format_methods = _format_method_lookup[version].get(message_dset_name, dict())
+
+    def _setup_index(self, block_size):
+        self.index_dset = self.file.get('packet_index')
+        if self.index_dset is None and block_size:
+            if self.version[0] != '2':
+                raise RuntimeError('packet index requires a LArPix+HDF5 v2 file')
+            if block_size is True:
+                block_size = self.packet_dset.chunks[0] if self.packet_dset.chunks else 2**12
+            self.index_dset = self.file.create_dataset('packet_index',
+                shape=(0,), maxshape=(None,), dtype=packet_index_dtype,
+                **self._dset_options)
+            self.index_dset.attrs['block_size'] = block_size
+            self.index_dset.attrs['indexed_rows'] = 0
+        if self.index_dset is None:
+            return
+        self.n_index_rows = _dset_length(self.index_dset)
+        # index any rows that are not covered yet
+        indexed_rows = int(self.index_dset.attrs['indexed_rows'])
+        block_size = int(self.index_dset.attrs['block_size'])
+        for start in range(indexed_rows, self.n_packets, block_size):
+            end = min(start + block_size, self.n_packets)
+            self._update_index(self.packet_dset[start:end], start)
+
+    def _update_index(self, rows, first_row):
+        '''
+        Append the ``packet_index`` rows of new ``packets`` rows
+
+        '''
+        index = _index_rows(rows, first_row,
+            int(self.index_dset.attrs['block_size']))
+        _resize_dset(self.index_dset, self.n_index_rows + len(index),
+            self.growth_factor)
+        self.index_dset[self.n_index_rows:self.n_index_rows + len(index)] = index
+        self.n_index_rows += len(index)
+        self.index_dset.attrs['indexed_rows'] = first_row + len(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, packet_list):
+        '''
+        Append the given packets to the file (see ``to_file``)
+
+        '''
+        if isinstance(packet_list, (np.ndarray, dict)):
+            packet_list = [packet_list]
+        version = self.version
+        packet_dtype = self.packet_dtype
+        packet_format_methods = self._packet_format_methods
+        message_format_methods = self._message_format_methods
+
+        packet_chunks = []
         encoded_packets = []
+        v2_packets = []
         messages = []
-        for i, packet in enumerate(packet_list):
-            if packet.__class__ in _format_method_lookup[version].get(packet_dset_name, tuple()):
-                encoded_packet = _format_method_lookup[version][packet_dset_name][packet.__class__](packet)
+        def flush_encoded():
+            if encoded_packets:
+                packet_chunks.append(np.array(encoded_packets, dtype=packet_dtype))
+                del encoded_packets[:]
+            if v2_packets:
+                packet_chunks.append(_packet_v2_array(v2_packets))
+                del v2_packets[:]
+        for packet in packet_list:
+            if isinstance(packet, (np.ndarray, dict)):
+                if isinstance(packet, dict) or (packet.dtype.names
+                        and 'payload' in packet.dtype.names):
+                    packet = _packet_array_from_columns(packet, version)
+                elif packet.dtype != packet_dtype:
+                    raise ValueError('packet array dtype does not match '
+                        'LArPix+HDF5 v%s %s' % (version, self._packet_dset_name))
+                flush_encoded()
+                packet_chunks.append(packet)
+                continue
+
+            if version == '2.3' and packet.__class__ is Packet_v2:
+                # formatted in bulk from the raw packet words
+                if encoded_packets:
+                    flush_encoded()
+                v2_packets.append(packet)
+                continue
+
+            if packet.__class__ in packet_format_methods:
+                if v2_packets:
+                    flush_encoded()
+                encoded_packet = packet_format_methods[packet.__class__](packet)
                 for idx in range(len(encoded_packet)):
                     if encoded_packet[idx] is None:
                         encoded_packet[idx] = 0
                 encoded_packets.append(tuple(encoded_packet))
 
-            if version != '0.0' and packet.__class__ in _format_method_lookup[version].get(message_dset_name, tuple()):
-                encoded_message = _format_method_lookup[version][message_dset_name][packet.__class__](packet, counter=message_start_index + len(messages))
+            if packet.__class__ in message_format_methods:
+                encoded_message = message_format_methods[packet.__class__](packet, counter=self.n_messages + len(messages))
                 messages.append(encoded_message)
+        flush_encoded()
+
+        n_packets = sum([len(chunk) for chunk in packet_chunks])
+        start_index = self.n_packets
+        if n_packets:
+            _resize_dset(self.packet_dset, start_index + n_packets, self.growth_factor)
+        for chunk in packet_chunks:
+            self.packet_dset[start_index:start_index + len(chunk)] = chunk
+            if self.index_dset is not None:
+                self._update_index(chunk, start_index)
+            start_index += len(chunk)
+        self.n_packets = start_index
+        if messages:
+            _resize_dset(self.message_dset, self.n_messages + len(messages),
+                self.growth_factor)
+            self.message_dset[self.n_messages:self.n_messages
+                + len(messages)] = messages
+            self.n_messages += len(messages)
+
+    def write_raw_messages(self, messages, io_groups, receipt_time=None):
+        '''
+        Append undecoded PACMAN messages to the ``raw_messages`` datasets
+        (see "Raw messages"), creating them if needed
+
+        :param messages: list of message ``bytes``
+        :param io_groups: io group of each message
+        :param receipt_time: receipt time of each message, or of all messages (default: now)
+
+        '''
+        if not messages:
+            return
+        if self.version[0] != '2':
+            raise RuntimeError('raw messages require a LArPix+HDF5 v2 file')
+        if self.raw_dset is None:
+            options = dict(self._dset_options, chunks=(2**16,))
+            self.raw_dset = self.file.create_dataset('raw_messages',
+                shape=(0,), maxshape=(None,), dtype='u1', **options)
+            self.raw_index_dset = self.file.create_dataset('raw_message_index',
+                shape=(0,), maxshape=(None,), dtype=raw_message_dtype,
+                **self._dset_options)
+        data = np.frombuffer(b''.join(messages), dtype='u1')
+        index = np.zeros((len(messages),), dtype=raw_message_dtype)
+        index['io_group'] = io_groups
+        index['receipt_time'] = time.time() if receipt_time is None else receipt_time
+        index['length'] = [len(message) for message in messages]
+        index['start'] = self.n_raw_bytes + np.cumsum(index['length']) - index['length']
+
+        _resize_dset(self.raw_dset, self.n_raw_bytes + len(data), self.growth_factor)
+        self.raw_dset[self.n_raw_bytes:self.n_raw_bytes + len(data)] = data
+        self.n_raw_bytes += len(data)
+        _resize_dset(self.raw_index_dset, self.n_raw_messages + len(index), self.growth_factor)
+        self.raw_index_dset[self.n_raw_messages:self.n_raw_messages + len(index)] = index
+        self.n_raw_messages += len(index)
+
+    def flush(self):
+        '''
+        Update the file modification time and flush all written data to disk
+
+        '''
+        if not self.file:
+            return
+        self.header.attrs['modified'] = time.time()
+        self.file.flush()
+
+    def close(self):
+        '''
+        Flush and close the file (if it was opened by the writer)
+
+        '''
+        if not self.file:
+            return
+        if hasattr(self, 'header'):
+            self.flush()
+        if self._owns_file:
+            self.file.close()
+
+def convert_raw_file(filename, output_filename=None, chunk_size=4096,
+        direction=1, **kwargs):
+    '''
+    Decode the raw PACMAN messages of a file (see "Raw messages") into
+    ``packets`` rows, in the same way as
+    ``larpix.format.pacman_msg_format.parse_to_array``. The messages are
+    read and decoded ``chunk_size`` messages at a time, with all of the
+    messages of a chunk decoded at once.
+
+    The number of decoded messages is kept in the ``decoded_raw_messages``
+    attribute of the output ``packets`` dataset and decoding resumes from
+    there, so running the conversion again with the same output does not
+    duplicate any packets (only messages added since are decoded). If a
+    different input file is converted into the same output, the
+    attribute is not meaningful and a new output file should be used.
+
+    :param filename: the name of the file with raw messages
+    :param output_filename: the name of the file to write the packets to
+        (optional, default: append the packets to the input file)
+    :param chunk_size: the number of messages to decode at a time
+        (optional, default: ``4096``)
+    :param direction: the ``direction`` of the decoded packets (optional,
+        default: ``1``, i.e. ``Logger.READ``)
+    :param kwargs: additional options passed to ``FileWriter`` (e.g.
+        ``compression``)
+    :returns: the number of packet rows written (``0`` if there were no new messages)
 
-        packet_dset[start_index:] = encoded_packets
-        if version != '0.0':
-            message_dset.resize(message_start_index + len(messages), axis=0)
-            message_dset[message_start_index:] = messages
+    '''
+    # imported here since pacman_msg_format depends on this module
+    from larpix.format import pacman_msg_format
+
+    mode = 'a' if output_filename is None else 'r'
+    n_rows = 0
+    with h5py.File(filename, mode) as f:
+        if output_filename is None:
+            writer = FileWriter(f, **kwargs)
+        else:
+            writer = FileWriter(output_filename, **kwargs)
+        with writer:
+            if not 'raw_message_index' in f:
+                return n_rows
+            index_dset = f['raw_message_index']
+            raw_dset = f['raw_messages']
+            n_decoded = int(writer.packet_dset.attrs.get('decoded_raw_messages', 0))
+            for i in range(n_decoded, _dset_length(index_dset), chunk_size):
+                index = index_dset[i:min(i + chunk_size, _dset_length(index_dset))]
+                if not len(index):
+                    continue
+                start = int(index['start'][0])
+                end = int(index['start'][-1] + index['length'][-1])
+                packets = pacman_msg_format.parse_messages_to_array(
+                    raw_dset[start:end], index['start'] - start,
+                    io_groups=index['io_group'])
+                packets['direction'] = direction
+                writer.write(packets)
+                writer.packet_dset.attrs['decoded_raw_messages'] = i + len(index)
+                n_rows += len(packets)
+    return n_rows
+
+def _index_rows(rows, first_row, block_size):
+    '''
+    Build the ``packet_index`` rows (see "Packet index") of the
+    ``packets`` rows starting at row ``first_row``
+
+    '''
+    block = (first_row + np.arange(len(rows), dtype='u8')) // block_size
+    keys = [block] + [rows[key] for key in packet_index_keys]
+    order = np.lexsort(keys[::-1])
+    keys = [key[order] for key in keys]
+    new_key = np.zeros(len(rows), dtype=bool)
+    new_key[:1] = True
+    for key in keys:
+        new_key[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(new_key)
+    timestamp = rows['timestamp'][order]
+
+    index = np.zeros(len(starts), dtype=packet_index_dtype)
+    index['block'] = keys[0][starts]
+    for name, key in zip(packet_index_keys, keys[1:]):
+        index[name] = key[starts]
+    index['count'] = np.diff(np.append(starts, len(rows)))
+    if len(rows):
+        index['timestamp_min'] = np.minimum.reduceat(timestamp, starts)
+        index['timestamp_max'] = np.maximum.reduceat(timestamp, starts)
+    return index
+
+def _isin(values, selection):
+    '''
+    Mask of the ``values`` that are in ``selection`` (a single value or an
+    iterable)
+
+    '''
+    return np.isin(values, np.atleast_1d(np.asarray(selection)))
+
+def _chip_key_ints(rows):
+    '''
+    Combine the ``io_group``, ``io_channel``, and ``chip_id`` columns into
+    a single integer per row
+
+    '''
+    return ((rows['io_group'].astype('u4') << 16)
+        | (rows['io_channel'].astype('u4') << 8) | rows['chip_id'])
+
+def _query_mask(rows, selection, windows):
+    '''
+    Mask of the rows that match the ``iter_file`` selections. Selections
+    on columns that ``rows`` does not have are ignored, and windows are
+    applied to the ``<column>_min`` and ``<column>_max`` columns if
+    present (i.e. for ``packet_index`` rows).
+
+    '''
+    names = rows.dtype.names
+    mask = np.ones(len(rows), dtype=bool)
+    for key, value in selection.items():
+        if key == 'chip_key':
+            if not isinstance(value, (list, set)):
+                value = [value]
+            keys = [Key(chip_key) for chip_key in value]
+            mask &= _isin(_chip_key_ints(rows), [(key.io_group << 16)
+                | (key.io_channel << 8) | key.chip_id for key in keys])
+        elif key in names:
+            mask &= _isin(rows[key], value)
+    for key, (window_start, window_end) in windows.items():
+        min_key, max_key = key + '_min', key + '_max'
+        if not min_key in names:
+            min_key, max_key = key, key
+        if not min_key in names:
+            continue
+        if window_start is not None:
+            mask &= rows[max_key] >= window_start
+        if window_end is not None:
+            mask &= rows[min_key] < window_end
+    return mask
+
+def _index_ranges(index_dset, selection, windows, start, end):
+    '''
+    Use a ``packet_index`` dataset to find the ranges of ``packets`` rows
+    between ``start`` and ``end`` that may match the selections
+
+    '''
+    index = index_dset[:_dset_length(index_dset)]
+    block_size = int(index_dset.attrs['block_size'])
+    indexed_rows = int(index_dset.attrs['indexed_rows'])
+    blocks = np.unique(index['block'][_query_mask(index, selection, windows)])
+    # merge consecutive blocks into a single read
+    ranges = []
+    for block in blocks.tolist():
+        range_start = max(block * block_size, start)
+        range_end = min((block + 1) * block_size, indexed_rows, end)
+        if range_start >= range_end:
+            continue
+        if ranges and ranges[-1][1] == range_start:
+            ranges[-1] = (ranges[-1][0], range_end)
+        else:
+            ranges.append((range_start, range_end))
+    if max(indexed_rows, start) < end:
+        ranges.append((max(indexed_rows, start), end))
+    return ranges
+
+def build_index(filename, block_size=True):
+    '''
+    Create the ``packet_index`` dataset (see "Packet index") of an
+    existing file, or bring it up to date
+
+    :param filename: the name of the file to index
+    :param block_size: the number of rows in each block, or ``True`` to
+        use the HDF5 chunk size of the ``packets`` dataset (ignored if
+        the file already has an index)
+
+    '''
+    FileWriter(filename, index_block_size=block_size).close()
 
-def from_file(filename, version=None, start=None, end=None):
+def query_file(filename, io_group=None, io_channel=None, chip_id=None,
+        channel_id=None, chip_key=None, timestamp=None, packet_type=None,
+        receipt_timestamp=None, version=None, as_packets=False):
+    '''
+    Read the packets of specific chips and channels from the given file.
+
+    The selections are the same as for ``iter_file``. If the file has a
+    ``packet_index`` dataset (see "Packet index"), only the blocks of rows
+    that contain matching packets are read, otherwise the full file is
+    scanned one chunk at a time.
+
+    :param filename: the name of the file to read
+    :param version: the format version, with the same semantics as
+        ``from_file``
+    :param as_packets: ``True`` to return a list of packet objects (as
+        returned by ``from_file``) rather than a numpy structured array
+    :returns: numpy structured array of the matching ``packets`` rows (or
+        a list of packet objects)
+
+    '''
+    with h5py.File(filename, 'r') as f:
+        version = _check_version(f['_header'].attrs['version'], version)
+        if version[0] != '2':
+            raise RuntimeError('query_file requires a LArPix+HDF5 v2 file')
+        chunks = list(iter_file(f, version=version, as_packets=as_packets,
+            io_group=io_group, io_channel=io_channel, chip_id=chip_id,
+            channel_id=channel_id, chip_key=chip_key, timestamp=timestamp,
+            packet_type=packet_type, receipt_timestamp=receipt_timestamp))
+        if as_packets:
+            return [packet for chunk in chunks for packet in chunk]
+        return np.concatenate([np.empty((0,), dtype=f['packets'].dtype)]
+            + chunks)
+
+def _dataset_options(chunks=None, compression=None, compression_opts=None,
+        shuffle=False):
+    '''
+    Collect the ``h5py.Group.create_dataset`` storage options of a
+    LArPix+HDF5 dataset (see ``to_file``)
+
+    '''
+    options = dict()
+    if chunks is not None:
+        options['chunks'] = (chunks,) if isinstance(chunks, int) else tuple(chunks)
+    if compression is not None:
+        options['compression'] = compression
+        if compression_opts is not None:
+            options['compression_opts'] = compression_opts
+    if shuffle:
+        options['shuffle'] = True
+    return options
+
+def _dset_length(dset):
+    '''
+    The number of valid rows in a dataset, which may be smaller than the
+    allocated size if the dataset was grown geometrically (see ``to_file``)
+
+    '''
+    return int(dset.attrs.get('n_rows', dset.shape[0]))
+
+def _resize_dset(dset, n_rows, growth_factor=None):
+    '''
+    Resize a dataset to hold at least ``n_rows`` valid rows, growing by at
+    least ``growth_factor`` if it needs to be extended
+
+    '''
+    if n_rows > dset.shape[0]:
+        size = n_rows
+        if growth_factor:
+            size = max(size, int(math.ceil(dset.shape[0] * growth_factor)))
+        dset.resize(size, axis=0)
+    if dset.shape[0] != n_rows or 'n_rows' in dset.attrs:
+        dset.attrs['n_rows'] = n_rows
+
+def trim_file(filename):
+    '''
+    Shrink the datasets of a file written with a ``capacity`` or
+    ``growth_factor`` (see ``to_file``) to the number of valid rows, so
+    that the file can be read without the ``n_rows`` attribute.
+
+    :param filename: the name of the file to trim, or an ``h5py.File``
+        opened for writing (which is left open)
+
+    '''
+    if isinstance(filename, h5py.File):
+        context = contextlib.nullcontext(filename)
+    else:
+        context = h5py.File(filename, 'a')
+    with context as f:
+        for dset in f.values():
+            if not isinstance(dset, h5py.Dataset) or not 'n_rows' in dset.attrs:
+                continue
+            dset.resize(_dset_length(dset), axis=0)
+            del dset.attrs['n_rows']
+
+def _check_version(file_version, version):
+    '''
+    Check the requested format version against the version stored in a file
+    (see ``from_file``)
+
+    :returns: the version to use to interpret the file
+
+    '''
+    if version is None:
+        version = file_version
+    elif version[0] == '~':
+        file_major, file_minor = file_version.split('.')
+        version_major, version_minor = version[1:].split('.')
+        if (file_major != version_major
+                or int(file_minor) < int(version_minor)):
+            raise RuntimeError('Incompatible versions: existing: %s, '
+                'specified: %s' % (file_version, version))
+        else:
+            version = file_version
+    elif version == file_version:
+        pass
+    else:
+        raise RuntimeError('Incompatible versions: existing: %s, '
+            'specified: %s' % (file_version, version))
+
+    if version not in dtypes:
+        raise RuntimeError('Unknown version: %s' % version)
+    return version
+
+def iter_file(filename, chunk_size=None, version=None, start=None, end=None,
+        as_packets=False, packet_type=None, io_group=None, io_channel=None,
+        chip_id=None, channel_id=None, chip_key=None, timestamp=None,
+        receipt_timestamp=None):
+    '''
+    Iterate over the rows of the packet dataset of the given file in
+    chunks, so that files that do not fit in memory can be processed.
+
+    Each chunk is read with a single slice of the dataset. Slice
+    boundaries are aligned to the HDF5 chunks of the dataset, so that each
+    HDF5 chunk is read and decompressed only once, and the memory used is
+    bounded by ``chunk_size``.
+
+    :param filename: the name of the file to read, or an open ``h5py.File``
+    :param chunk_size: the maximum number of rows in each chunk, rounded
+        up to a multiple of the dataset HDF5 chunk size (default: the
+        dataset HDF5 chunk size or 65536 rows for contiguous datasets)
+    :param version: the format version, with the same semantics as
+        ``from_file``
+    :param start: the index of the first row to read
+    :param end: the index after the last row to read (same semantics as
+        Python ``range``)
+    :param as_packets: ``True`` to yield lists of packet objects (as
+        returned by ``from_file``) rather than numpy structured arrays
+    :yields: numpy structured arrays of rows (or lists of packet objects)
+
+    The rows can also be selected by the values of the ``packets``
+    columns (version 2 files only). The selections are applied to each
+    chunk with numpy before any packet objects are created, and chunks
+    without any selected rows are skipped. If the file has a
+    ``packet_index`` dataset (see "Packet index"), the ``io_group``,
+    ``io_channel``, ``chip_id``, ``channel_id``, ``chip_key``, and
+    ``timestamp`` selections are also used to skip the blocks of rows
+    that cannot match. Each of the following can be a single value or a
+    list of values, and only rows that match all of the given selections
+    are yielded:
+
+    :param packet_type: packet type(s) to select, e.g.
+        ``Packet_v2.CONFIG_READ_PACKET``
+    :param io_group: io group(s) to select
+    :param io_channel: io channel(s) to select
+    :param chip_id: chip id(s) to select
+    :param channel_id: channel id(s) to select
+    :param chip_key: a chip key (anything that can be converted to a
+        ``Key``), or a ``list`` of chip keys to select
+
+    and the following are ``(start, end)`` ranges with the same semantics
+    as Python ``range``, where either limit may be ``None``:
+
+    :param timestamp: range of packet ``timestamp`` to select
+    :param receipt_timestamp: range of packet ``receipt_timestamp`` to
+        select (v2.3 files only)
+
+    '''
+    if isinstance(filename, h5py.File):
+        context = contextlib.nullcontext(filename)
+    else:
+        context = h5py.File(filename, 'r')
+    with context as f:
+        version = _check_version(f['_header'].attrs['version'], version)
+        if version == '0.0':
+            dset_name = 'raw_packet'
+            message_dset = None
+        else:
+            dset_name = 'packets'
+            message_dset = f['messages']
+        dset = f[dset_name]
+
+        start, end, _ = slice(start, end).indices(_dset_length(dset))
+        hdf5_chunk_size = dset.chunks[0] if dset.chunks else 1
+        if chunk_size is None:
+            chunk_size = dset.chunks[0] if dset.chunks else 2**16
+        chunk_size = int(math.ceil(chunk_size / hdf5_chunk_size)) * hdf5_chunk_size
+
+        selection = dict(packet_type=packet_type, io_group=io_group,
+            io_channel=io_channel, chip_id=chip_id, channel_id=channel_id,
+            chip_key=chip_key)
+        selection = dict([(key, value) for key, value in selection.items()
+            if value is not None])
+        windows = dict(timestamp=timestamp, receipt_timestamp=receipt_timestamp)
+        windows = dict([(key, value) for key, value in windows.items()
+            if value is not None])
+        selected = bool(selection or windows)
+        if selected and version[0] != '2':
+            raise RuntimeError('packet selections require a LArPix+HDF5 v2 file')
+        if 'receipt_timestamp' in windows and not 'receipt_timestamp' in dset.dtype.names:
+            raise RuntimeError('receipt_timestamp selection requires a LArPix+HDF5 v2.3 file')
+
+        ranges = [(start, end)]
+        if selected and 'packet_index' in f:
+            ranges = _index_ranges(f['packet_index'], selection, windows,
+                start, end)
+
+        for range_start, range_end in ranges:
+            chunk_start = range_start
+            while chunk_start < range_end:
+                chunk_end = min((chunk_start // chunk_size + 1) * chunk_size, range_end)
+                rows = dset[chunk_start:chunk_end]
+                chunk_start = chunk_end
+                if selected:
+                    rows = rows[_query_mask(rows, selection, windows)]
+                    if not len(rows):
+                        continue
+                if not as_packets:
+                    yield rows
+                    continue
+                packets = []
+                for row in rows:
+                    pkt = _parse_method_lookup[version][dset_name](row, message_dset)
+                    if pkt is not None:
+                        packets.append(pkt)
+                yield packets
+
+def from_file(filename, version=None, start=None, end=None, **selection):
     '''
     Read the data from the given file into LArPix Packet objects.
 
@@ -1066,57 +1916,24 @@ def from_file(filename, version=None, start=None, end=None):
     :param start: the index of the first row to read
     :param end: the index after the last row to read (same semantics as
         Python ``range``)
+    :param selection: optional selections of the packets to read, e.g.
+        ``packet_type``, ``chip_key``, or ``timestamp`` (see ``iter_file``).
+        The selections are evaluated on each chunk of rows before the
+        packet objects are created, so only the selected packets are
+        loaded.
     :returns packet_dict: a dict with keys ``'packets'`` containing a
         list of packet objects; and ``'created'``, ``'modified'``, and
         ``'version'``, containing the file metadata.
 
     '''
+    packets = []
+    for chunk in iter_file(filename, version=version, start=start, end=end,
+            as_packets=True, **selection):
+        packets.extend(chunk)
     with h5py.File(filename, 'r') as f:
-        file_version = f['_header'].attrs['version']
-        if version is None:
-            version = file_version
-        elif version[0] == '~':
-            file_major, _, file_minor = file_version.split('.')
-            version_major, _, version_minor = version.split('.')
-            version_major = version_major[1:]
-            if (file_major != version_major
-                    or file_minor < version_minor):
-                raise RuntimeError('Incompatible versions: existing: %s, '
-                    'specified: %s' % (file_version, version))
-            else:
-                version = file_version
-        elif version == file_version:
-            pass
-        else:
-            raise RuntimeError('Incompatible versions: existing: %s, '
-                'specified: %s' % (file_version, version))
-
-        if version not in dtypes:
-            raise RuntimeError('Unknown version: %s' % version)
-
-        if version == '0.0':
-            dset_name = 'raw_packet'
-            message_dset = None
-        else:
-            dset_name = 'packets'
-            message_dset_name = 'messages'
-            message_props = (
-                    dtype_property_index_lookup[version][message_dset_name])
-            message_dset = f[message_dset_name]
-        props = dtype_property_index_lookup[version][dset_name]
-        packets = []
-        if start is None and end is None:
-            dset_iter = f[dset_name]
-        else:
-            dset_iter = f[dset_name][start:end]
-        for row in dset_iter:
-            pkt = _parse_method_lookup[version][dset_name](row, message_dset)
-            if pkt is not None:
-                packets.append(pkt)
         return {
                 'packets': packets,
                 'created': f['_header'].attrs['created'],
                 'modified': f['_header'].attrs['modified'],
                 'version': f['_header'].attrs['version'],
                 }
-
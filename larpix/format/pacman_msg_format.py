@@ -46,12 +46,32 @@ that when formatting messages, packets' ``io_group`` field is ignored, and when
 parsing messages, an ``io_group`` value needs to be specified at the time of
 parsing.
 
+When sending many packets, ``format_tx(packets)`` is a faster equivalent of
+``format(packets, msg_type='REQ')`` that also accepts a numpy array of
+``io_channel`` and ``payload`` rows (see ``tx_dtype``).
+
+If you don't need packet objects (e.g. when receiving data at high rates), the
+``parse_to_array(msg, io_group=None)`` method decodes a message directly into
+a numpy structured array with the same fields as the LArPix+HDF5 v2.3
+``packets`` dataset, without creating any python objects per word. E.g.::
+
+    packets = pacman_msg_fmt.parse_to_array(msg, io_group=1)
+    packets['chip_id'] # array of chip ids
+    packets['packet_type'] == 4 # first row is the message header timestamp
+
+With ``return_payload=True``, the raw 64-bit word of each data row is also
+returned, so that the packets can be rebuilt exactly (e.g. as a
+``PacketArray``).
+
 '''
 import struct
 from bidict import bidict
 import time
 
+import numpy as np
+
 from larpix import Packet_v2, TriggerPacket, SyncPacket, TimestampPacket
+from larpix.format import hdf5format
 
 HEADER_LEN=8
 WORD_LEN=16
@@ -113,6 +133,26 @@ word_struct_table = dict([
     for word_type, word_fmt in word_fmt_table.items()
     ])
 
+#: A numpy dtype that can be used to view the words of a message. Fields
+#: overlap, since their interpretation depends on the word type:
+#:
+#:  - ``DATA``/``TX`` words use ``io_channel``, ``receipt_timestamp``, and ``payload``
+#:  - ``TRIG`` words use ``type_data`` (trigger type) and ``timestamp``
+#:  - ``SYNC`` words use ``type_data`` (sync type), ``clk_source``, and ``timestamp``
+word_dtype = np.dtype(dict(
+    names=['word_type', 'io_channel', 'type_data', 'clk_source',
+           'receipt_timestamp', 'timestamp', 'payload'],
+    formats=['u1', 'u1', 'u1', 'u1', '<u4', '<u4', '<u8'],
+    offsets=[0, 1, 1, 2, 2, 4, 8],
+    itemsize=WORD_LEN
+    ))
+
+#: A numpy dtype that can be used to build the array argument of ``format_tx``
+tx_dtype = np.dtype([('io_channel', 'u1'), ('payload', '<u8')])
+
+#: The numpy dtype returned by ``parse_to_array`` (LArPix+HDF5 v2.3 ``packets``)
+packet_dtype = np.dtype(hdf5format.dtypes['2.3']['packets'])
+
 def format_header(msg_type, msg_words):
     '''
     Generates a header-formatted bytestring of
@@ -166,10 +206,19 @@ def format_msg(msg_type, msg_words):
     ``msg_words`` should be a list of tuples that can be unpacked and passed into ``format_word``
 
     '''
-    bytestream = format_header(msg_type, len(msg_words))
-    for msg_word in msg_words:
-        bytestream += format_word(msg_type, *msg_word)
-    return bytestream
+    msg = bytearray(HEADER_LEN + WORD_LEN*len(msg_words))
+    msg_header_struct.pack_into(msg, 0,
+        msg_type_table[msg_type],
+        int(time.time()),
+        len(msg_words)
+        )
+    word_types = word_type_table[msg_type]
+    offset = HEADER_LEN
+    for word_type, *data in msg_words:
+        word_struct_table[word_type].pack_into(msg, offset,
+            word_types[word_type], *data)
+        offset += WORD_LEN
+    return bytes(msg)
 
 def parse_msg(msg):
     '''
@@ -232,6 +281,57 @@ def format(packets, msg_type='REQ', ts_pacman=0):
         word_datas.append(word_data)
     return format_msg(msg_type, word_datas)
 
+def format_tx(packets, buffer=None):
+    '''
+    Converts larpix packets into a single PACMAN ``REQ`` message of ``TX``
+    words, equivalent to ``format(packets, msg_type='REQ')``.
+
+    The header and all words are written directly into a single
+    preallocated buffer, so this is much faster than ``format`` for large
+    messages (e.g. when configuring many chips).
+
+    :param packets: a list of packets (only ``Packet_v2`` objects are
+        formatted) or a numpy structured array with ``'io_channel'`` and
+        ``'payload'`` fields, e.g. with dtype ``tx_dtype``. The payload can
+        either be a ``'<u8'`` integer or 8 raw bytes (``'S8'``/``'V8'``)
+        in the same order as ``Packet_v2.bytes()``
+
+    :param buffer: optional, a writable buffer (e.g. a ``bytearray``) to
+        hold the message. If provided, the message is formatted in place
+        and a ``memoryview`` of the message within ``buffer`` is returned,
+        otherwise a new ``bytes`` object is returned
+
+    '''
+    if isinstance(packets, np.ndarray):
+        io_channel = packets['io_channel']
+        payload = packets['payload']
+        if payload.dtype.kind in 'SV':
+            payload = payload.view('<u8')
+    else:
+        packets = [packet for packet in packets if isinstance(packet, Packet_v2)]
+        io_channel = [_replace_none(packet, 'io_channel') for packet in packets]
+        payload = np.frombuffer(b''.join([packet.bytes() for packet in packets]), dtype='<u8')
+    n_words = len(payload)
+    msg_len = HEADER_LEN + WORD_LEN*n_words
+
+    if buffer is None:
+        msg = bytearray(msg_len)
+    else:
+        msg = memoryview(buffer).cast('B')
+        if len(msg) < msg_len:
+            raise ValueError('buffer too small for message ({} < {} bytes)'.format(
+                len(msg), msg_len))
+        msg = msg[:msg_len]
+        msg[:] = bytes(msg_len)
+    msg_header_struct.pack_into(msg, 0, MSG_TYPE_REQ, int(time.time()), n_words)
+    words = np.frombuffer(msg, dtype=word_dtype, count=n_words, offset=HEADER_LEN)
+    words['word_type'] = ord(WORD_TYPE_TX)
+    words['io_channel'] = io_channel
+    words['payload'] = payload
+    if buffer is None:
+        return bytes(msg)
+    return msg
+
 def parse(msg, io_group=None):
     '''
     Converts a PACMAN message into larpix packets
@@ -268,3 +368,139 @@ def parse(msg, io_group=None):
 
 
 
+
+def parse_to_array(msg, io_group=None, return_payload=False):
+    '''
+    Converts a PACMAN message into a numpy structured array with the same
+    fields as the LArPix+HDF5 v2.3 ``packets`` dataset (see ``packet_dtype``)
+
+    This is equivalent to running ``parse`` and then formatting the packets
+    with ``larpix.format.hdf5format``, but decodes all words at once using
+    bit masks rather than creating one python object per word.
+
+    The header is converted into a timestamp row (``packet_type == 4``),
+    data words are converted into ``Packet_v2`` rows,
+    trigger words are converted into trigger rows (``packet_type == 7``),
+    and sync words are converted into sync rows (``packet_type == 6``). All
+    other words are skipped.
+
+    If ``return_payload`` is ``True``, a 2-``tuple`` of the rows and a
+    ``<u8`` array of the same length is returned. The array holds the
+    raw packet word of each data row (``0`` for the other rows).
+
+    '''
+    header = parse_header(msg)
+    n_words = (len(msg) - HEADER_LEN) // WORD_LEN
+    words = np.frombuffer(msg, dtype=word_dtype, count=n_words, offset=HEADER_LEN)
+    word_type = words['word_type']
+
+    data_mask = word_type == ord(WORD_TYPE_DATA)
+    trig_mask = word_type == ord(WORD_TYPE_TRIG)
+    sync_mask = word_type == ord(WORD_TYPE_SYNC)
+    if header[0] != 'DATA':
+        trig_mask[:] = False
+        sync_mask[:] = False
+    keep_mask = data_mask | trig_mask | sync_mask
+
+    packets = np.zeros(np.count_nonzero(keep_mask) + 1, dtype=packet_dtype)
+    packets['io_group'] = io_group if io_group is not None else 0
+    packets[0]['packet_type'] = TimestampPacket().packet_type
+    packets[0]['timestamp'] = header[1]
+
+    words = words[keep_mask]
+    packets[1:] = _fill_word_rows(packets[1:], words, data_mask[keep_mask],
+        trig_mask[keep_mask], sync_mask[keep_mask])
+    if return_payload:
+        payload = np.zeros(packets.shape, dtype='<u8')
+        payload[1:][data_mask[keep_mask]] = words['payload'][data_mask[keep_mask]]
+        return packets, payload
+    return packets
+
+def _fill_word_rows(rows, words, data_mask, trig_mask, sync_mask):
+    '''
+    Fill the ``packets`` rows of the data, trigger, and sync words of a
+    data message (see ``parse_to_array``)
+
+    '''
+    data_rows = hdf5format._fill_packets_from_payload_v2_3(
+        rows[data_mask], words['payload'][data_mask])
+    data_rows['io_channel'] = words['io_channel'][data_mask]
+    data_rows['receipt_timestamp'] = words['receipt_timestamp'][data_mask]
+    rows[data_mask] = data_rows
+
+    rows['packet_type'][trig_mask] = TriggerPacket.packet_type
+    rows['trigger_type'][trig_mask] = words['type_data'][trig_mask]
+    rows['timestamp'][trig_mask] = words['timestamp'][trig_mask]
+
+    rows['packet_type'][sync_mask] = SyncPacket.packet_type
+    rows['trigger_type'][sync_mask] = words['type_data'][sync_mask]
+    rows['dataword'][sync_mask] = words['clk_source'][sync_mask] & 0x01
+    rows['timestamp'][sync_mask] = words['timestamp'][sync_mask]
+    return rows
+
+def parse_messages_to_array(buffer, offsets=None, io_groups=None, return_payload=False):
+    '''
+    Converts many PACMAN messages into a single numpy structured array with
+    the LArPix+HDF5 v2.3 ``packets`` dtype. This is equivalent to
+    concatenating the result of ``parse_to_array`` for each message, but
+    decodes the headers and words of all messages at once.
+
+    :param buffer: either a list of messages, or ``bytes`` (or a ``u1``
+        array) containing the messages back-to-back
+
+    :param offsets: the start of each message within ``buffer`` (required if ``buffer`` is not a list)
+
+    :param io_groups: the io group of each message (optional)
+
+    :param return_payload: also return the raw packet word of each row (see ``parse_to_array``)
+
+    '''
+    if isinstance(buffer, (list, tuple)):
+        lengths = np.array([len(msg) for msg in buffer], dtype='i8')
+        offsets = np.cumsum(lengths) - lengths
+        buffer = b''.join(buffer)
+    if isinstance(buffer, (bytes, bytearray, memoryview)):
+        buffer = np.frombuffer(buffer, dtype='u1')
+    offsets = np.asarray(offsets, dtype='i8')
+    n_msgs = len(offsets)
+
+    # headers
+    headers = buffer[offsets[:,np.newaxis] + np.arange(HEADER_LEN)].view(
+        np.dtype([('msg_type', 'u1'), ('timestamp', '<u4'), ('pad', 'u1'),
+            ('n_words', '<u2')]))[:,0]
+    n_words = headers['n_words'].astype('i8')
+    data_msg = headers['msg_type'] == ord(MSG_TYPE_DATA)
+
+    # words
+    msg_index = np.repeat(np.arange(n_msgs), n_words)
+    word_index = np.arange(len(msg_index)) - np.repeat(np.cumsum(n_words) - n_words, n_words)
+    word_offsets = offsets[msg_index] + HEADER_LEN + WORD_LEN * word_index
+    words = buffer[word_offsets[:,np.newaxis] + np.arange(WORD_LEN)].view(word_dtype)[:,0]
+    word_type = words['word_type']
+
+    data_mask = word_type == ord(WORD_TYPE_DATA)
+    trig_mask = (word_type == ord(WORD_TYPE_TRIG)) & data_msg[msg_index]
+    sync_mask = (word_type == ord(WORD_TYPE_SYNC)) & data_msg[msg_index]
+    keep_mask = data_mask | trig_mask | sync_mask
+
+    # one timestamp row per message, followed by its kept words
+    n_kept = np.bincount(msg_index[keep_mask], minlength=n_msgs)
+    n_rows = n_kept + 1
+    header_rows = np.cumsum(n_rows) - n_rows
+    packets = np.zeros(np.sum(n_rows), dtype=packet_dtype)
+    if io_groups is not None:
+        packets['io_group'] = np.repeat(np.asarray(io_groups, dtype='u1'), n_rows)
+    packets['packet_type'][header_rows] = TimestampPacket().packet_type
+    packets['timestamp'][header_rows] = headers['timestamp']
+
+    kept_msg_index = msg_index[keep_mask]
+    word_rows = header_rows[kept_msg_index] + 1 + np.arange(len(kept_msg_index)) \
+        - np.repeat(np.cumsum(n_kept) - n_kept, n_kept)
+    packets[word_rows] = _fill_word_rows(packets[word_rows], words[keep_mask],
+        data_mask[keep_mask], trig_mask[keep_mask], sync_mask[keep_mask])
+    if return_payload:
+        payload = np.zeros(packets.shape, dtype='<u8')
+        kept_data_mask = data_mask[keep_mask]
+        payload[word_rows[kept_data_mask]] = words['payload'][keep_mask][kept_data_mask]
+        return packets, payload
+    return packets
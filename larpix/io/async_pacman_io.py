@@ -0,0 +1,403 @@
+import asyncio
+import zmq
+import zmq.asyncio
+
+import larpix.format.pacman_msg_format as pacman_msg_format
+from larpix.io.pacman_io import PACMAN_IO, _MessageBuffer
+
+class AsyncPACMAN_IO(PACMAN_IO):
+    '''
+    An asyncio variant of ``PACMAN_IO``, built on ``zmq.asyncio``.
+
+    This object is configured in the same way as the ``PACMAN_IO``
+    object, but all methods that communicate with the PACMAN boards
+    (``send``, ``empty_queue``, ``get_reg``, ``set_reg``, ``ping``,
+    ``get_vddd``, ...) are coroutines and must be awaited from within
+    an event loop. E.g.::
+
+        io = AsyncPACMAN_IO(config_filepath='io/pacman.json')
+        async def monitor():
+            while True:
+                print(await io.get_vddd())
+                await asyncio.sleep(1)
+
+    When called without an ``io_group``, requests are made to all io
+    groups concurrently. Requests to a single io group are serialized,
+    so monitoring tasks can run alongside data-taking in the same event
+    loop without extra threads. Use the ``async_*`` methods of the
+    ``Controller`` (e.g. ``Controller.async_send``) to drive an
+    ``AsyncPACMAN_IO`` object.
+
+    With ``background_receive`` enabled, ``start_listening()`` must be
+    called from within the event loop and starts an asyncio task (rather
+    than a thread) that reads data messages into the receive buffer. The
+    ``max_msgs_in_flight``, ``decode_workers``, and ``decode_batch_size``
+    options behave as in ``PACMAN_IO``.
+
+    '''
+    _valid_config_classes = ['PACMAN_IO', 'AsyncPACMAN_IO']
+
+    _context_class = zmq.asyncio.Context
+    _poller_class = zmq.asyncio.Poller
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncPACMAN_IO, self).__init__(*args, **kwargs)
+        self._sender_locks = dict()
+        self._receiver_task = None
+
+    def _sender_lock(self, address):
+        # created on first use, so that the lock is bound to the running loop
+        if address not in self._sender_locks:
+            self._sender_locks[address] = asyncio.Lock()
+        return self._sender_locks[address]
+
+    async def _request(self, address, msg):
+        '''
+        Send a single request message to ``address`` and return the reply
+
+        '''
+        async with self._sender_lock(address):
+            await self.senders[address].send(msg)
+            reply = await self.senders[address].recv()
+        self._sender_replies[address].append(reply)
+        return reply
+
+    async def _for_each_io_group(self, method, *args, **kwargs):
+        io_groups = list(self._io_group_table)
+        values = await asyncio.gather(*[
+            method(*args, io_group=io_group, **kwargs) for io_group in io_groups])
+        return dict(zip(io_groups, values))
+
+    async def send(self, packets):
+        '''
+        Sends a request message to PACMAN boards to send designated
+        packets. Messages to each io group are sent concurrently.
+
+        '''
+        msgs = dict()
+        for address, msg in self._format_send_msgs(packets):
+            msgs.setdefault(address, list()).append(msg)
+        await asyncio.gather(*[self._send_msgs(address, address_msgs)
+            for address, address_msgs in msgs.items()])
+
+    async def _send_msgs(self, address, msgs):
+        if self.max_msgs_in_flight <= 1:
+            for msg in msgs:
+                await self._request(address, msg)
+            return
+        # pipeline messages over a DEALER socket
+        sender = self._pipeline_sender(address)
+        slots = asyncio.Semaphore(self.max_msgs_in_flight)
+        async def receive_replies():
+            for _ in msgs:
+                reply = await sender.recv_multipart()
+                self._sender_replies[address].append(reply[-1])
+                slots.release()
+        receiver = asyncio.ensure_future(receive_replies())
+        try:
+            for msg in msgs:
+                await slots.acquire()
+                await sender.send_multipart([b'', msg])
+            await receiver
+        except BaseException:
+            # late replies would otherwise be received by the next send
+            receiver.cancel()
+            self._discard_pipeline_sender(address)
+            raise
+        finally:
+            receiver.cancel()
+
+    def start_listening(self):
+        '''
+        Start keeping msgs from data server
+
+        '''
+        if self.is_listening:
+            raise RuntimeError('Already listening')
+        super(PACMAN_IO, self).start_listening()
+        for receiver in self.receivers.values():
+            receiver.setsockopt(zmq.SUBSCRIBE, b'')
+        if self.background_receive:
+            if self._receive_buffer is None or self._receive_buffer.length != self.receive_buffer_length:
+                self._receive_buffer = _MessageBuffer(self.receive_buffer_length)
+            self._receiver_task = asyncio.ensure_future(self._receive_loop())
+
+    def stop_listening(self):
+        '''
+        Stop keeping msgs from data server
+
+        '''
+        if not self.is_listening:
+            raise RuntimeError('Already not listening')
+        super(PACMAN_IO, self).stop_listening()
+        self._stop_receive_loop()
+        for receiver in self.receivers.values():
+            receiver.setsockopt(zmq.UNSUBSCRIBE, b'')
+
+    async def _receive_loop(self):
+        '''
+        Background receiver task, reads all waiting messages into the
+        receive buffer until cancelled
+
+        '''
+        while True:
+            messages = await self._recv_messages(timeout=None)
+            self._receive_buffer.extend(messages)
+
+    def _stop_receive_loop(self):
+        if self._receiver_task is not None:
+            self._receiver_task.cancel()
+            self._receiver_task = None
+
+    async def _recv_messages(self, timeout=0):
+        '''
+        Receive up to ``hwm`` waiting messages, waiting up to ``timeout``
+        ms (``None`` to wait indefinitely) for the first message
+
+        Returns a list of ``(address, message)``
+
+        '''
+        messages = list()
+        while len(messages) < self.hwm:
+            events = dict(await self.poller.poll(timeout))
+            if not events:
+                break
+            for socket in events:
+                messages.append((self.receivers.inv[socket], await socket.recv()))
+            timeout = 0
+        return messages
+
+    async def empty_queue(self, as_array=False, raw=False, return_payload=False):
+        '''
+        Fetch and parse waiting packets on pacman data socket
+
+        returns tuple of list of packets, full bytestream of all messages
+
+        :param as_array: if ``True``, packets are returned as a single numpy
+            structured array using the LArPix+HDF5 v2.3 ``packets`` dtype (see
+            ``pacman_msg_format.parse_to_array``) rather than a list of
+            packet objects
+
+        :param raw: if ``True``, the messages are not parsed and a list of
+            ``(io_group, message)`` tuples is returned in place of the packets
+
+        :param return_payload: if ``True`` (requires ``as_array``), the raw
+            packet word of each row is returned as a third element, i.e.
+            ``(packets, bytestream, payload)``
+
+        '''
+        if return_payload and not as_array:
+            raise ValueError('return_payload requires as_array')
+        messages = list()
+        if self._receive_buffer is not None:
+            messages = self._receive_buffer.swap()
+        if self._receiver_task is None:
+            messages += await self._recv_messages()
+        io_group_list = [self._io_group_table.inv[address] for address, message in messages]
+        bytestream_list = [message for address, message in messages]
+        if raw:
+            return list(zip(io_group_list, bytestream_list)), b''.join(bytestream_list)
+        packets = self._parse_messages(io_group_list, bytestream_list,
+            as_array=as_array, return_payload=return_payload)
+        if return_payload:
+            packets, payload = packets
+            return packets, b''.join(bytestream_list), payload
+        return packets, b''.join(bytestream_list)
+
+    async def set_reg(self, reg, val, io_group=None):
+        '''
+        Set a 32-bit register in the pacman PL
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.set_reg, reg, val)
+        msg = pacman_msg_format.format_msg('REQ',[('WRITE',reg,val)])
+        await self._request(self._io_group_table[io_group], msg)
+
+    async def get_reg(self, reg, io_group=None):
+        '''
+        Read a 32-bit register from the pacman PL
+
+        If no ``io_group`` is specified, returns a ``dict`` of ``io_group, reg_value``
+        else returns reg_value
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.get_reg, reg)
+        msg = pacman_msg_format.format_msg('REQ',[('READ',reg,0)])
+        reply = await self._request(self._io_group_table[io_group], msg)
+        msg_data = pacman_msg_format.parse_msg(reply)
+        if msg_data[1][0][0] == 'READ':
+            return msg_data[1][0][-1]
+        raise RuntimeError('Error received from server')
+
+    async def ping(self, io_group=None):
+        '''
+        Send a ping message
+
+        If no ``io_group`` is specified, returns a ``dict`` of ``io_group, response``
+        else returns response
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.ping)
+        msg = pacman_msg_format.format_msg('REQ',[('PING',)])
+        try:
+            reply = await self._request(self._io_group_table[io_group], msg)
+            msg_data = pacman_msg_format.parse_msg(reply)
+            if msg_data[1][0][0] == 'PONG':
+                return True
+        except zmq.ZMQError as e:
+            print('IO error on {}: {}'.format(io_group,e))
+        return False
+
+    async def _get_adc(self, v_reg, i_reg, io_group):
+        mv = self._adc2mv(await self.get_reg(v_reg, io_group=io_group))
+        ma = self._adc2ma(await self.get_reg(i_reg, io_group=io_group))
+        return mv, ma
+
+    async def get_vddd(self, io_group=None):
+        '''
+        Gets PACMAN VDDD voltage
+
+        Returns VDDD and IDDD values from the built-in ADC as
+        a tuple of mV and mA respectively
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.get_vddd)
+        return await self._get_adc(self._vddd_adc_reg, self._iddd_adc_reg, io_group)
+
+    async def set_vddd(self, vddd_dac=0xD5A3, io_group=None, settling_time=0.1):
+        '''
+        Sets PACMAN VDDD voltage
+
+        If no ``vddd_dac`` value is specified, sets VDDD to default of ~1.8V
+
+        Returns the resulting VDDD and IDDD values from the built-in ADC as
+        a tuple of mV and mA respectively
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.set_vddd, vddd_dac, settling_time=settling_time)
+        await self.set_reg(self._vddd_dac_reg, vddd_dac, io_group=io_group)
+        if settling_time:
+            await asyncio.sleep(settling_time)
+        return await self.get_vddd(io_group=io_group)
+
+    async def get_vdda(self, io_group=None):
+        '''
+        Gets PACMAN VDDA voltage
+
+        Returns VDDA and IDDA values from the built-in ADC as
+        a tuple of mV and mA respectively
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.get_vdda)
+        return await self._get_adc(self._vdda_adc_reg, self._idda_adc_reg, io_group)
+
+    async def set_vdda(self, vdda_dac=0xD5A3, io_group=None, settling_time=0.1):
+        '''
+        Sets PACMAN VDDA voltage
+
+        If no ``vdda_dac`` value is specified, sets VDDA to default of ~1.8V
+
+        Returns the resulting VDDA and IDDA values from the built-in ADC as
+        a tuple of mV and mA respectively
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.set_vdda, vdda_dac, settling_time=settling_time)
+        await self.set_reg(self._vdda_dac_reg, vdda_dac, io_group=io_group)
+        if settling_time:
+            await asyncio.sleep(settling_time)
+        return await self.get_vdda(io_group=io_group)
+
+    async def get_vplus(self, io_group=None):
+        '''
+        Gets PACMAN Vplus voltage
+
+        Returns Vplus and Iplus values from the built-in ADC as
+        a tuple of mV and mA respectively
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.get_vplus)
+        return await self._get_adc(self._vplus_adc_reg, self._iplus_adc_reg, io_group)
+
+    async def enable_tile(self, tile_indices=None, io_group=None):
+        '''
+        Enables the specified pixel tile(s) (first tile is index=0, second
+        tile is index=1, ...).
+
+        Returns the value of the new tile enable mask
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.enable_tile, tile_indices=tile_indices)
+        if tile_indices is None:
+            tile_indices = list(range(8))
+        elif isinstance(tile_indices,int):
+            tile_indices = [tile_indices]
+        val = await self.get_reg(self._base_ctrl_reg, io_group=io_group)
+        for idx in tile_indices:
+            val = val | (1 << idx)
+        await self.set_reg(self._base_ctrl_reg, val, io_group=io_group)
+        return (await self.get_reg(self._base_ctrl_reg, io_group=io_group) & 0xFF)
+
+    async def disable_tile(self, tile_indices=None, io_group=None):
+        '''
+        Disables the specified pixel tile(s) (first tile is index=0, second
+        tile is index=1, ...).
+
+        Returns the value of the new tile enable mask
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.disable_tile, tile_indices=tile_indices)
+        if tile_indices is None:
+            tile_indices = list(range(8))
+        elif isinstance(tile_indices,int):
+            tile_indices = [tile_indices]
+        val = await self.get_reg(self._base_ctrl_reg, io_group=io_group)
+        for idx in tile_indices:
+            val = val & (0xFFFFFFFF & ~(1 << idx))
+        await self.set_reg(self._base_ctrl_reg, val, io_group=io_group)
+        return (await self.get_reg(self._base_ctrl_reg, io_group=io_group) & 0xFF)
+
+    async def set_uart_clock_ratio(self, channel, ratio, io_group=None):
+        '''
+        Sets PACMAN UART clock speed relative to the larpix master clock
+        for the specified channel
+
+        For a nominal 10MHz clock, a ratio value of 4 results in a 2.5MHz
+        UART clock.
+
+        Returns the value of the UART clock register that was set
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.set_uart_clock_ratio, channel, ratio)
+        reg = self._channel_size*channel + self._uart_clock_ratio_offset + self._channel_offset
+        await self.set_reg(reg, ratio, io_group=io_group)
+        return await self.get_reg(reg, io_group=io_group)
+
+    async def reset_larpix(self, length=256, io_group=None):
+        '''
+        Issues a reset of the specified length (in larpix MCLK cycles).
+
+        If no ``length`` specified, issue a hard reset.
+
+        Returns the value of the clock/reset control register after the reset
+
+        '''
+        if io_group is None:
+            return await self._for_each_io_group(self.reset_larpix, length)
+        # set reset cycles
+        await self.set_reg(self._sw_reset_cycles_reg, length, io_group=io_group)
+        # toggle reset bit
+        clk_ctrl = await self.get_reg(self._clk_ctrl_reg, io_group=io_group)
+        await self.set_reg(self._clk_ctrl_reg, clk_ctrl|4, io_group=io_group)
+        await self.set_reg(self._clk_ctrl_reg, clk_ctrl, io_group=io_group)
+        return await self.get_reg(self._clk_ctrl_reg, io_group=io_group)
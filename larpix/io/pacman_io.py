@@ -2,13 +2,87 @@ import itertools
 import zmq
 import bidict
 import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
 
+import numpy as np
+
 from larpix.io import IO
 from larpix.configs import load
 import larpix.format.pacman_msg_format as pacman_msg_format
 from larpix import Packet_v2
 
+def _decode_messages(io_groups, messages, as_array=False, return_payload=False):
+    '''
+    Decode a batch of messages (the decode worker function, see
+    ``PACMAN_IO._parse_messages``)
+
+    '''
+    if as_array:
+        return pacman_msg_format.parse_messages_to_array(list(messages),
+            io_groups=io_groups, return_payload=return_payload)
+    packets = list()
+    for io_group, message in zip(io_groups, messages):
+        packets += pacman_msg_format.parse(message, io_group=io_group)
+    return packets
+
+class _MessageBuffer(object):
+    '''
+    A fixed-length double buffer of received messages, filled by the
+    background receiver thread and swapped out by ``empty_queue``.
+
+    Messages that arrive while the active buffer is full are dropped and
+    counted in ``n_dropped``, ``n_overflows`` counts the number of times
+    the buffer filled up.
+
+    '''
+    def __init__(self, length):
+        self.length = length
+        self.n_dropped = 0
+        self.n_overflows = 0
+        self._buffers = [[None]*length, [None]*length]
+        self._active = 0
+        self._n = 0
+        self._full = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._n
+
+    def extend(self, items):
+        '''
+        Add items to the active buffer, returns the number of items dropped
+
+        '''
+        with self._lock:
+            buffer = self._buffers[self._active]
+            n_stored = min(len(items), self.length - self._n)
+            buffer[self._n:self._n+n_stored] = items[:n_stored]
+            self._n += n_stored
+            n_dropped = len(items) - n_stored
+            if n_dropped:
+                if not self._full:
+                    self.n_overflows += 1
+                    self._full = True
+                self.n_dropped += n_dropped
+            return n_dropped
+
+    def swap(self):
+        '''
+        Swap the active buffer and return a list of the buffered items
+
+        '''
+        with self._lock:
+            buffer, n = self._buffers[self._active], self._n
+            self._active ^= 1
+            self._n = 0
+            self._full = False
+        items = buffer[:n]
+        buffer[:n] = [None]*n
+        return items
+
 class PACMAN_IO(IO):
     '''
     The PACMAN_IO object interfaces with a network of PACMAN
@@ -18,12 +92,13 @@ class PACMAN_IO(IO):
     formatted messages to/from the PACMAN boards. If you want more
     info on how messages are formatted, see `larpix.format.pacman_msg_format`.
 
-    The PACMAN_IO object has three flags for optimizing communications
+    The PACMAN_IO object has four options for optimizing communications
     which you may or may not want to enable::
 
         group_packets_by_io_group
         interleave_packets_by_io_channel
         double_send_packets
+        max_msgs_in_flight
 
     To enable each option set the flag to ``True``; to disable, set to
     ``False``.
@@ -51,6 +126,36 @@ class PACMAN_IO(IO):
     reaches a chip, but you don't care about introducing extra packets into
     the system (i.e. when configuring chips).
 
+    The ``max_msgs_in_flight`` option is set to 1 by default, in which case
+    each message is sent and its reply is received before the next message
+    is sent. If set to a value N > 1, ``send()`` instead pipelines messages
+    over DEALER sockets: up to N messages are sent to each io group before
+    waiting on a reply, and messages to all io groups are sent
+    concurrently. The order of messages is preserved for each io group and
+    replies are still collected in ``_sender_replies``. This removes the
+    network round-trip latency between messages and is useful when sending
+    large numbers of packets (i.e. when configuring many chips).
+
+    By default, messages from the data server are only read from the ZMQ
+    sockets when ``empty_queue()`` is called, so messages beyond the socket
+    high water mark (``hwm``) are silently dropped if ``empty_queue()`` is
+    not called often enough. Setting ``background_receive`` to ``True``
+    before calling ``start_listening()`` starts a background thread that
+    continuously reads messages into a preallocated double buffer of
+    ``receive_buffer_length`` messages. ``empty_queue()`` then swaps
+    buffers and parses the buffered messages. Messages received while the
+    buffer is full are dropped, but are counted (see
+    ``receive_buffer_stats()``).
+
+    Parsing messages in ``empty_queue()`` can be distributed across a pool
+    of processes by setting ``decode_workers`` to the number of worker
+    processes (the default of 0 parses messages on the calling thread).
+    Messages are sent to the workers in batches of ``decode_batch_size``
+    messages and the resulting packets are returned in the order the
+    messages were received. Since packets must be copied back from the
+    worker processes, this is most effective with
+    ``empty_queue(as_array=True)``.
+
 
     '''
     default_filepath = 'io/pacman.json'
@@ -62,6 +167,15 @@ class PACMAN_IO(IO):
     group_packets_by_io_group = True
     interleave_packets_by_io_channel = True
     double_send_packets = False
+    max_msgs_in_flight = 1
+    background_receive = False
+    receive_buffer_length = 2**18
+    _receiver_poll_interval = 10 # ms
+    decode_workers = 0
+    decode_batch_size = 64
+
+    _context_class = zmq.Context
+    _poller_class = zmq.Poller
 
     _base_ctrl_reg = 0x10
     _clk_ctrl_reg = 0x1010
@@ -84,13 +198,14 @@ class PACMAN_IO(IO):
         super(PACMAN_IO, self).__init__()
         self.load(config_filepath)
 
-        self.context = zmq.Context()
+        self.context = self._context_class()
         self.senders = bidict.bidict()
         self.receivers = bidict.bidict()
         for address in self._io_group_table.inv:
             self.senders[address] = self.context.socket(zmq.REQ)
             self.receivers[address] = self.context.socket(zmq.SUB)
         self.hwm = hwm
+        self.timeout = timeout
         for receiver in self.receivers.values():
             receiver.set_hwm(self.hwm)
             receiver.setsockopt(zmq.CONNECT_TIMEOUT,max(timeout,0))
@@ -109,7 +224,13 @@ class PACMAN_IO(IO):
             self.senders[address].connect(send_address)
             self.receivers[address].connect(receive_address)
         self._sender_replies = defaultdict(list)
-        self.poller = zmq.Poller()
+        self._pipeline_senders = bidict.bidict()
+        self._receive_buffer = None
+        self._receiver_thread = None
+        self._stop_receiver = threading.Event()
+        self._decode_pool = None
+        self._decode_pool_workers = 0
+        self.poller = self._poller_class()
         for receiver in self.receivers.values():
             self.poller.register(receiver, zmq.POLLIN)
 
@@ -118,6 +239,19 @@ class PACMAN_IO(IO):
         Sends a request message to PACMAN boards to send designated
         packets.
 
+        '''
+        msgs = self._format_send_msgs(packets)
+        if self.max_msgs_in_flight > 1:
+            self._pipelined_send(msgs)
+            return
+        for address, msg in msgs:
+            self.senders[address].send(msg)
+            self._sender_replies[address].append(self.senders[address].recv())
+
+    def _format_send_msgs(self, packets):
+        '''
+        Converts packets into a list of ``(address, msg)`` to send, in order
+
         '''
         msg_packets = list()
         # group packets into messages destined for a single io group (otherwise 1pkt = 1msg)
@@ -145,16 +279,94 @@ class PACMAN_IO(IO):
             msg_packets = doubled_msg_packets
 
         # convert packets to messages
-        resp_addresses = list()
+        msgs = list()
         for packets in msg_packets:
             io_group = packets[0].io_group
             for i in range(0, len(packets), self.max_msg_length):
                 #for packet in packets: print(packet)
                 msg_len = min(len(packets)-i, self.max_msg_length)
-                msg = pacman_msg_format.format(packets[i:i+msg_len], msg_type='REQ')
+                msg = pacman_msg_format.format_tx(packets[i:i+msg_len])
                 address = self._io_group_table[io_group]
-                self.senders[address].send(msg)
-                self._sender_replies[address].append(self.senders[address].recv())
+                msgs.append((address, msg))
+        return msgs
+
+    def _pipeline_sender(self, address):
+        '''
+        Get (or create) the DEALER socket used for pipelined sends to
+        ``address``
+
+        '''
+        if address not in self._pipeline_senders:
+            sender = self.context.socket(zmq.DEALER)
+            sender.setsockopt(zmq.LINGER,0)
+            sender.setsockopt(zmq.CONNECT_TIMEOUT,max(self.timeout,0))
+            sender.setsockopt(zmq.SNDTIMEO,self.timeout)
+            sender.setsockopt(zmq.RCVTIMEO,self.timeout)
+            sender.connect('tcp://' + address + ':' + self.cmdserver_port)
+            self._pipeline_senders[address] = sender
+        return self._pipeline_senders[address]
+
+    def _discard_pipeline_sender(self, address):
+        '''
+        Close the DEALER socket used for pipelined sends to ``address``, so
+        that any late replies to messages still in flight are not received
+        as replies to later messages. A new socket is created on the next
+        send.
+
+        '''
+        sender = self._pipeline_senders.pop(address, None)
+        if sender is not None:
+            sender.close(linger=0)
+
+    def _pipelined_send(self, msgs):
+        '''
+        Sends a list of ``(address, msg)`` over DEALER sockets, keeping up
+        to ``max_msgs_in_flight`` messages outstanding per address. Messages
+        to each address are sent in order and all replies are appended to
+        ``_sender_replies``.
+
+        Raises a ``zmq.Again`` error if no reply is received within the
+        timeout (same as a blocking ``recv()`` on the REQ sockets). The
+        sockets with messages still in flight are then discarded, so that
+        their replies are not mistaken for replies to the next call.
+
+        '''
+        pending = defaultdict(list)
+        for address, msg in msgs:
+            pending[address].append(msg)
+        for address in pending:
+            pending[address].reverse()
+        in_flight = defaultdict(int)
+        poller = zmq.Poller()
+        for address in pending:
+            poller.register(self._pipeline_sender(address), zmq.POLLIN)
+
+        timeout = self.timeout if self.timeout >= 0 else None
+        try:
+            while any(pending.values()) or any(in_flight.values()):
+                for address, address_msgs in pending.items():
+                    sender = self._pipeline_sender(address)
+                    while address_msgs and in_flight[address] < self.max_msgs_in_flight:
+                        # empty delimiter frame emulates a REQ socket envelope
+                        sender.send_multipart([b'', address_msgs.pop()])
+                        in_flight[address] += 1
+                events = dict(poller.poll(timeout))
+                if not events:
+                    raise zmq.Again()
+                for sender in events:
+                    address = self._pipeline_senders.inv[sender]
+                    while in_flight[address]:
+                        try:
+                            reply = sender.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        self._sender_replies[address].append(reply[-1])
+                        in_flight[address] -= 1
+        except zmq.Again:
+            for address in in_flight:
+                if in_flight[address]:
+                    self._discard_pipeline_sender(address)
+            raise
 
     def start_listening(self):
         '''
@@ -166,6 +378,13 @@ class PACMAN_IO(IO):
         super(PACMAN_IO, self).start_listening()
         for receiver in self.receivers.values():
             receiver.setsockopt(zmq.SUBSCRIBE, b'')
+        if self.background_receive:
+            if self._receive_buffer is None or self._receive_buffer.length != self.receive_buffer_length:
+                self._receive_buffer = _MessageBuffer(self.receive_buffer_length)
+            self._stop_receiver.clear()
+            self._receiver_thread = threading.Thread(target=self._receive_loop,
+                name='PACMAN_IO receiver', daemon=True)
+            self._receiver_thread.start()
 
     def stop_listening(self):
         '''
@@ -175,9 +394,53 @@ class PACMAN_IO(IO):
         if not self.is_listening:
             raise RuntimeError('Already not listening')
         super(PACMAN_IO, self).stop_listening()
+        self._stop_receive_loop()
         for receiver in self.receivers.values():
             receiver.setsockopt(zmq.UNSUBSCRIBE, b'')
 
+    def _receive_loop(self):
+        '''
+        Background receiver thread target, reads all waiting messages
+        into the receive buffer until ``_stop_receiver`` is set
+
+        '''
+        while not self._stop_receiver.is_set():
+            events = dict(self.poller.poll(self._receiver_poll_interval))
+            for socket in events:
+                address = self.receivers.inv[socket]
+                messages = list()
+                while len(messages) < self.hwm:
+                    try:
+                        messages.append((address, socket.recv(zmq.NOBLOCK)))
+                    except zmq.Again:
+                        break
+                self._receive_buffer.extend(messages)
+
+    def _stop_receive_loop(self):
+        if self._receiver_thread is not None:
+            self._stop_receiver.set()
+            self._receiver_thread.join()
+            self._receiver_thread = None
+
+    def receive_buffer_stats(self):
+        '''
+        Statistics of the background receiver buffer (see
+        ``background_receive``)
+
+        :returns: ``dict`` of the number of messages currently buffered
+            (``'buffered'``), the number of messages dropped due to a full
+            buffer (``'dropped'``), and the number of times the buffer
+            filled up (``'overflows'``)
+
+        '''
+        if self._receive_buffer is None:
+            return dict(buffered=0, dropped=0, overflows=0)
+        return dict(
+            buffered=len(self._receive_buffer),
+            dropped=self._receive_buffer.n_dropped,
+            overflows=self._receive_buffer.n_overflows
+            )
+
     @staticmethod
     def _group_by_attr(packets, attr):
         '''
@@ -210,19 +473,38 @@ class PACMAN_IO(IO):
                     interleaved.append(packet)
         return interleaved
 
-    def empty_queue(self):
+    def empty_queue(self, as_array=False, raw=False, return_payload=False):
         '''
         Fetch and parse waiting packets on pacman data socket
 
         returns tuple of list of packets, full bytestream of all messages
 
+        :param as_array: if ``True``, packets are returned as a single numpy
+            structured array using the LArPix+HDF5 v2.3 ``packets`` dtype (see
+            ``pacman_msg_format.parse_to_array``) rather than a list of
+            packet objects
+
+        :param raw: if ``True``, the messages are not parsed and a list of
+            ``(io_group, message)`` tuples is returned in place of the packets
+            (e.g. for ``HDF5Logger`` raw message logging)
+
+        :param return_payload: if ``True`` (requires ``as_array``), the raw
+            packet word of each row is returned as a third element, i.e.
+            ``(packets, bytestream, payload)``
+
         '''
+        if return_payload and not as_array:
+            raise ValueError('return_payload requires as_array')
         packets = []
         address_list = list()
         bytestream_list = list()
         bytestream = b''
+        if self._receive_buffer is not None:
+            buffered = self._receive_buffer.swap()
+            address_list = [address for address, message in buffered]
+            bytestream_list = [message for address, message in buffered]
         n_recv = 0
-        while self.poller.poll(0) and n_recv < self.hwm:
+        while self._receiver_thread is None and self.poller.poll(0) and n_recv < self.hwm:
             events = dict(self.poller.poll(0))
             for socket, n_events in events.items():
                 for _ in range(n_events):
@@ -230,14 +512,53 @@ class PACMAN_IO(IO):
                     n_recv += 1
                     bytestream_list += [message]
                     address_list += [self.receivers.inv[socket]]
-        for message, address in zip(bytestream_list, address_list):
-            packets += pacman_msg_format.parse(message, io_group=self._io_group_table.inv[address])
+        io_group_list = [self._io_group_table.inv[address] for address in address_list]
+        if raw:
+            return list(zip(io_group_list, bytestream_list)), b''.join(bytestream_list)
+        packets = self._parse_messages(io_group_list, bytestream_list,
+            as_array=as_array, return_payload=return_payload)
         bytestream = b''.join(bytestream_list)
         #print(bytestream)
         #for packet in packets:
         #    if isinstance(packet, Packet_v2): print(packet)
+        if return_payload:
+            packets, payload = packets
+            return packets, bytestream, payload
         return packets,bytestream
 
+    def _parse_messages(self, io_groups, messages, as_array=False, return_payload=False):
+        '''
+        Parse messages, using the decode worker pool if ``decode_workers``
+        is set and there is more than one batch of messages
+
+        '''
+        if self.decode_workers < 1 or len(messages) <= self.decode_batch_size:
+            return _decode_messages(io_groups, messages, as_array=as_array,
+                return_payload=return_payload)
+        if self._decode_pool is None or self._decode_pool_workers != self.decode_workers:
+            self._shutdown_decode_pool()
+            # spawn workers, since forking a process with running zmq threads is unsafe
+            self._decode_pool = ProcessPoolExecutor(
+                max_workers=self.decode_workers,
+                mp_context=multiprocessing.get_context('spawn'))
+            self._decode_pool_workers = self.decode_workers
+        batches = range(0, len(messages), self.decode_batch_size)
+        results = self._decode_pool.map(_decode_messages,
+            [io_groups[i:i+self.decode_batch_size] for i in batches],
+            [messages[i:i+self.decode_batch_size] for i in batches],
+            [as_array]*len(batches), [return_payload]*len(batches))
+        if as_array and return_payload:
+            packets, payload = zip(*results)
+            return np.concatenate(packets), np.concatenate(payload)
+        if as_array:
+            return np.concatenate(list(results))
+        return list(itertools.chain.from_iterable(results))
+
+    def _shutdown_decode_pool(self):
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown()
+            self._decode_pool = None
+
     def cleanup(self):
         '''
         Close the ZMQ objects to prevent a memory leak.
@@ -246,9 +567,13 @@ class PACMAN_IO(IO):
         ``PACMAN_IO`` object.
 
         '''
+        self._stop_receive_loop()
+        self._shutdown_decode_pool()
         for address in self.senders.keys():
             self.senders[address].close(linger=0)
             self.receivers[address].close(linger=0)
+        for address in self._pipeline_senders.keys():
+            self._pipeline_senders[address].close(linger=0)
         self.context.term()
 
     def set_reg(self, reg, val, io_group=None):
@@ -1,12 +1,15 @@
 import time
 import os
+import json
+import queue
+import threading
 
 import numpy as np
 import h5py
 
 from larpix.logger import Logger
 from larpix import Packet, TimestampPacket, Packet_v1, Packet_v2, SyncPacket, TriggerPacket
-from larpix.format.hdf5format import to_file, latest_version
+from larpix.format.hdf5format import FileWriter, trim_file, latest_version
 
 class HDF5Logger(Logger):
     '''
@@ -30,6 +33,81 @@ class HDF5Logger(Logger):
         default: '')
     :param version: the format version of LArPix+HDF5 to use (optional,
         default: ``larpix.format.hdf5format.latest_version``)
+    :param chunks: HDF5 chunk shape (number of rows) of the datasets
+        (optional, default: ``None``, chosen by h5py)
+    :param compression: compression filter of the datasets, e.g.
+        ``'gzip'`` or ``'lzf'`` (optional, default: ``None``)
+    :param compression_opts: compression filter settings, e.g. the
+        ``'gzip'`` level (optional, default: ``None``)
+    :param shuffle: ``True`` to apply the HDF5 shuffle filter (optional,
+        default: ``False``)
+    :param capacity: number of rows to allocate when creating the
+        ``packets`` dataset (optional, default: ``None``)
+    :param growth_factor: factor by which the datasets are grown when
+        they are full, the datasets are trimmed to their final size when
+        the logger is disabled (optional, default: ``None``, the datasets
+        are resized to the exact number of rows on each write). Until
+        then, the unused rows are zero-filled and are only skipped by
+        readers that use the ``n_rows`` attribute of the datasets (e.g.
+        ``larpix.format.hdf5format.from_file``), so only use this if the
+        files are not read by other tools before they are closed.
+    :param index_block_size: number of rows in each block of the
+        ``packet_index`` dataset, or ``True`` to use the HDF5 chunk size
+        (see ``larpix.format.hdf5format.query_file``) (optional, default:
+        ``None``, no index)
+    :param flush_interval: minimum time in seconds between flushes of the
+        written data to disk (optional, default: ``1``)
+    :param background_write: ``True`` to write to the file from a
+        dedicated writer thread (optional, default: ``False``)
+    :param queue_length: maximum number of flushed buffers waiting to be
+        written by the writer thread before ``record`` blocks (optional,
+        default: ``16``)
+    :param max_rows: start a new file once the current file has this many
+        ``packets`` rows (optional, default: ``None``)
+    :param max_bytes: start a new file once the current file is this many
+        bytes (optional, default: ``None``)
+    :param max_time: start a new file once the current file has been open
+        for this many seconds (optional, default: ``None``)
+
+    The file is kept open by a ``larpix.format.hdf5format.FileWriter``
+    from ``enable`` until ``disable``, so each flush of the buffer only
+    appends the new rows. After a flush, the written data is also flushed
+    to disk if more than ``flush_interval`` seconds have passed since the
+    last time, which limits how much data can be lost if the process
+    stops unexpectedly.
+
+    If any of ``max_rows``, ``max_bytes``, or ``max_time`` are set, the
+    data is split over a sequence of files. ``filename`` is then the base
+    name of the run, and the data is written to ``<base>_0000.h5``,
+    ``<base>_0001.h5``, and so on (``filename`` is updated to the current
+    file). The limits are checked before each write of the buffer, so a
+    file can exceed them by up to one buffer. When a file is full, it is
+    trimmed and closed and the next file is opened, and the run manifest
+    ``<base>_manifest.json`` is updated with the name, number of
+    ``packets`` rows, and open and close times of each completed file. The
+    manifest can be given to ``larpix.format.hdf5dataset.HDF5Dataset`` to
+    read the files of the run. In background write mode, the switch to the
+    next file is made by the writer thread, so it does not hold up
+    ``record``.
+
+    Undecoded PACMAN messages can also be logged, as ``(io_group,
+    message)`` tuples (e.g. from ``Controller.read(raw=True)``). These
+    are stored without decoding in the ``raw_messages`` datasets of the
+    file, along with the time they were recorded, and each message counts
+    as one row of the buffer. This keeps the cost of logging at high data
+    rates to a copy of the bytes; the messages can be decoded into the
+    ``packets`` dataset afterwards with
+    ``larpix.format.hdf5format.convert_raw_file``.
+
+    In background write mode, ``flush`` hands the buffered data to a
+    writer thread over a bounded queue instead of writing it directly. The
+    writer thread combines all of the buffers that are waiting into a
+    single write. If the writer thread falls behind and
+    the queue is full, ``flush`` (and therefore ``record``) blocks until
+    there is space again. How often and how long this happened is available
+    from ``write_queue_stats()``. ``disable`` waits for all queued data to
+    be written before closing the file. Any error raised in the writer
+    thread is raised again by the next ``flush`` or ``disable``.
 
     '''
     data_desc_map = {
@@ -41,19 +119,53 @@ class HDF5Logger(Logger):
     }
 
     def __init__(self, filename=None, buffer_length=10000,
-            directory='', version=latest_version, enabled=False):
+            directory='', version=latest_version, enabled=False,
+            chunks=None, compression=None, compression_opts=None,
+            shuffle=False, capacity=None, growth_factor=None,
+            index_block_size=None, flush_interval=1., background_write=False,
+            queue_length=16, max_rows=None, max_bytes=None, max_time=None):
         super(HDF5Logger, self).__init__(enabled=enabled)
         self.version = version
+        self.dataset_options = dict(chunks=chunks, compression=compression,
+            compression_opts=compression_opts, shuffle=shuffle,
+            capacity=capacity, index_block_size=index_block_size)
+        self.growth_factor = growth_factor
         self.filename = filename
         self.directory = directory
         self.datafile = None
         self.buffer_length = buffer_length
+        self.flush_interval = flush_interval
+        self.background_write = background_write
+        self.queue_length = queue_length
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_time = max_time
 
-        self._buffer = {'packets': []}
+        self._writer = None
+        self._last_disk_flush = 0
+        self._writer_opened = 0
+
+        self._write_queue = None
+        self._writer_thread = None
+        self._writer_error = None
+        self._write_stats = dict(blocked=0, blocked_time=0., max_queued=0,
+            written=0, writes=0)
+
+        self._buffer = {'packets': [], 'raw_messages': []}
+        self._buffer_rows = {'packets': 0, 'raw_messages': 0}
         if not self.filename:
             self.filename = self._default_filename()
         self.filename = os.path.join(self.directory, self.filename)
 
+        self.sequence = 0
+        self.manifest_filename = None
+        self._manifest_files = dict()
+        if self._rollover_enabled():
+            self._base_filename = self.filename
+            root = os.path.splitext(self._base_filename)[0]
+            self.manifest_filename = root + '_manifest.json'
+            self.filename = self._sequence_filename(self.sequence)
+
     def _default_filename(self, timestamp=None):
         '''
         Fetch the default filename based on a timestamp
@@ -76,7 +188,10 @@ class HDF5Logger(Logger):
         .. note:: buffer is flushed after all ``data`` is placed in buffer, this
             means that the buffer size will exceed the set value temporarily
 
-        :param data: list of data to be written to log
+        :param data: list of data to be written to log, or a numpy
+            structured array of packets (e.g. from
+            ``Controller.read(as_array=True)``). Raw PACMAN messages are
+            given as ``(io_group, message)`` tuples in the list.
         :param direction: ``Logger.WRITE`` if packets were sent to
             ASICs, ``Logger.READ`` if packets
             were received from ASICs. (default: ``Logger.WRITE``)
@@ -84,15 +199,24 @@ class HDF5Logger(Logger):
         '''
         if not self.is_enabled():
             return
-        if not isinstance(data, list):
+        if isinstance(data, np.ndarray):
+            data['direction'] = direction
+            self._buffer['packets'].append(data)
+            self._buffer_rows['packets'] += len(data)
+        elif not isinstance(data, list):
             raise ValueError('data must be a list')
+        else:
+            for data_obj in data:
+                if isinstance(data_obj, tuple):
+                    self._buffer['raw_messages'].append(data_obj + (time.time(),))
+                    self._buffer_rows['raw_messages'] += 1
+                    continue
+                data_obj.direction = direction
+                dataset = self.data_desc_map[type(data_obj)]
+                self._buffer[dataset].append(data_obj)
+                self._buffer_rows[dataset] += 1
 
-        for data_obj in data:
-            data_obj.direction = direction
-            dataset = self.data_desc_map[type(data_obj)]
-            self._buffer[dataset].append(data_obj)
-
-        if any([len(buff) > self.buffer_length for dataset, buff in self._buffer.items()]):
+        if any([n_rows > self.buffer_length for dataset, n_rows in self._buffer_rows.items()]):
             self.flush()
 
     def enable(self):
@@ -105,12 +229,223 @@ class HDF5Logger(Logger):
             initializing (Optional, default=``True``)
         '''
         super(HDF5Logger, self).enable()
-        to_file(self.filename, [], version=self.version)
+        self._open_writer()
+        if self.background_write:
+            self._start_writer()
+
+    def disable(self):
+        '''
+        Flush any held data and disable the logger. The datasets are
+        trimmed to the number of rows written.
+
+        '''
+        was_enabled = self.is_enabled()
+        super(HDF5Logger, self).disable()
+        self._stop_writer()
+        self._close_writer()
+        if was_enabled:
+            trim_file(self.filename)
+            if self._rollover_enabled():
+                self._write_manifest()
 
     def flush(self):
         '''
-        Flushes any held data to the output file
+        Flushes any held data to the output file (or to the writer thread
+        queue in background write mode)
+        '''
+        if self.background_write and self.is_enabled():
+            # the file is only opened and closed by the writer thread (and
+            # by enable/disable while it is stopped), otherwise a rollover
+            # could be interleaved with the file being reopened here
+            self._start_writer()
+            n_rows = sum(self._buffer_rows.values())
+            if n_rows:
+                self._enqueue((self._buffer, n_rows))
+        else:
+            self._open_writer()
+            self._write(self._buffer)
+        self._buffer = dict([(dataset, []) for dataset in self._buffer])
+        self._buffer_rows = dict([(dataset, 0) for dataset in self._buffer_rows])
+
+    def write_queue_stats(self):
+        '''
+        Statistics of the background writer queue
+
+        :returns: ``dict`` with the number of buffers waiting to be written
+            (``'queued'``), the maximum number of buffers that were waiting
+            (``'max_queued'``), the number of flushes that had to wait for
+            space in the queue (``'blocked'``) and the total time spent
+            waiting in seconds (``'blocked_time'``), and the number of rows
+            (``'written'``) and file writes (``'writes'``) completed by the
+            writer thread
+
+        '''
+        stats = dict(self._write_stats)
+        stats['queued'] = self._write_queue.qsize() if self._write_queue is not None else 0
+        return stats
+
+    def _open_writer(self):
+        if self._writer is None:
+            self._writer = FileWriter(self.filename, version=self.version,
+                growth_factor=self.growth_factor, **self.dataset_options)
+            self.datafile = self._writer.file
+            self._last_disk_flush = time.time()
+            self._writer_opened = self._last_disk_flush
+
+    def _close_writer(self):
+        if self._writer is not None:
+            if self._rollover_enabled():
+                entry = self._manifest_files.setdefault(self.sequence,
+                    dict(filename=os.path.basename(self.filename),
+                        sequence=self.sequence, opened=self._writer_opened))
+                entry['n_rows'] = self._writer.n_packets
+                entry['closed'] = time.time()
+            self._writer.close()
+            self._writer = None
+            self.datafile = None
+
+    def _rollover_enabled(self):
+        return any([limit is not None for limit in
+            (self.max_rows, self.max_bytes, self.max_time)])
+
+    def _sequence_filename(self, sequence):
+        root, ext = os.path.splitext(self._base_filename)
+        return '{}_{:04d}{}'.format(root, sequence, ext)
+
+    def _rollover_due(self):
+        if not (self._writer.n_packets or self._writer.n_raw_messages):
+            return False
+        if self.max_rows is not None and self._writer.n_packets >= self.max_rows:
+            return True
+        if self.max_bytes is not None and self._writer.file.id.get_filesize() >= self.max_bytes:
+            return True
+        if self.max_time is not None and time.time() - self._writer_opened >= self.max_time:
+            return True
+        return False
+
+    def _rollover(self):
+        '''
+        Trim and close the current file, update the run manifest, and open
+        the next file of the sequence
+
+        '''
+        trim_file(self._writer.file)
+        self._close_writer()
+        self._write_manifest()
+        self.sequence += 1
+        self.filename = self._sequence_filename(self.sequence)
+        self._open_writer()
+
+    def _write_manifest(self):
+        '''
+        Write the run manifest, replacing the previous version in a single
+        step so that it is always complete
+
+        '''
+        manifest = dict(
+            base_filename=os.path.basename(self._base_filename),
+            version=self.version,
+            max_rows=self.max_rows,
+            max_bytes=self.max_bytes,
+            max_time=self.max_time,
+            files=[self._manifest_files[sequence]
+                for sequence in sorted(self._manifest_files)],
+            )
+        tmp_filename = self.manifest_filename + '.tmp'
+        with open(tmp_filename, 'w') as of:
+            json.dump(manifest, of, indent=4)
+        os.replace(tmp_filename, self.manifest_filename)
+
+    def _write(self, buffer):
+        '''
+        Append the buffered data to the file, and flush it to disk if
+        ``flush_interval`` has passed. If the current file is full, the
+        next file is opened first, so that no empty files are created.
+
+        '''
+        if (self._rollover_enabled() and any(buffer.values())
+                and self._rollover_due()):
+            self._rollover()
+        self._writer.write(buffer['packets'])
+        if buffer['raw_messages']:
+            io_groups, messages, receipt_times = zip(*buffer['raw_messages'])
+            self._writer.write_raw_messages(messages, io_groups, receipt_times)
+        now = time.time()
+        if now - self._last_disk_flush > self.flush_interval:
+            self._writer.flush()
+            self._last_disk_flush = now
+
+    def _raise_writer_error(self):
+        if self._writer_error is not None:
+            err, self._writer_error = self._writer_error, None
+            raise err
+
+    def _start_writer(self):
+        if self._writer_thread is not None:
+            return
+        self._raise_writer_error()
+        self._write_queue = queue.Queue(maxsize=self.queue_length)
+        self._writer_thread = threading.Thread(target=self._write_loop,
+            name='HDF5Logger writer', daemon=True)
+        self._writer_thread.start()
+
+    def _stop_writer(self):
+        if self._writer_thread is None:
+            return
+        self._enqueue(None)
+        self._writer_thread.join()
+        self._writer_thread = None
+        self._write_queue = None
+        self._raise_writer_error()
+
+    def _enqueue(self, item):
+        '''
+        Put an item in the writer queue, waiting for space if it is full
+
+        '''
+        try:
+            self._write_queue.put_nowait(item)
+        except queue.Full:
+            self._write_stats['blocked'] += 1
+            start = time.time()
+            while True:
+                if not self._writer_thread.is_alive():
+                    self._raise_writer_error()
+                    raise RuntimeError('HDF5Logger writer thread has stopped')
+                try:
+                    self._write_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            self._write_stats['blocked_time'] += time.time() - start
+        self._write_stats['max_queued'] = max(self._write_stats['max_queued'],
+            self._write_queue.qsize())
+
+    def _write_loop(self):
+        '''
+        Writer thread: combine all of the queued buffers and write them to
+        the open file until the stop signal (``None``) is received
+
         '''
-        to_file(self.filename, self._buffer['packets'],
-                version=self.version)
-        self._buffer['packets'] = []
+        try:
+            stop = False
+            while not stop:
+                items = [self._write_queue.get()]
+                while True:
+                    try:
+                        items.append(self._write_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in items:
+                    stop = True
+                    items = items[:items.index(None)]
+                if not items:
+                    continue
+                self._open_writer()
+                self._write(dict([
+                    (dataset, [data for buffer, _ in items for data in buffer[dataset]])
+                    for dataset in self._buffer]))
+                self._write_stats['written'] += sum([n_rows for _, n_rows in items])
+                self._write_stats['writes'] += 1
+        except Exception as err:
+            self._writer_error = err
@@ -26,7 +26,7 @@ class Logger(object):
         '''
         Log specified data.
 
-        :param data: ``list`` of data to be written to log. Valid data types are specified by logger implementation. Raises a ``ValueError`` if datatype is invalid.
+        :param data: ``list`` of data to be written to log, or a numpy structured array of packets with the LArPix+HDF5 v2.3 ``packets`` dtype (e.g. from ``Controller.read(as_array=True)``). Valid data types are specified by logger implementation. Raises a ``ValueError`` if datatype is invalid.
         :param direction: ``Logger.WRITE`` if packets were sent to
             ASICs, ``Logger.READ`` if packets
             were received from ASICs. (default: ``Logger.WRITE``)
@@ -1,5 +1,6 @@
 from __future__ import print_function
 import time
+import numpy as np
 
 from larpix.logger import Logger
 
@@ -22,14 +23,16 @@ class StdoutLogger(Logger):
         '''
         Send the specified data to stdout
 
-        :param data: list of data to be written to log
+        :param data: list of data to be written to log, or a numpy
+            structured array of packets (e.g. from
+            ``Controller.read(as_array=True)``), logged one row at a time
         :param direction: 0 if packets were sent to ASICs, 1 if packets
             were received from ASICs. optional, default=0
         '''
         if not self.is_enabled():
             return
-        if not isinstance(data,list):
-            raise ValueError('data must be a list')
+        if not isinstance(data,(list,np.ndarray)):
+            raise ValueError('data must be a list or array')
 
         self._buffer += ['Record: {}'.format(str(data_obj)) for data_obj in data]
 
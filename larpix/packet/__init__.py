@@ -7,3 +7,4 @@ from .sync_packet import *
 Packet = Packet_v2
 
 from .packet_collection import *
+from .packet_array import *
@@ -0,0 +1,378 @@
+import numpy as np
+
+from ..key import Key
+from .packet_v2 import Packet_v2
+
+#: The dtype of the ``PacketArray.data`` array
+packet_array_dtype = np.dtype([
+        ('word', '<u8'),
+        ('io_group', 'u1'),
+        ('io_channel', 'u1'),
+        ('receipt_timestamp', 'u4'),
+        ('direction', 'u1'),
+        ])
+
+class PacketArray(object):
+    '''
+    A group of ``Packet_v2`` packets stored in a numpy structured array
+    (see ``packet_array_dtype``) of the 64 bit packet words along with
+    their ``io_group``, ``io_channel``, ``receipt_timestamp``, and
+    ``direction``. It has the same interface as ``PacketCollection``, but
+    selections and group-by operations are evaluated on all of the
+    packets at once with numpy.
+
+    Index into the PacketArray as if it were a list:
+
+        >>> array[0]
+        Packet_v2(b'\x07\x00\x00\x00\x00\x00\x00\x00')
+        >>> first_ten = array[:10]
+        >>> type(first_ten)
+        larpix.larpix.PacketArray
+        >>> data_packets = array[array.mask(packet_type=0)]
+
+    Indexing a single element creates a new ``Packet_v2`` from the stored
+    values, so modifying the packet does not modify the array. Slices,
+    index arrays, and boolean masks give a new ``PacketArray``.
+
+    Packets that are not ``Packet_v2`` objects (e.g. ``TimestampPacket``)
+    are not stored. Packets without an ``io_group`` or ``io_channel``, or
+    ``receipt_timestamp``, or ``direction`` are stored with ``0``.
+
+    :param packets: a list of packet objects, an array of packet words,
+        or a ``packet_array_dtype`` array (used as-is)
+    :param fifo_diagnostics_enabled: ``True`` to interpret the data packets
+        in FIFO diagnostics mode (see ``Packet_v2``) (optional, default:
+        ``Packet_v2.fifo_diagnostics_enabled``)
+
+    The other parameters are the same as for ``PacketCollection``.
+
+    '''
+    # attributes that are stored in the bits of the packet word
+    _word_fields = ('packet_type', 'chip_id', 'downstream_marker', 'parity',
+        'channel_id', 'timestamp', 'first_packet', 'dataword',
+        'trigger_type', 'local_fifo', 'shared_fifo', 'register_address',
+        'register_data')
+
+    def __init__(self, packets=None, bytestream=None, message='',
+            read_id=None, skipped=None, fifo_diagnostics_enabled=None):
+        if packets is None:
+            packets = np.zeros((0,), dtype=packet_array_dtype)
+        elif isinstance(packets, np.ndarray) and packets.dtype == packet_array_dtype:
+            pass
+        elif isinstance(packets, np.ndarray):
+            words = packets
+            packets = np.zeros(words.shape, dtype=packet_array_dtype)
+            packets['word'] = words
+        else:
+            packets = self._from_packets(packets)
+        self.data = packets
+        if fifo_diagnostics_enabled is None:
+            fifo_diagnostics_enabled = Packet_v2.fifo_diagnostics_enabled
+        self.fifo_diagnostics_enabled = fifo_diagnostics_enabled
+        self.bytestream = bytestream
+        self.skipped = skipped
+        self.message = message
+        self.read_id = read_id
+        self.parent = None
+
+    @staticmethod
+    def _from_packets(packets):
+        packets = [packet for packet in packets if isinstance(packet, Packet_v2)]
+        data = np.zeros((len(packets),), dtype=packet_array_dtype)
+        data['word'] = np.frombuffer(b''.join([packet.bytes() for packet in packets]),
+            dtype='<u8')
+        data['io_group'] = [packet.io_group or 0 for packet in packets]
+        data['io_channel'] = [packet.io_channel or 0 for packet in packets]
+        data['receipt_timestamp'] = [getattr(packet, 'receipt_timestamp', 0) or 0
+            for packet in packets]
+        data['direction'] = [getattr(packet, 'direction', 0) or 0 for packet in packets]
+        return data
+
+    def _subset(self, key, message):
+        items = PacketArray(self.data[key], message=message,
+            read_id=self.read_id,
+            fifo_diagnostics_enabled=self.fifo_diagnostics_enabled)
+        items.parent = self
+        return items
+
+    def __eq__(self, other):
+        '''
+        Return True if the packets, message and bytestream compare equal.
+
+        '''
+        if isinstance(other, PacketArray):
+            packets_equal = np.array_equal(self.data['word'], other.data['word'])
+        else:
+            packets_equal = self.packets == other.packets
+        return (packets_equal and
+                self.message == other.message and
+                self.bytestream == other.bytestream)
+
+    def __repr__(self):
+        return '<%s with %d packets, read_id %s, "%s">' % (self.__class__.__name__,
+                len(self), self.read_id, self.message)
+
+    def __str__(self):
+        if len(self) < 20:
+            return '\n'.join(str(packet) for packet in self)
+        else:
+            beginning = '\n'.join(str(self[i]) for i in range(10))
+            middle = '\n'.join(['   .', '   . omitted %d packets' %
+                (len(self)-20), '   .'])
+            end = '\n'.join(str(self[i]) for i in range(-10, 0))
+            return '\n'.join([beginning, middle, end])
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._packet(i)
+
+    def __getitem__(self, key):
+        '''
+        Get the specified item(s).
+
+        If key is an int, return a ``Packet_v2`` with the values at that
+        index.
+
+        If key is a slice, an array of indices, or a boolean mask, return
+        a PacketArray with the specified packets, and with a message
+        inherited from self.message.
+
+        If key is (slice or int, 'str'), use the behavior as if setting
+        key = key[0].
+
+        If key is (int, 'bits') or (slice, 'bits'), return a string (or
+        list of strings) representation of the bits as in
+        ``PacketCollection``.
+
+        '''
+        if isinstance(key, tuple):
+            if key[1] == 'bits':
+                return self._bits_getitem(key[0])
+            elif key[1] == 'str':
+                return self[key[0]]
+        elif isinstance(key, (slice, np.ndarray, list)):
+            return self._subset(key, '%s | subset %s' % (self.message,
+                key if isinstance(key, slice) else 'array'))
+        else:
+            return self._packet(key)
+
+    def _packet(self, index):
+        row = self.data[index]
+        packet = Packet_v2(int(row['word']).to_bytes(8, 'little'))
+        packet.io_group = int(row['io_group'])
+        packet.io_channel = int(row['io_channel'])
+        packet.receipt_timestamp = int(row['receipt_timestamp'])
+        packet.direction = int(row['direction'])
+        if self.fifo_diagnostics_enabled != Packet_v2.fifo_diagnostics_enabled:
+            packet.fifo_diagnostics_enabled = self.fifo_diagnostics_enabled
+        return packet
+
+    def _bits_getitem(self, key):
+        '''
+        Replace each packet with a string of the packet bits grouped 8
+        bits at a time.
+
+        '''
+        def bits_str(word):
+            bits = format(int(word), '064b')[::-1]
+            return ' '.join(bits[i:i+8] for i in range(0, Packet_v2.size, 8))
+        if isinstance(key, slice):
+            return [bits_str(word) for word in self.data['word'][key]]
+        return bits_str(self.data['word'][key])
+
+    @property
+    def packets(self):
+        '''
+        A list of ``Packet_v2`` objects for all of the packets
+
+        '''
+        return list(self)
+
+    def to_dict(self):
+        '''
+        Export the information in this PacketArray to a dict (in the same
+        format as ``PacketCollection.to_dict``).
+
+        '''
+        d = {}
+        d['packets'] = [packet.export() for packet in self]
+        d['id'] = id(self)
+        d['parent'] = 'None' if self.parent is None else id(self.parent)
+        d['message'] = str(self.message)
+        d['read_id'] = 'None' if self.read_id is None else self.read_id
+        d['bytestream'] = ('None' if self.bytestream is None else
+                self.bytestream.decode('raw_unicode_escape'))
+        return d
+
+    def from_dict(self, d):
+        '''
+        Load the information in the dict into this PacketArray.
+
+        '''
+        self.message = d['message']
+        self.read_id = d['read_id']
+        self.bytestream = d['bytestream'].encode('raw_unicode_escape')
+        self.parent = None
+        words = [int(p['bits'][::-1], 2) for p in d['packets']]
+        self.data = np.zeros((len(words),), dtype=packet_array_dtype)
+        self.data['word'] = words
+
+    def column(self, attr):
+        '''
+        Get the values of an attribute of all of the packets as a numpy
+        array. Any attribute stored in the bits of the packet word (e.g.
+        ``chip_id`` or ``timestamp``), or stored in ``data`` (e.g.
+        ``io_group``) is valid, as well as ``local_fifo_half``,
+        ``local_fifo_full``, ``shared_fifo_half``, ``shared_fifo_full``,
+        ``local_fifo_events``, and ``shared_fifo_events``. ``chip_key`` gives
+        an array of ``Key`` objects.
+
+        :raises AttributeError: if ``attr`` is not a valid attribute
+
+        '''
+        if attr in packet_array_dtype.names:
+            return self.data[attr]
+        if attr == 'chip_key':
+            unique, inverse = np.unique(self._chip_key_ints(), return_inverse=True)
+            keys = np.empty(len(unique), dtype=object)
+            keys[:] = [Key(int(key) >> 16, (int(key) >> 8) & 0xff, int(key) & 0xff)
+                for key in unique]
+            return keys[inverse]
+        if attr in ('local_fifo_half', 'shared_fifo_half'):
+            return self.column(attr[:-5]) % 2
+        if attr in ('local_fifo_full', 'shared_fifo_full'):
+            return self.column(attr[:-5]) // 2
+        if attr == 'timestamp' and self.fifo_diagnostics_enabled:
+            return self._word_field(Packet_v2.fifo_diagnostics_timestamp_bits)
+        if attr in ('local_fifo_events', 'shared_fifo_events'):
+            if not self.fifo_diagnostics_enabled:
+                raise AttributeError('{} requires fifo_diagnostics_enabled'.format(attr))
+            return self._word_field(getattr(Packet_v2, attr + '_bits'))
+        if attr in self._word_fields:
+            return self._word_field(getattr(Packet_v2, attr + '_bits'))
+        raise AttributeError('PacketArray has no attribute {}'.format(attr))
+
+    def _word_field(self, bit_slice):
+        mask = (1 << (bit_slice.stop - bit_slice.start)) - 1
+        values = (self.data['word'] >> np.uint64(bit_slice.start)) & np.uint64(mask)
+        return values.astype(np.min_scalar_type(mask))
+
+    def _chip_key_ints(self):
+        return ((self.data['io_group'].astype('u4') << 16)
+            | (self.data['io_channel'].astype('u4') << 8)
+            | self.column('chip_id'))
+
+    def mask(self, **selection):
+        '''
+        Get a boolean mask of the packets that match all of the selections
+        (see ``extract``)
+
+        '''
+        mask = np.ones(len(self), dtype=bool)
+        for key, value in selection.items():
+            if key == 'chip_key':
+                value = Key(value)
+                mask &= self._chip_key_ints() == ((value.io_group << 16)
+                    | (value.io_channel << 8) | value.chip_id)
+            else:
+                mask &= self.column(key) == value
+        return mask
+
+    def extract(self, *attrs, **selection):
+        '''
+        Extract the given attribute(s) from packets specified by selection
+        and return a list (see ``PacketCollection.extract`` and ``column``
+        for the valid attributes).
+
+        Usage:
+
+        >>> # Return a list of adc counts from any data packets
+        >>> dataword = array.extract('dataword', packet_type=0)
+        >>> # Return multiple attributes
+        >>> chip_keys, channel_ids = zip(*array.extract('chip_key','channel_id'))
+
+        '''
+        try:
+            mask = self.mask(**selection)
+            columns = [self.column(attr)[mask].tolist() for attr in attrs]
+        except AttributeError:
+            # no packet has the attribute
+            return []
+        if len(attrs) > 1:
+            return [list(values) for values in zip(*columns)]
+        return columns[0]
+
+    def origin(self):
+        '''
+        Return the original PacketArray that this PacketArray derives
+        from.
+
+        '''
+        child = self
+        parent = self.parent
+        max_generations = 100  # to prevent infinite loops
+        i = 0
+        while parent is not None and i < max_generations:
+            # Move up the family tree one generation
+            child = parent
+            parent = parent.parent
+            i += 1
+        if parent is None:
+            return child
+        else:
+            raise ValueError('Reached limit on generations: %d' %
+                    max_generations)
+
+    def with_chip_key(self, chip_key):
+        '''
+        Return a PacketArray of the packets with the specified chip key.
+
+        '''
+        return self._subset(self.mask(chip_key=chip_key),
+            self.message + ' | chip {}'.format(chip_key))
+
+    def _group_by(self, values):
+        '''
+        Group the packets by value (keeping their order)
+
+        :returns: list of ``(value, indices)``
+
+        '''
+        unique, inverse = np.unique(values, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1]
+        return zip(unique.tolist(), np.split(order, bounds))
+
+    def by_chip_key(self):
+        '''
+        Return a dict of { chip_key: PacketArray }.
+
+        '''
+        to_return = {}
+        for key, indices in self._group_by(self._chip_key_ints()):
+            chip_key = Key(key >> 16, (key >> 8) & 0xff, key & 0xff)
+            to_return[chip_key] = self._subset(indices,
+                self.message + ' | chip {}'.format(chip_key))
+        return to_return
+
+    def with_chipid(self, chipid):
+        '''
+        Return a PacketArray of the packets with the specified chip ID.
+
+        '''
+        return self._subset(self.mask(chip_id=chipid),
+            self.message + ' | chip %s' % chipid)
+
+    def by_chipid(self):
+        '''
+        Return a dict of { chipid: PacketArray }.
+
+        '''
+        to_return = {}
+        for chipid, indices in self._group_by(self.column('chip_id')):
+            to_return[chipid] = self._subset(indices,
+                self.message + ' | chip %s' % chipid)
+        return to_return
@@ -1,14 +1,66 @@
+from operator import index
+
 from bitarray import bitarray
 
-from .. import bitarrayhelper as bah
 from ..key import Key
 
+class _PacketBits(bitarray):
+    '''
+    A ``bitarray`` copy of the bits of a ``Packet_v2`` that writes item
+    assignments (e.g. ``packet.bits[0] = 1``) back to the packet
+
+    '''
+    def __new__(cls, packet):
+        bits = super(_PacketBits, cls).__new__(cls, endian=packet.endian)
+        bits.frombytes(packet.bytes())
+        bits._packet = packet
+        return bits
+
+    def __setitem__(self, key, value):
+        super(_PacketBits, self).__setitem__(key, value)
+        packet = getattr(self, '_packet', None)
+        if packet is not None:
+            packet.bits = self
+
+try:
+    _popcount = int.bit_count
+except AttributeError: # python < 3.10
+    def _popcount(value):
+        return bin(value).count('1')
+
+def _field_accessors(bit_slice):
+    '''
+    Create the getter and setter of a field stored in ``bit_slice`` of the
+    packet word. The setter raises a ``ValueError`` if the value does not
+    fit in the field.
+
+    '''
+    shift = bit_slice.start
+    nbits = bit_slice.stop - bit_slice.start
+    mask = (1 << nbits) - 1
+    clear = ~(mask << shift)
+    def getter(self):
+        return (self._word >> shift) & mask
+    def setter(self, value):
+        try:
+            value = index(value)
+        except TypeError:
+            # a bitarray, assigned bit by bit starting from bit 0
+            if len(value) > nbits:
+                raise ValueError('{} bits do not fit in a {} bit field'.format(len(value), nbits))
+            value = int(value.to01()[::-1] or '0', 2)
+        if not 0 <= value <= mask:
+            raise ValueError('{} does not fit in a {} bit field'.format(value, nbits))
+        self._word = (self._word & clear) | (value << shift)
+    return getter, setter
+
 class Packet_v2(object):
     '''
     Representation of a 64 bit LArPix v2 (or LightPix v1) UART data packet.
 
-    Packet_v2 objects are internally represented as bitarrays, but a variety of
-    helper properties allow one to access and set the data stored in the bitarrays in
+    Packet_v2 objects are internally represented as a single 64 bit integer
+    (bit 0 is the first bit sent over the UART), but a variety of helper
+    properties allow one to access and set the data stored in the packet in
     a natural fashion. E.g.::
 
         p = Packet_v2() # initialize a packet of zeros
@@ -16,7 +68,13 @@ class Packet_v2(object):
         p.packet_type = 2 # set the packet type to a config write packet
         print(p.bits) # the bits have been updated!
 
-    Packet_v2 objects don't enforce any value validation, so set these fields with caution!
+    ``p.bits`` gives a copy of the packet bits as a ``bitarray``. Item
+    assignments to it are written back to the packet (e.g. ``p.bits[0] =
+    1``), and a new ``bitarray`` can be assigned to ``p.bits``.
+
+    Setting a field to a value that does not fit in its bits raises a
+    ``ValueError``, but Packet_v2 objects don't enforce any other value
+    validation, so set these fields with caution!
 
     In FIFO diagnostics mode, the bits are to be interpreted in a different way.
     At this point, there is no way for the ``Packet_v2`` to automatically know if it
@@ -70,19 +128,25 @@ class Packet_v2(object):
 
     endian = 'little'
 
+    # the packet word and the io attributes are kept in slots, other
+    # attributes (e.g. a per-packet ``fifo_diagnostics_enabled``) are stored
+    # in the instance dict
+    __slots__ = ('_word', '_io_group', '_io_channel', '_chip_key',
+        'direction', 'receipt_timestamp', '__dict__')
+
     def __init__(self, bytestream=None):
+        # the io and chip key slots are only filled when they are set
         if bytestream is None:
-            self.bits = bitarray(self.size,endian=self.endian)
-            self.bits.setall(False)
-            return
-        elif len(bytestream) == self.num_bytes:
-            self.bits = bitarray(endian=self.endian)
-            self.bits.frombytes(bytestream)
+            self._word = 0
+        elif len(bytestream) == 8:
+            self._word = int.from_bytes(bytestream, 'little')
         else:
             raise ValueError('Invalid number of bytes: %s' %
                     len(bytestream))
 
     def __eq__(self, other):
+        if isinstance(other, Packet_v2):
+            return self._word == other._word
         return self.bits == other.bits
 
     def __ne__(self, other):
@@ -151,7 +215,19 @@ class Packet_v2(object):
         Byte 0 is still the first byte to send out and contains bits [0:7]
 
         '''
-        return self.bits.tobytes() #[::-1]
+        return self._word.to_bytes(8, 'little')
+
+    @property
+    def bits(self):
+        '''
+        The packet bits as a ``bitarray`` (see ``Packet_v2``)
+
+        '''
+        return _PacketBits(self)
+
+    @bits.setter
+    def bits(self, value):
+        self._word = int(value.to01()[::-1] or '0', 2)
 
     def export(self):
         '''
@@ -169,7 +245,7 @@ class Packet_v2(object):
         d['chip_key'] = str(self.chip_key) if self.chip_key else None
         d['io_group'] = self.io_group
         d['io_channel'] = self.io_channel
-        d['bits'] = self.bits.to01()
+        d['bits'] = format(self._word, '064b')[::-1]
         d['type_str'] = type_map[self.packet_type]
         d['packet_type'] = self.packet_type
         d['chip_id'] = self.chip_id
@@ -224,18 +300,21 @@ class Packet_v2(object):
     @property
     def chip_key(self):
         ''''''
-        if hasattr(self, '_chip_key'):
-            return self._chip_key
-        if self.io_group is None or self.io_channel is None:
+        try:
+            if self._chip_key is not None:
+                return self._chip_key
+        except AttributeError:
+            pass
+        io_group, io_channel = self.io_group, self.io_channel
+        if io_group is None or io_channel is None:
             return None
-        self._chip_key = Key(self.io_group, self.io_channel, self.chip_id)
+        self._chip_key = Key(io_group, io_channel, self.chip_id)
         return self._chip_key
 
     @chip_key.setter
     def chip_key(self, value):
         # remove cached key
-        if hasattr(self, '_chip_key'):
-            del self._chip_key
+        self._chip_key = None
         if value is None:
             self.io_channel = None
             self.io_group = None
@@ -251,52 +330,51 @@ class Packet_v2(object):
     @property
     def io_group(self):
         ''''''
-        if hasattr(self, '_io_group'):
+        try:
             return self._io_group
-        return None
+        except AttributeError:
+            return None
 
     @io_group.setter
     def io_group(self, value):
-        if hasattr(self, '_chip_key'):
-            # remove cached key
-            del self._chip_key
-        if value is None:
-            if hasattr(self, '_io_group'):
-                del self._io_group
-            return
+        # remove cached key
+        self._chip_key = None
         # no value validation!
         self._io_group = value
 
     @property
     def io_channel(self):
-        if hasattr(self, '_io_channel'):
+        try:
             return self._io_channel
-        return None
+        except AttributeError:
+            return None
 
     @io_channel.setter
     def io_channel(self, value):
-        if hasattr(self, '_chip_key'):
-            # remove cached key
-            del self._chip_key
-        if value is None:
-            if hasattr(self, '_io_channel'):
-                del self._io_channel
-            return
+        # remove cached key
+        self._chip_key = None
         # no value validation!
         self._io_channel = value
 
+    _get_timestamp, _set_timestamp = _field_accessors(timestamp_bits)
+    _get_fifo_diagnostics_timestamp, _set_fifo_diagnostics_timestamp = \
+        _field_accessors(fifo_diagnostics_timestamp_bits)
+    _get_local_fifo_events, _set_local_fifo_events = _field_accessors(local_fifo_events_bits)
+    _get_shared_fifo_events, _set_shared_fifo_events = _field_accessors(shared_fifo_events_bits)
+    _parity_calc_mask = (1 << parity_calc_bits.stop) - 1
+
     @property
     def timestamp(self):
         if self.fifo_diagnostics_enabled:
-            return bah.touint(self.bits[self.fifo_diagnostics_timestamp_bits], endian=self.endian)
-        return bah.touint(self.bits[self.timestamp_bits], endian=self.endian)
+            return self._get_fifo_diagnostics_timestamp()
+        return self._get_timestamp()
 
     @timestamp.setter
     def timestamp(self, value):
         if self.fifo_diagnostics_enabled:
-            self.bits[self.fifo_diagnostics_timestamp_bits] = bah.fromuint(value, self.fifo_diagnostics_timestamp_bits, endian=self.endian)
+            self._set_fifo_diagnostics_timestamp(value)
         else:
-            self.bits[self.timestamp_bits] = bah.fromuint(value, self.timestamp_bits, endian=self.endian)
+            self._set_timestamp(value)
 
     @property
     def local_fifo_half(self):
@@ -331,7 +409,7 @@ class Packet_v2(object):
         self.shared_fifo = value*2 + self.shared_fifo_half
 
     def compute_parity(self):
-        return 1 - (self.bits[self.parity_calc_bits].count(True) % 2)
+        return 1 - (_popcount(self._word & self._parity_calc_mask) % 2)
 
     def assign_parity(self):
         self.parity = self.compute_parity()
@@ -342,61 +420,44 @@ class Packet_v2(object):
     @property
     def local_fifo_events(self):
         if self.fifo_diagnostics_enabled:
-            bit_slice = self.local_fifo_events_bits
-            return bah.touint(self.bits[bit_slice], endian=self.endian)
+            return self._get_local_fifo_events()
         return None
 
     @local_fifo_events.setter
     def local_fifo_events(self, value):
         if self.fifo_diagnostics_enabled:
-            bit_slice = self.local_fifo_events_bits
-            self.bits[bit_slice] = bah.fromuint(value, bit_slice, endian=self.endian)
+            self._set_local_fifo_events(value)
 
     @property
     def shared_fifo_events(self):
         if self.fifo_diagnostics_enabled:
-            bit_slice = self.shared_fifo_events_bits
-            return bah.touint(self.bits[bit_slice], endian=self.endian)
+            return self._get_shared_fifo_events()
         return None
 
     @shared_fifo_events.setter
     def shared_fifo_events(self, value):
         if self.fifo_diagnostics_enabled:
-            bit_slice = self.shared_fifo_events_bits
-            self.bits[bit_slice] = bah.fromuint(value, bit_slice, endian=self.endian)
+            self._set_shared_fifo_events(value)
+
+    _get_chip_id, _set_chip_id = _field_accessors(chip_id_bits)
 
     @property
     def chip_id(self):
-        bit_slice = self.chip_id_bits
-        return bah.touint(self.bits[bit_slice], endian=self.endian)
+        return self._get_chip_id()
 
     @chip_id.setter
     def chip_id(self, value):
-        if hasattr(self,'_chip_key'):
-            del self._chip_key
-        bit_slice = self.chip_id_bits
-        self.bits[bit_slice] = bah.fromuint(value, bit_slice, endian=self.endian)
-
-    def _basic_getter(name):
-        def basic_getter_func(self):
-            bit_slice = getattr(self, name + '_bits')
-            return bah.touint(self.bits[bit_slice], endian=self.endian)
-        return basic_getter_func
-
-    def _basic_setter(name):
-        def basic_setter_func(self, value):
-            bit_slice = getattr(self, name + '_bits')
-            self.bits[bit_slice] = bah.fromuint(value, bit_slice, endian=self.endian)
-        return basic_setter_func
-
-    packet_type = property(_basic_getter('packet_type'),_basic_setter('packet_type'))
-    downstream_marker = property(_basic_getter('downstream_marker'),_basic_setter('downstream_marker'))
-    parity = property(_basic_getter('parity'),_basic_setter('parity'))
-    channel_id = property(_basic_getter('channel_id'),_basic_setter('channel_id'))
-    dataword = property(_basic_getter('dataword'),_basic_setter('dataword'))
-    first_packet = property(_basic_getter('first_packet'),_basic_setter('first_packet'))
-    trigger_type = property(_basic_getter('trigger_type'),_basic_setter('trigger_type'))
-    register_address = property(_basic_getter('register_address'),_basic_setter('register_address'))
-    register_data = property(_basic_getter('register_data'),_basic_setter('register_data'))
-    local_fifo = property(_basic_getter('local_fifo'),_basic_setter('local_fifo'))
-    shared_fifo = property(_basic_getter('shared_fifo'),_basic_setter('shared_fifo'))
+        self._chip_key = None
+        self._set_chip_id(value)
+
+    packet_type = property(*_field_accessors(packet_type_bits))
+    downstream_marker = property(*_field_accessors(downstream_marker_bits))
+    parity = property(*_field_accessors(parity_bits))
+    channel_id = property(*_field_accessors(channel_id_bits))
+    dataword = property(*_field_accessors(dataword_bits))
+    first_packet = property(*_field_accessors(first_packet_bits))
+    trigger_type = property(*_field_accessors(trigger_type_bits))
+    register_address = property(*_field_accessors(register_address_bits))
+    register_data = property(*_field_accessors(register_data_bits))
+    local_fifo = property(*_field_accessors(local_fifo_bits))
+    shared_fifo = property(*_field_accessors(shared_fifo_bits))
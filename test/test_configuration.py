@@ -229,3 +229,35 @@ def test_get_nondefault_registers():
             'csa_enable': [({'index': 35, 'value': 0}, {'index': 35,
                 'value': 1})],
             }
+
+def _all_data_from_registers(c):
+    bits = [None] * c.num_registers
+    for register in c.register_names:
+        for addr, register_bits in getattr(c, register+'_data'):
+            if bits[addr] is None:
+                bits[addr] = register_bits
+    return bits
+
+def test_register_image():
+    c = Configuration_v2()
+    assert c.all_data() == _all_data_from_registers(c)
+    assert c.dirty_registers == list(range(c.num_registers))
+
+    c.clear_dirty()
+    c.threshold_global = 40
+    c.pixel_trim_dac[3] = 2
+    c.channel_mask[20] = 1 - c.channel_mask[20]
+    c.enable_miso_differential = [1, 0, 1, 0]
+    c.periodic_trigger_cycles = 0x12345678
+    c.csa_gain = c.csa_gain # unchanged
+    assert c.dirty_registers == [3, 64, 125, 133, 166, 167, 168, 169]
+    assert c.register_image[64] == 40
+    assert c.all_data() == _all_data_from_registers(c)
+    assert c.all_data(endian='big') == [bits[::-1] for bits in _all_data_from_registers(c)]
+
+    c.clear_dirty([3, 64])
+    assert c.dirty_registers == [125, 133, 166, 167, 168, 169]
+    c.digital_threshold_data = (180, bah.fromuint(7, 8, endian='little'))
+    assert c.digital_threshold[7] == 7
+    assert c.register_image[180] == 7
+    assert 180 in c.dirty_registers
@@ -98,3 +98,22 @@ def test_get_nondefault_registers():
             'hit_threshold': (8,16),
             'timeout': (34, 30)
             }
+
+def test_lightpix_registers_written():
+    from larpix import Chip
+    chip = Chip('1-1-12', version='lightpix-v1.0')
+    c = chip.config
+    c.lightpix_mode = 1
+    c.hit_threshold = 3
+    c.timeout = 34
+    all_data = c.all_data()
+    assert len(all_data) == 239
+    assert all_data[237] == bitarray('11100000')
+    assert all_data[238] == bah.fromuint(34, 8, endian='little')
+
+    packets = chip.get_configuration_write_packets()
+    assert [p.register_address for p in packets] == list(range(239))
+    assert packets[237].register_data == 0b111
+    assert packets[238].register_data == 34
+    packets = chip.get_configuration_write_packets(registers=[237, 238])
+    assert [(p.register_address, p.register_data) for p in packets] == [(237, 0b111), (238, 34)]
@@ -1,8 +1,9 @@
 import pytest
 import json
 
-from larpix import Controller, Configuration_v2, Key
+from larpix import Controller, Configuration_v2, Key, Packet_v2
 from larpix.io import FakeIO
+import larpix.bitarrayhelper as bah
 
 @pytest.fixture
 def network_config_old(tmpdir):
@@ -248,6 +249,10 @@ def test_controller_reset(network_controller_old, network_controller_new):
         chip_id_config_packet.chip_id = 13
         assert c.io.sent[-1][-2] == chip_id_config_packet
         assert c.io.sent[-1][-1] == c['1-1-12'].get_configuration_write_packets(registers=Configuration_v2.register_map['enable_miso_upstream'])[0]
+        assert c['1-1-13'].asic_registers == {}
+        enable_miso_upstream_register = Configuration_v2.register_map['enable_miso_upstream'][0]
+        assert (c['1-1-12'].asic_registers[enable_miso_upstream_register]
+            == c['1-1-12'].config.register_image[enable_miso_upstream_register])
 
         c.reset_network(1,1)
         for chip_key in c.chips:
@@ -257,6 +262,18 @@ def test_controller_reset(network_controller_old, network_controller_new):
             assert c[chip_key].config.enable_miso_downstream == [0,0,0,0]
             assert c[chip_key].config.enable_mosi == [1,1,1,1]
 
+def test_controller_reset_dummy_node(network_controller_old, network_controller_new):
+    for c in (network_controller_old, network_controller_new):
+        c.init_network(1,1)
+        # a node without a chip object, e.g. an external device, only
+        # disables the miso_us uart of its parent chip
+        c.add_network_node(1,1,c.network_names,'dummy')
+        c.add_network_link(1,1,'miso_us',(13,'dummy'),1)
+        c['1-1-13'].config.enable_miso_upstream[1] = 1
+        c.reset_network(1,1,'dummy')
+        assert c['1-1-13'].config.enable_miso_upstream[1] == 0
+        assert c.io.sent[-1] == c['1-1-13'].get_configuration_write_packets(registers=Configuration_v2.register_map['enable_miso_upstream'])
+
 def test_controller_network_traversal(network_controller_old, network_controller_new):
     for c in (network_controller_old, network_controller_new):
         c = network_controller_new
@@ -273,3 +290,183 @@ def test_controller_network_traversal(network_controller_old, network_controller
         assert set(keys[1:3]) == set(['1-1-3','1-1-12'])
         assert keys[3] == '1-1-2'
 
+
+class LoopbackIO(FakeIO):
+    '''
+    Replies to configuration reads with the controller's current chip configurations
+
+    '''
+    def __init__(self, controller):
+        super(LoopbackIO, self).__init__()
+        self.controller = controller
+
+    def send(self, packets):
+        self.sent.append(packets)
+        replies = list()
+        for packet in packets:
+            if packet.packet_type == Packet_v2.CONFIG_READ_PACKET:
+                reply = self.controller[packet.chip_key].get_configuration_write_packets(registers=[packet.register_address])[0]
+                reply.packet_type = Packet_v2.CONFIG_READ_PACKET
+                replies.append(reply)
+        if replies:
+            self.queue.append((replies, b''))
+
+def test_controller_network_layers(network_controller_old, network_controller_new):
+    for c in (network_controller_old, network_controller_new):
+        layers = c.get_network_layers(1,1)
+        assert layers[0] == ['ext']
+        assert layers[1] == [2]
+        assert set(layers[2]) == set([3,12])
+        assert layers[3] == [13]
+        assert c.get_network_ids(1,1) == sum(layers, [])
+
+        # a chip reachable from two chips of the same layer appears once
+        c.add_network_link(1,1,'miso_us',(3,13),1)
+        assert c.get_network_layers(1,1) == layers
+        assert c.get_network_ids(1,1) == sum(layers, [])
+        assert c.get_network_ids(1,1,root_first_traversal=False) == sum(layers, [])[::-1]
+
+def test_controller_init_network_layers(network_controller_old, network_controller_new, network_config_new):
+    expected = Controller()
+    expected.load(network_config_new)
+    expected.io = FakeIO()
+    expected.init_network(1,1)
+    for c in (network_controller_old, network_controller_new):
+        c.io = LoopbackIO(c)
+        ok, diff = c.init_network_layers(timeout=1)
+        assert ok
+        assert diff == {}
+        # one send and one read back per layer
+        assert len([packets for packets in c.io.sent
+            if packets[0].packet_type == Packet_v2.CONFIG_WRITE_PACKET]) == 3
+        assert len(c.reads) == 3
+        for chip_key in c.chips:
+            assert c[chip_key].config.all_data() == expected[chip_key].config.all_data()
+        sent = [packet for packets in c.io.sent for packet in packets
+            if packet.packet_type == Packet_v2.CONFIG_WRITE_PACKET]
+        expected_sent = [packet for packets in expected.io.sent for packet in packets]
+        assert sent == expected_sent
+
+class HydraGridIO(FakeIO):
+    '''
+    Simulates a grid of unconfigured v2 chips attached to an external root at
+    position (0,0). Commands reach a chip if it is the first chip or if a
+    neighbor that receives commands has enabled its miso_us uart towards the
+    chip. Replies reach the root if the chip has enabled its miso_ds uart
+    towards a neighbor (or the root) that can pass the replies on.
+
+    '''
+    directions = [(1,0),(0,1),(-1,0),(0,-1)]
+
+    def __init__(self, shape, miso_uart_map=[3,0,1,2], ext_uart=1):
+        super(HydraGridIO, self).__init__()
+        self.chips = dict([((x,y), Configuration_v2()) for x in range(shape[0]) for y in range(shape[1])])
+        self.uart_links = dict([(pos, dict()) for pos in self.chips])
+        for (x,y) in self.chips:
+            for idx, (dx,dy) in enumerate(self.directions):
+                if (x+dx,y+dy) in self.chips:
+                    self.uart_links[(x,y)][miso_uart_map[idx]] = (x+dx,y+dy)
+        self.ext_uart = ext_uart
+
+    def listening(self):
+        listening = set([(0,0)])
+        to_visit = [(0,0)]
+        while to_visit:
+            pos = to_visit.pop()
+            for uart, other in self.uart_links[pos].items():
+                if self.chips[pos].enable_miso_upstream[uart] and not other in listening:
+                    listening.add(other)
+                    to_visit.append(other)
+        return listening
+
+    def replying(self):
+        replying = set()
+        if self.chips[(0,0)].enable_miso_downstream[self.ext_uart]:
+            replying.add((0,0))
+        changed = True
+        while changed:
+            changed = False
+            for pos, config in self.chips.items():
+                if pos in replying:
+                    continue
+                if any([config.enable_miso_downstream[uart] and other in replying
+                        for uart, other in self.uart_links[pos].items()]):
+                    replying.add(pos)
+                    changed = True
+        return replying
+
+    def send(self, packets):
+        self.sent.append(packets)
+        replies = list()
+        for packet in packets:
+            listening = self.listening()
+            for pos in listening:
+                config = self.chips[pos]
+                if config.chip_id != packet.chip_id:
+                    continue
+                if packet.packet_type == Packet_v2.CONFIG_WRITE_PACKET:
+                    config.from_dict_registers({packet.register_address: packet.register_data})
+                elif packet.packet_type == Packet_v2.CONFIG_READ_PACKET and pos in self.replying():
+                    reply = Packet_v2(packet.bytes())
+                    reply.io_group = packet.io_group
+                    reply.io_channel = packet.io_channel
+                    reply.register_data = bah.touint(config.all_data()[packet.register_address], endian='little')
+                    replies.append(reply)
+        if replies:
+            self.queue.append((replies, b''))
+
+def _grid_positions(io):
+    return dict([(config.chip_id, pos) for pos, config in io.chips.items()])
+
+def _grid_links(c, io):
+    chip_positions = _grid_positions(io)
+    return set([(chip_positions[link[0]], chip_positions[link[1]])
+        for link in c.network[1][1]['miso_us'].edges() if link[0] != 'ext'])
+
+def test_controller_grow_network_layers(tmpdir):
+    expected = Controller()
+    expected.io = HydraGridIO((2,2))
+    expected.add_network_node(1, 1, expected.network_names, 'ext', root=True)
+    expected.grow_network(1, 1, 'ext')
+    assert len(expected.chips) == 4
+
+    network_file = str(tmpdir.join('test_grown_network.json'))
+    c = Controller()
+    c.io = HydraGridIO((2,2))
+    c.add_network_node(1, 1, c.network_names, 'ext', root=True)
+    c.grow_network_layers(1, 1, 'ext', network_file=network_file)
+    assert len(c.chips) == len(expected.chips)
+    assert sorted([config.chip_id for config in c.io.chips.values()]) == sorted([key.chip_id for key in c.chips])
+    assert _grid_links(c, c.io) == _grid_links(expected, expected.io)
+    assert [len(layer) for layer in c.get_network_layers(1,1)] == [1,1,2,1]
+    # one init send and one read back per network depth (+1 with no new chips)
+    assert len(c.reads) == 4
+    for chip_key in c.chips:
+        assert c[chip_key].config.all_data() == c.io.chips[_grid_positions(c.io)[chip_key.chip_id]].all_data()
+
+    # reload from cache
+    cached = Controller()
+    cached.io = FakeIO()
+    cached.grow_network_layers(1, 1, 'ext', network_file=network_file)
+    assert cached.io.sent == []
+    assert set(cached.chips) == set(c.chips)
+    for name in c.network_names:
+        assert set(cached.network[1][1][name].edges(data='uart')) == set(c.network[1][1][name].edges(data='uart'))
+    assert cached.get_network_layers(1,1) == c.get_network_layers(1,1)
+
+    # only the cached io channel is replaced
+    cached = Controller()
+    cached.io = FakeIO()
+    cached.add_chip('1-1-99')
+    cached.add_chip('1-2-5', root=True)
+    cached.add_chip('2-1-6', root=True)
+    cached.grow_network_layers(1, 1, 'ext', network_file=network_file)
+    assert cached.io.sent == []
+    assert set(cached.chips) == set(c.chips) | set([Key('1-2-5'), Key('2-1-6')])
+    assert cached.get_network_layers(1,1) == c.get_network_layers(1,1)
+    assert cached.get_network_ids(1,2) == [5]
+    assert cached.get_network_ids(2,1) == [6]
+
+    with pytest.raises(RuntimeError, match='io group 1 io channel 2'):
+        cached.grow_network_layers(1, 2, 5, network_file=network_file)
+    assert cached.get_network_ids(1,2) == [5]
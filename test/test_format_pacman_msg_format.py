@@ -1,3 +1,6 @@
+import pytest
+import numpy as np
+
 from larpix.format.pacman_msg_format import *
 from larpix import Packet_v2, TimestampPacket, SyncPacket, TriggerPacket
 
@@ -45,3 +48,100 @@ def test_packets():
     
     assert packets == new_packets[1:]
     assert isinstance(new_packets[0], TimestampPacket)
+
+def test_parse_to_array():
+    from larpix.format.hdf5format import _format_packets_packet_v2_3
+
+    packets = []
+    for i in range(100):
+        packets.append(Packet_v2())
+        packets[-1].io_channel = i % 4 + 1
+        packets[-1].packet_type = i % 4
+        packets[-1].chip_id = i
+        packets[-1].channel_id = i % 64
+        packets[-1].timestamp = 1000 * i
+        packets[-1].dataword = i
+        packets[-1].register_address = i
+        packets[-1].local_fifo = i % 4
+        packets[-1].shared_fifo = (i // 4) % 4
+        packets[-1].downstream_marker = i % 2
+        packets[-1].receipt_timestamp = 10 * i
+        if i % 3:
+            packets[-1].assign_parity()
+    packets.append(SyncPacket(timestamp=123456, sync_type=b'H', clk_source=1))
+    packets.append(TriggerPacket(timestamp=123456, trigger_type=b'\x01'))
+
+    msg = format(packets, msg_type='DATA')
+    arr = parse_to_array(msg, io_group=2)
+    new_packets = parse(msg, io_group=2)
+
+    assert arr.dtype == packet_dtype
+    assert len(arr) == len(new_packets)
+    for row, packet in zip(arr, new_packets):
+        expected = _format_packets_packet_v2_3(packet)
+        expected = tuple(0 if value is None else value for value in expected)
+        assert row.tolist() == expected
+
+    arr_payload, payload = parse_to_array(msg, io_group=2, return_payload=True)
+    assert (arr_payload == arr).all()
+    assert payload.dtype == np.dtype('<u8')
+    assert payload.tolist() == [0] + [int.from_bytes(p.bytes(), 'little') for p in packets[:-2]] + [0, 0]
+
+def test_format_tx():
+    packets = []
+    for i in range(100):
+        packets.append(Packet_v2())
+        packets[-1].io_channel = i % 32
+        packets[-1].chip_id = i
+        packets[-1].register_data = 255 - i
+        packets[-1].assign_parity()
+    packets.append(TimestampPacket(timestamp=123456))
+
+    msg = format(packets, msg_type='REQ')
+    msg_tx = format_tx(packets)
+    assert msg_tx[:1] == msg[:1]
+    assert msg_tx[6:] == msg[6:]
+
+    arr = np.zeros((100,), dtype=tx_dtype)
+    arr['io_channel'] = [packet.io_channel for packet in packets[:-1]]
+    arr['payload'] = np.frombuffer(b''.join([packet.bytes() for packet in packets[:-1]]), dtype='<u8')
+    assert format_tx(arr)[6:] == msg[6:]
+
+    buffer = bytearray(b'\xff' * (len(msg) + WORD_LEN))
+    msg_buffer = format_tx(arr, buffer=buffer)
+    assert bytes(msg_buffer)[6:] == msg[6:]
+    assert parse(bytes(msg_buffer))[1:] == packets[:-1]
+
+    with pytest.raises(ValueError):
+        format_tx(arr, buffer=bytearray(len(msg) - 1))
+
+def test_parse_messages_to_array():
+    messages = []
+    for i in range(5):
+        packets = []
+        for j in range(i):
+            packets.append(Packet_v2())
+            packets[-1].io_channel = j % 4 + 1
+            packets[-1].chip_id = i
+            packets[-1].channel_id = j
+        packets.append(SyncPacket(timestamp=i, sync_type=b'H', clk_source=1))
+        messages.append(format(packets, msg_type='DATA'))
+    io_groups = [i % 2 + 1 for i in range(len(messages))]
+    expected = np.concatenate([parse_to_array(msg, io_group=io_group)
+        for msg, io_group in zip(messages, io_groups)])
+
+    arr = parse_messages_to_array(messages, io_groups=io_groups)
+    assert (arr == expected).all()
+
+    offsets = np.cumsum([0] + [len(msg) for msg in messages[:-1]])
+    arr = parse_messages_to_array(b''.join(messages), offsets, io_groups=io_groups)
+    assert (arr == expected).all()
+
+    arr, payload = parse_messages_to_array(messages, io_groups=io_groups, return_payload=True)
+    assert (arr == expected).all()
+    expected_payload = np.concatenate([parse_to_array(msg, return_payload=True)[1]
+        for msg in messages])
+    assert (payload == expected_payload).all()
+    assert (payload != 0).sum() == sum(range(5))
+
+    assert len(parse_messages_to_array([])) == 0
@@ -5,6 +5,7 @@ Tests for basic logging functionality
 from __future__ import print_function
 import pytest
 import os
+import time
 import numpy as np
 from larpix.larpix import Packet_v1, Packet_v2, Controller, Chip, TimestampPacket
 from larpix.io.fakeio import FakeIO
@@ -46,6 +47,17 @@ def test_record(tmpdir):
     logger.record([TimestampPacket(timestamp=123)])
     assert len(logger._buffer['packets']) == 2
 
+def test_record_array(tmpdir):
+    from larpix.format.hdf5format import dtypes
+    logger = HDF5Logger(directory=str(tmpdir), buffer_length=5,
+            enabled=True)
+    arr = np.zeros((3,), dtype=dtypes[logger.version]['packets'])
+    logger.record(arr, direction=logger.READ)
+    assert len(logger._buffer['packets']) == 1
+    assert np.all(arr['direction'] == logger.READ)
+    logger.record(arr)
+    assert len(logger._buffer['packets']) == 0
+
 @pytest.mark.filterwarnings("ignore:no IO object")
 def test_controller_write_capture(tmpdir, chip):
     controller = Controller()
@@ -64,3 +76,225 @@ def test_controller_read_capture(tmpdir):
     controller.logger.enable()
     controller.run(0.1,'test')
     assert len(controller.logger._buffer['packets']) == 1
+
+def test_dataset_options(tmpdir):
+    import h5py
+    from larpix.format.hdf5format import from_file
+    logger = HDF5Logger(directory=str(tmpdir), buffer_length=5,
+            chunks=64, compression='gzip', compression_opts=4, shuffle=True,
+            capacity=4, growth_factor=2)
+    logger.enable()
+    with h5py.File(logger.filename, 'r') as f:
+        assert f['packets'].chunks == (64,)
+        assert f['packets'].compression == 'gzip'
+        assert f['packets'].compression_opts == 4
+        assert f['packets'].shuffle
+        assert f['packets'].shape == (4,)
+        assert f['packets'].attrs['n_rows'] == 0
+    sizes = []
+    for i in range(10):
+        logger.record([Packet_v2()]*3)
+        with h5py.File(logger.filename, 'r') as f:
+            sizes.append(f['packets'].shape[0])
+            assert f['packets'].attrs['n_rows'] == 6 * ((i+1) // 2)
+    # datasets grow geometrically
+    assert sizes == [4, 8, 8, 16, 16, 32, 32, 32, 32, 32]
+    assert len(from_file(logger.filename)['packets']) == 30
+    logger.disable()
+    with h5py.File(logger.filename, 'r') as f:
+        assert f['packets'].shape == (30,)
+        assert 'n_rows' not in f['packets'].attrs
+    assert len(from_file(logger.filename)['packets']) == 30
+
+def test_exact_resize(tmpdir):
+    import h5py
+    logger = HDF5Logger(directory=str(tmpdir), buffer_length=5)
+    logger.enable()
+    for i in range(4):
+        logger.record([Packet_v2()]*3)
+        with h5py.File(logger.filename, 'r') as f:
+            # no zero-filled rows by default
+            assert f['packets'].shape[0] == 6 * ((i+1) // 2)
+    logger.disable()
+
+def test_background_write(tmpdir, monkeypatch):
+    import threading
+    from larpix.format.hdf5format import from_file, FileWriter
+    release = threading.Event()
+    write = FileWriter.write
+    def slow_write(*args, **kwargs):
+        if threading.current_thread().name == 'HDF5Logger writer':
+            release.wait()
+        return write(*args, **kwargs)
+    monkeypatch.setattr(FileWriter, 'write', slow_write)
+
+    logger = HDF5Logger(directory=str(tmpdir), buffer_length=5,
+            background_write=True, queue_length=1)
+    logger.enable()
+    packets = []
+    for i in range(3):
+        packet = Packet_v2()
+        packet.chip_id = i
+        packets.append(packet)
+        logger.record([packet]*6)
+        if i == 0:
+            # wait for the writer thread to pick up the first buffer
+            while logger.write_queue_stats()['queued']:
+                time.sleep(0.01)
+            threading.Timer(0.2, release.set).start()
+    stats = logger.write_queue_stats()
+    assert stats['blocked'] == 1
+    assert stats['blocked_time'] > 0.1
+    assert stats['max_queued'] == 1
+    logger.record([packets[0]])
+    logger.disable()
+    stats = logger.write_queue_stats()
+    assert stats['written'] == 19
+    assert stats['queued'] == 0
+    assert logger._writer_thread is None
+    new_packets = from_file(logger.filename)['packets']
+    assert new_packets == [packets[0]]*6 + [packets[1]]*6 + [packets[2]]*6 + [packets[0]]
+
+def test_persistent_file(tmpdir, monkeypatch):
+    from larpix.format.hdf5format import from_file, FileWriter
+    disk_flushes = []
+    flush = FileWriter.flush
+    def count_flush(writer):
+        disk_flushes.append(writer)
+        return flush(writer)
+    monkeypatch.setattr(FileWriter, 'flush', count_flush)
+
+    logger = HDF5Logger(directory=str(tmpdir), buffer_length=1,
+            flush_interval=3600)
+    logger.enable()
+    datafile = logger.datafile
+    assert datafile
+    logger.record([Packet_v2()]*2)
+    logger.record([Packet_v2()]*2)
+    assert logger.datafile is datafile
+    assert logger._writer.n_packets == 4
+    assert len(disk_flushes) == 0
+    logger.flush_interval = 0
+    logger.record([Packet_v2()]*2)
+    assert len(disk_flushes) == 1
+    logger.disable()
+    assert not datafile
+    assert logger.datafile is None
+    assert len(from_file(logger.filename)['packets']) == 6
+
+def test_raw_messages(tmpdir):
+    import h5py
+    from larpix.format.hdf5format import convert_raw_file
+    from larpix.format import pacman_msg_format
+    messages = []
+    for i in range(10):
+        packets = []
+        for j in range(i):
+            packet = Packet_v2()
+            packet.io_channel = j % 4 + 1
+            packet.chip_id = i
+            packet.channel_id = j
+            packets.append(packet)
+        messages.append((i % 2 + 1, pacman_msg_format.format(packets, msg_type='DATA')))
+
+    logger = HDF5Logger(directory=str(tmpdir), buffer_length=3)
+    logger.enable()
+    record_time = time.time()
+    logger.record(messages, direction=logger.READ)
+    logger.disable()
+    with h5py.File(logger.filename, 'r') as f:
+        assert len(f['packets']) == 0
+        index = f['raw_message_index'][:]
+        assert b''.join(f['raw_messages'][start:start+length].tobytes()
+            for start, length in zip(index['start'], index['length'])) \
+            == b''.join(msg for _, msg in messages)
+        assert index['io_group'].tolist() == [io_group for io_group, _ in messages]
+        assert (index['receipt_time'] >= record_time).all()
+
+    expected = np.concatenate([pacman_msg_format.parse_to_array(msg, io_group=io_group)
+        for io_group, msg in messages])
+    expected['direction'] = logger.READ
+    output_filename = str(tmpdir.join('converted.h5'))
+    assert convert_raw_file(logger.filename, output_filename, chunk_size=3) == len(expected)
+    with h5py.File(output_filename, 'r') as f:
+        assert (f['packets'][:] == expected).all()
+    assert convert_raw_file(logger.filename) == len(expected)
+    with h5py.File(logger.filename, 'r') as f:
+        assert (f['packets'][:] == expected).all()
+
+    # converting again only decodes new messages
+    assert convert_raw_file(logger.filename, output_filename) == 0
+    assert convert_raw_file(logger.filename) == 0
+    logger.enable()
+    logger.record(messages[-2:], direction=logger.READ)
+    logger.disable()
+    n_new = sum(len(pacman_msg_format.parse_to_array(msg)) for _, msg in messages[-2:])
+    assert convert_raw_file(logger.filename, output_filename, chunk_size=3) == n_new
+    assert convert_raw_file(logger.filename) == n_new
+    expected = np.concatenate([expected, expected[-n_new:]])
+    for name in (output_filename, logger.filename):
+        with h5py.File(name, 'r') as f:
+            assert (f['packets'][:] == expected).all()
+            assert f['packets'].attrs['decoded_raw_messages'] == 12
+
+@pytest.mark.parametrize('background_write', [False, True])
+def test_rollover(tmpdir, background_write):
+    import json
+    from larpix.format.hdf5format import from_file
+    from larpix.format.hdf5dataset import HDF5Dataset
+    logger = HDF5Logger(filename='run.h5', directory=str(tmpdir),
+            buffer_length=4, max_rows=10, background_write=background_write)
+    assert logger.filename == str(tmpdir.join('run_0000.h5'))
+    logger.enable()
+    packets = []
+    for i in range(25):
+        packet = Packet_v2()
+        packet.chip_id = i
+        packets.append(packet)
+        logger.record([packet])
+    logger.disable()
+    with open(logger.manifest_filename) as f:
+        manifest = json.load(f)
+    assert manifest['base_filename'] == 'run.h5'
+    assert all(entry['closed'] >= entry['opened'] for entry in manifest['files'])
+    assert sum([entry['n_rows'] for entry in manifest['files']]) == 25
+    if not background_write:
+        # the writer thread may combine buffers into fewer, larger writes
+        assert logger.filename == str(tmpdir.join('run_0002.h5'))
+        assert [entry['filename'] for entry in manifest['files']] \
+            == ['run_0000.h5', 'run_0001.h5', 'run_0002.h5']
+        assert [entry['n_rows'] for entry in manifest['files']] == [10, 10, 5]
+        assert len(from_file(str(tmpdir.join('run_0001.h5')))['packets']) == 10
+    dataset = HDF5Dataset(logger.manifest_filename)
+    assert dataset[:]['chip_id'].tolist() == list(range(25))
+
+def test_rollover_flush(tmpdir):
+    import json
+    import h5py
+    logger = HDF5Logger(filename='run.h5', directory=str(tmpdir),
+            buffer_length=1000, max_rows=3, background_write=True)
+    logger.enable()
+    for i in range(200):
+        packet = Packet_v2()
+        packet.chip_id = i % 256
+        logger.record([packet])
+        logger.flush()
+    logger.disable()
+    with open(logger.manifest_filename) as f:
+        manifest = json.load(f)
+    assert sum([entry['n_rows'] for entry in manifest['files']]) == 200
+    for entry in manifest['files']:
+        with h5py.File(str(tmpdir.join(entry['filename'])), 'r') as f:
+            assert len(f['packets']) == entry['n_rows']
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        [entry['filename'] for entry in manifest['files']] + ['run_manifest.json'])
+
+def test_rollover_time(tmpdir):
+    logger = HDF5Logger(filename='run.h5', directory=str(tmpdir),
+            buffer_length=0, max_time=0)
+    logger.enable()
+    for i in range(3):
+        logger.record([Packet_v2()])
+    logger.disable()
+    assert sorted(os.listdir(str(tmpdir))) == ['run_0000.h5', 'run_0001.h5',
+        'run_0002.h5', 'run_manifest.json']
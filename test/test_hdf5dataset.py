@@ -0,0 +1,86 @@
+'''
+Tests for larpix.format.hdf5dataset module
+
+'''
+import os
+
+import pytest
+import h5py
+import numpy as np
+
+from larpix.format.hdf5format import to_file, from_file, dtypes
+from larpix.format.hdf5dataset import HDF5Dataset
+
+@pytest.fixture
+def rows():
+    rows = np.zeros((1000,), dtype=dtypes['2.3']['packets'])
+    rows['packet_type'] = np.arange(len(rows)) % 4
+    rows['chip_id'] = np.arange(len(rows)) % 7
+    rows['timestamp'] = np.arange(len(rows))
+    return rows
+
+@pytest.fixture
+def filenames(tmpdir, rows):
+    filenames = []
+    for i, (start, end) in enumerate([(0, 300), (300, 300), (300, 750), (750, 1000)]):
+        filename = str(tmpdir.join('datalog_{}.h5'.format(i)))
+        to_file(filename, rows[start:end], version='2.3', chunks=64,
+            capacity=end - start + 10)
+        filenames.append(filename)
+    return filenames
+
+def test_dataset(tmpdir, filenames, rows):
+    dataset = HDF5Dataset(str(tmpdir.join('datalog_*.h5')))
+    assert dataset.filenames == filenames
+    assert dataset._headers == [None] * 4
+    assert dataset.header(1)['n_rows'] == 0
+    assert dataset._headers[0] is None
+    assert len(dataset) == len(rows)
+    assert [header['n_rows'] for header in dataset.headers] == [300, 0, 450, 250]
+    assert dataset.dtype == rows.dtype
+    assert (dataset[:] == rows).all()
+    assert (dataset[250:800] == rows[250:800]).all()
+    assert dataset[-1] == rows[-1]
+    assert dataset[300] == rows[300]
+    with pytest.raises(IndexError):
+        dataset[1000]
+
+    dataset = HDF5Dataset(filenames[2:] + filenames[:1], version='~2.1')
+    assert (dataset[:] == np.concatenate([rows[300:], rows[:300]])).all()
+
+def test_dataset_iter_chunks(filenames, rows):
+    dataset = HDF5Dataset(filenames)
+    chunks = list(dataset.iter_chunks(chunk_size=100))
+    assert [len(chunk) for chunk in chunks] == [128, 128, 44, 128, 128, 128, 66, 128, 122]
+    assert (np.concatenate(chunks) == rows).all()
+
+    chunks = list(dataset.iter_chunks(packet_type=1, timestamp=(100, 900)))
+    mask = (rows['packet_type'] == 1) & (rows['timestamp'] >= 100) & (rows['timestamp'] < 900)
+    assert (np.concatenate(chunks) == rows[mask]).all()
+
+    chunks = list(dataset.iter_chunks(chunk_size=100, workers=2, chip_id=3))
+    assert (np.concatenate(chunks) == rows[rows['chip_id'] == 3]).all()
+    assert list(dataset.map(len, chunk_size=100, workers=2)) \
+        == list(dataset.map(len, chunk_size=100)) \
+        == [128, 128, 44, 128, 128, 128, 66, 128, 122]
+
+def test_dataset_virtual_file(tmpdir, filenames, rows, monkeypatch):
+    dataset = HDF5Dataset(filenames)
+    os.makedirs(str(tmpdir.join('vds')))
+    filename = str(tmpdir.join('vds', 'run.h5'))
+    dataset.to_virtual_file(filename)
+    monkeypatch.chdir(str(tmpdir.join('vds')))
+    with h5py.File('run.h5', 'r') as f:
+        assert f['packets'].is_virtual
+        assert (f['packets'][:] == rows).all()
+        assert f['_header'].attrs['created'] == dataset.header(0)['created']
+    assert len(from_file('run.h5', packet_type=0)['packets']) == 250
+
+def test_dataset_bad_version(tmpdir, filenames):
+    filename = str(tmpdir.join('datalog_old.h5'))
+    to_file(filename, [], version='2.2')
+    dataset = HDF5Dataset(filenames + [filename])
+    with pytest.raises(RuntimeError):
+        len(dataset)
+    with pytest.raises(FileNotFoundError):
+        HDF5Dataset(str(tmpdir.join('missing_*.h5')))
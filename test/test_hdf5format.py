@@ -2,11 +2,13 @@ from __future__ import print_function
 
 import pytest
 import h5py
+import numpy as np
 
 from larpix.larpix import (Packet_v1, Packet_v2, PacketCollection, TimestampPacket,
                            MessagePacket, Key, SyncPacket, TriggerPacket)
-from larpix.format.hdf5format import (to_file, from_file,
-        dtype_property_index_lookup)
+from larpix.format.hdf5format import (to_file, from_file, iter_file,
+        dtype_property_index_lookup, dtypes, packet_array_from_payload,
+        _format_packets_packet_v2_3)
 
 @pytest.fixture
 def tmpfile(tmpdir):
@@ -428,8 +430,202 @@ def test_from_file_v2_3_many_packets(tmpfile, data_packet_v2,
     assert new_packets[4] == sync_packet
     assert new_packets[5] == trigger_packet
 
+def test_to_file_v2_3_packet_array(tmpfile, data_packet_v2,
+                                   config_read_packet_v2, timestamp_packet):
+    to_file(tmpfile, [data_packet_v2], version='2.3')
+    rows = h5py.File(tmpfile, 'r')['packets'][:]
+    arr = np.concatenate([rows, rows])
+    to_file(tmpfile, [config_read_packet_v2, arr, timestamp_packet],
+            version='2.3')
+    new_packets = from_file(tmpfile)['packets']
+    assert len(new_packets) == 5
+    assert new_packets[1] == config_read_packet_v2
+    assert new_packets[2] == data_packet_v2
+    assert new_packets[3] == data_packet_v2
+    assert new_packets[4] == timestamp_packet
+
+def _random_packets_v2(n):
+    rng = np.random.RandomState(1234)
+    packets = []
+    for i in range(n):
+        p = Packet_v2(int(rng.randint(0, 2**63, dtype='u8')).to_bytes(8, 'little'))
+        p.io_group = int(rng.randint(0, 256))
+        p.io_channel = int(rng.randint(0, 256))
+        p.receipt_timestamp = int(rng.randint(0, 2**32, dtype='u8'))
+        if i % 3 == 0:
+            p.fifo_diagnostics_enabled = True
+            p.local_fifo_events = i % 4
+            p.shared_fifo_events = i
+        if i % 5 == 0:
+            p.direction = 1
+        packets.append(p)
+    return packets
+
+def _format_rows_v2_3(packets):
+    return np.array([tuple(0 if value is None else value
+        for value in _format_packets_packet_v2_3(p)) for p in packets],
+        dtype=dtypes['2.3']['packets'])
+
+def test_to_file_v2_3_packet_v2_bulk(tmpfile, timestamp_packet):
+    packets = _random_packets_v2(100)
+    to_file(tmpfile, packets[:50] + [timestamp_packet] + packets[50:],
+            version='2.3')
+    rows = h5py.File(tmpfile, 'r')['packets'][:]
+    expected = _format_rows_v2_3(packets[:50] + [timestamp_packet] + packets[50:])
+    assert (rows == expected).all()
+
+def test_to_file_v2_3_payload_columns(tmpfile):
+    packets = _random_packets_v2(10)
+    for p in packets:
+        p.fifo_diagnostics_enabled = False
+        p.direction = 0
+    payload = np.array([p.bytes() for p in packets], dtype='S8')
+    columns = dict(
+        payload=payload,
+        io_group=[p.io_group for p in packets],
+        io_channel=[p.io_channel for p in packets],
+        receipt_timestamp=[p.receipt_timestamp for p in packets]
+        )
+    to_file(tmpfile, columns, version='2.3')
+    words = np.zeros((10,), dtype=[('io_channel', 'u1'), ('payload', '<u8'),
+        ('receipt_timestamp', 'u4')])
+    words['payload'] = payload.view('<u8')
+    words['io_channel'] = columns['io_channel']
+    words['receipt_timestamp'] = columns['receipt_timestamp']
+    to_file(tmpfile, words)
+    rows = h5py.File(tmpfile, 'r')['packets'][:]
+    expected = _format_rows_v2_3(packets)
+    assert (rows[:10] == expected).all()
+    expected['io_group'] = 0
+    assert (rows[10:] == expected).all()
+    assert (packet_array_from_payload(b''.join([p.bytes() for p in packets]),
+        io_group=columns['io_group'], io_channel=columns['io_channel'],
+        receipt_timestamp=columns['receipt_timestamp']) == rows[:10]).all()
+
+def test_iter_file(tmpfile, timestamp_packet):
+    packets = _random_packets_v2(100)
+    to_file(tmpfile, packets[:50] + [timestamp_packet] + packets[50:],
+            version='2.3')
+    to_file(tmpfile, packet_array_from_payload(np.arange(1000)))
+    rows = h5py.File(tmpfile, 'r')['packets'][:]
+    hdf5_chunk_size = h5py.File(tmpfile, 'r')['packets'].chunks[0]
+    chunk_size = 2 * hdf5_chunk_size
+    n_chunks = len(rows) // chunk_size
+    chunks = list(iter_file(tmpfile, chunk_size=chunk_size - 1))
+    assert [len(chunk) for chunk in chunks] == [chunk_size]*n_chunks + [len(rows) % chunk_size]
+    assert (np.concatenate(chunks) == rows).all()
+
+    chunks = list(iter_file(tmpfile, chunk_size=chunk_size, start=10, end=-10))
+    assert len(chunks[0]) == chunk_size - 10
+    assert (np.concatenate(chunks) == rows[10:-10]).all()
+
+    chunks = list(iter_file(tmpfile, version='~2.1', end=101, as_packets=True))
+    assert sum(chunks, []) == from_file(tmpfile, end=101)['packets']
+    assert len(sum(chunks, [])) == 101
+
+    with pytest.raises(RuntimeError):
+        next(iter_file(tmpfile, version='2.2'))
+
+def test_to_file_packet_array_bad_dtype(tmpfile):
+    arr = np.zeros((1,), dtype=dtypes['2.2']['packets'])
+    with pytest.raises(ValueError):
+        to_file(tmpfile, arr, version='2.3')
+
 def test_from_file_incompatible(tmpfile):
     to_file(tmpfile, [], version='0.0')
     with pytest.raises(RuntimeError):
         from_file(tmpfile, version='1.0')
         pytest.fail('Should identify incompatible version')
+
+def test_file_writer(tmpfile, data_packet_v2, message_packet):
+    from larpix.format.hdf5format import FileWriter
+    with FileWriter(tmpfile, version='2.3') as writer:
+        writer.write([data_packet_v2, message_packet])
+        writer.write([data_packet_v2, message_packet])
+        assert writer.n_packets == 4
+        assert writer.n_messages == 2
+    f = h5py.File(tmpfile, 'r')
+    assert f['messages'][1]['index'] == 1
+    assert from_file(tmpfile)['packets'][2:] == [data_packet_v2, message_packet]
+    f.close()
+    with pytest.raises(RuntimeError):
+        FileWriter(tmpfile, version='2.2')
+
+def test_query_file(tmpfile, tmpdir):
+    from larpix.format.hdf5format import query_file, build_index
+    rng = np.random.RandomState(1234)
+    rows = np.zeros((1000,), dtype=dtypes['2.3']['packets'])
+    rows['io_group'] = rng.randint(1, 3, len(rows))
+    rows['io_channel'] = rng.randint(1, 5, len(rows))
+    rows['chip_id'] = rng.randint(11, 20, len(rows))
+    rows['channel_id'] = rng.randint(0, 4, len(rows))
+    rows['timestamp'] = np.arange(len(rows)) * 10
+    to_file(tmpfile, rows[:300], version='2.3')
+    to_file(tmpfile, rows[300:700], index_block_size=64)
+    to_file(tmpfile, rows[700:])
+
+    with h5py.File(tmpfile, 'r') as f:
+        index = f['packet_index'][:]
+        assert f['packet_index'].attrs['block_size'] == 64
+        assert f['packet_index'].attrs['indexed_rows'] == len(rows)
+    assert index['count'].sum() == len(rows)
+    assert (index['timestamp_min'] // 640 == index['block']).all()
+    assert (index['timestamp_max'] // 640 == index['block']).all()
+
+    assert (query_file(tmpfile, chip_id=12) == rows[rows['chip_id'] == 12]).all()
+    result = query_file(tmpfile, chip_key='1-2-13', channel_id=[0, 3],
+        timestamp=(2000, 5000))
+    mask = ((rows['io_group'] == 1) & (rows['io_channel'] == 2)
+        & (rows['chip_id'] == 13) & np.isin(rows['channel_id'], [0, 3])
+        & (rows['timestamp'] >= 2000) & (rows['timestamp'] < 5000))
+    assert mask.any()
+    assert (result == rows[mask]).all()
+    assert len(query_file(tmpfile, chip_id=0)) == 0
+    assert len(query_file(tmpfile, timestamp=(None, 100))) == 10
+
+    packets = query_file(tmpfile, chip_key='1-2-13', as_packets=True)
+    assert [p.chip_key for p in packets] == [Key('1-2-13')] * len(packets)
+
+    # file without an index is scanned
+    unindexed = str(tmpdir.join('unindexed.h5'))
+    to_file(unindexed, rows, version='2.3')
+    assert (query_file(unindexed, chip_key='1-2-13', channel_id=[0, 3],
+        timestamp=(2000, 5000)) == rows[mask]).all()
+    build_index(unindexed, block_size=100)
+    with h5py.File(unindexed, 'r') as f:
+        assert f['packet_index'].attrs['indexed_rows'] == len(rows)
+    assert (query_file(unindexed, chip_id=[12, 15]) == rows[np.isin(rows['chip_id'], [12, 15])]).all()
+
+def test_from_file_selection(tmpfile, tmpdir):
+    rng = np.random.RandomState(1234)
+    rows = np.zeros((1000,), dtype=dtypes['2.3']['packets'])
+    rows['packet_type'] = rng.randint(0, 4, len(rows))
+    rows['io_group'] = rng.randint(1, 3, len(rows))
+    rows['io_channel'] = rng.randint(1, 5, len(rows))
+    rows['chip_id'] = rng.randint(11, 14, len(rows))
+    rows['timestamp'] = np.arange(len(rows)) * 10
+    rows['receipt_timestamp'] = np.arange(len(rows))[::-1]
+    to_file(tmpfile, rows, version='2.3', chunks=64)
+
+    packets = from_file(tmpfile, packet_type=Packet_v2.CONFIG_READ_PACKET)['packets']
+    assert len(packets) == (rows['packet_type'] == 3).sum()
+    assert all(p.packet_type == Packet_v2.CONFIG_READ_PACKET for p in packets)
+
+    packets = from_file(tmpfile, chip_key=['1-1-11', Key(2, 4, 13)],
+        timestamp=(1000, None), receipt_timestamp=(None, 500), start=50)['packets']
+    mask = (((rows['io_group'] == 1) & (rows['io_channel'] == 1) & (rows['chip_id'] == 11))
+        | ((rows['io_group'] == 2) & (rows['io_channel'] == 4) & (rows['chip_id'] == 13)))
+    mask &= (rows['timestamp'] >= 1000) & (rows['receipt_timestamp'] < 500)
+    assert len(packets) == mask.sum()
+    assert [p.packet_type for p in packets] == rows['packet_type'][mask].tolist()
+    assert [p.receipt_timestamp for p in packets] == rows['receipt_timestamp'][mask].tolist()
+
+    chunks = list(iter_file(tmpfile, timestamp=(0, 1280), packet_type=[0, 1]))
+    assert len(chunks) == 2
+    mask = (rows['timestamp'] < 1280) & (rows['packet_type'] < 2)
+    assert (np.concatenate(chunks) == rows[mask]).all()
+
+    old_file = str(tmpdir.join('v1.h5'))
+    to_file(old_file, [], version='1.0')
+    with pytest.raises(RuntimeError):
+        from_file(old_file, packet_type=0)
@@ -4,8 +4,10 @@ Use the pytest framework to write tests for the larpix module.
 '''
 from __future__ import print_function
 import pytest
+import asyncio
+import time
 from larpix import (Chip, Packet_v1, Packet_v2, Packet, Key, Configuration, Configuration_v1, Controller,
-        PacketCollection, _Smart_List, TimestampPacket, MessagePacket)
+        PacketCollection, PacketArray, _Smart_List, TimestampPacket, MessagePacket)
 from larpix.io import FakeIO
 from larpix.timestamp import *  # use long = int in py3
 #from bitstring import BitArray
@@ -48,6 +50,17 @@ def test_chip_get_configuration_packets(chip):
     assert packet.register_address == 40
     assert packet.register_data == 16
 
+def test_chip_get_configuration_packets_subset(chip):
+    all_packets = chip.get_configuration_write_packets()
+    packets = chip.get_configuration_write_packets(registers=[64, 5, 5, 300])
+    assert packets == [all_packets[5], all_packets[64]]
+    chip.config.clear_dirty()
+    chip.config.threshold_global = 40
+    packets = chip.get_configuration_write_packets(registers=chip.config.dirty_registers)
+    assert [p.register_address for p in packets] == [64]
+    assert packets[0].register_data == 40
+    assert chip.get_configuration_read_packets(registers=[]) == []
+
 def test_chip_sync_configuration(chip):
     packet_type = Packet.CONFIG_READ_PACKET
     packets = chip.get_configuration_read_packets()
@@ -136,6 +149,22 @@ def test_controller_save_output(tmpdir, chip):
             }
     assert result == expected
 
+@pytest.mark.parametrize('endian', ['big', 'little'])
+def test_bitarrayhelper(endian):
+    for nbits in (1, 3, 8, 13, 64):
+        for val in (0, 1, 5, 2**nbits - 1, 2**nbits + 3):
+            bits = bah.fromuint(val, nbits, endian=endian)
+            expected = bah._fromuint_str(val, nbits, endian)
+            assert bits == expected
+            assert bits.to01() == expected.to01()
+            assert bah.touint(bits, endian=endian) == val
+            little_bits = bitarray(bits.to01(), endian='little')
+            assert bah.touint(little_bits, endian=endian) == val
+    assert bah.fromuint(5, slice(2, 10), endian=endian) == bah._fromuint_str(5, 8, endian)
+    assert bah.fromuint(bitarray('101'), 8, endian=endian) == bitarray('101')
+    with pytest.raises(ValueError):
+        bah.touint(bitarray(), endian=endian)
+
 def test_packet_bits_bytes():
     assert Packet.num_bytes == Packet.size // 8 + min(Packet.size % 8, 1)
 
@@ -1695,6 +1724,80 @@ def test_controller_multi_write_configuration_specify_registers(capfd, chip):
     result, err = capfd.readouterr()
     assert result == expected
 
+def test_controller_write_configuration_only_changed(capfd, chip):
+    controller = Controller()
+    controller.io = FakeIO()
+    controller.chips[chip.chip_key] = chip
+    n_registers = chip.config.num_registers
+    controller.write_configuration(chip.chip_key, only_changed=True)
+    assert controller.config_write_stats == dict(requested=n_registers,
+        sent=n_registers, saved=0)
+    assert chip.get_changed_registers() == []
+    controller.write_configuration(chip.chip_key, only_changed=True)
+    assert controller.config_write_stats == dict(requested=n_registers,
+        sent=0, saved=n_registers)
+    capfd.readouterr()
+
+    chip.config.threshold_global = 40
+    controller.write_configuration(chip.chip_key, only_changed=True)
+    assert controller.config_write_stats['sent'] == 1
+    expected = list_of_packets_str(chip.get_configuration_write_packets([64]))
+    result, err = capfd.readouterr()
+    assert result == expected
+
+    # a read back that differs from the configuration
+    reply = chip.get_configuration_read_packets([5])
+    reply[0].register_data = 3
+    controller.io.queue.append((reply, b'hi'))
+    controller.read_configuration(chip.chip_key, 5, timeout=0.01)
+    assert chip.asic_registers[5] == 3
+    capfd.readouterr()
+    controller.write_configuration(chip.chip_key, range(10), only_changed=True)
+    assert controller.config_write_stats == dict(requested=10, sent=1, saved=9)
+    expected = list_of_packets_str(chip.get_configuration_write_packets([5]))
+    result, err = capfd.readouterr()
+    assert result == expected
+
+def test_controller_send_asic_registers(chip):
+    controller = Controller()
+    controller.chips[chip.chip_key] = chip
+    packets = chip.get_configuration_write_packets([64])
+    with pytest.warns(RuntimeWarning):
+        controller.send(packets)
+    assert chip.asic_registers == {}
+
+    class FailingIO(FakeIO):
+        def send(self, packets):
+            raise RuntimeError('send failed')
+    controller.io = FailingIO()
+    with pytest.raises(RuntimeError):
+        controller.send(packets)
+    with pytest.raises(RuntimeError):
+        asyncio.run(controller.async_send(packets))
+    assert chip.asic_registers == {}
+
+    controller.io = FakeIO()
+    asyncio.run(controller.async_send(packets))
+    assert chip.asic_registers == {64: chip.config.threshold_global}
+
+def test_controller_multi_write_configuration_only_changed(capfd, chip):
+    controller = Controller()
+    controller.io = FakeIO()
+    chip2 = Chip('1-2-4')
+    controller.chips = {chip.chip_key: chip, chip2.chip_key: chip2}
+    controller.multi_write_configuration(controller.chips)
+    chip.config.threshold_global = 40
+    chip2.config.pixel_trim_dac[0] = 3
+    capfd.readouterr()
+    controller.multi_write_configuration(controller.chips, only_changed=True)
+    n_registers = chip.config.num_registers
+    assert controller.config_write_stats == dict(requested=2*n_registers,
+        sent=2, saved=2*n_registers-2)
+    expected = list_of_packets_str(chip.get_configuration_write_packets([64])
+        + chip2.get_configuration_write_packets([0]))
+    result, err = capfd.readouterr()
+    assert result == expected
+
 
 def test_controller_multi_read_configuration(capfd, chip):
     controller = Controller()
@@ -1783,6 +1886,73 @@ def test_controller_verify_configuration_bad_value(capfd, chip):
     assert ok == False
     assert diff == {chip.chip_key: {5: (16, 17)}}
 
+def test_controller_verify_configuration_return_early(capfd, chip):
+    controller = Controller()
+    controller.io = FakeIO()
+    controller.chips[chip.chip_key] = chip
+    conf_data = chip.get_configuration_packets(Packet.CONFIG_WRITE_PACKET)
+    for packet in conf_data: packet.packet_type = Packet.CONFIG_READ_PACKET
+    controller.io.queue.append((conf_data[:10],b'hi'))
+    controller.io.queue.append((conf_data[10:],b'hi'))
+    start = time.time()
+    ok, diff = controller.verify_configuration(chip_keys=chip.chip_key,
+        timeout=10, return_early=True)
+    assert time.time() - start < 5
+    assert diff == {}
+    assert ok
+    stats = controller.config_read_stats
+    assert stats['requested'] == len(conf_data)
+    assert stats['received'] == len(conf_data)
+    assert stats['missing'] == []
+    assert 0 <= stats['latency']['min'] <= stats['latency']['max'] <= stats['elapsed']
+
+def test_controller_verify_configuration_return_early_timeout(capfd, chip):
+    controller = Controller()
+    controller.io = FakeIO()
+    controller.chips[chip.chip_key] = chip
+    conf_data = chip.get_configuration_packets(Packet.CONFIG_WRITE_PACKET)
+    for packet in conf_data: packet.packet_type = Packet.CONFIG_READ_PACKET
+    del conf_data[5]
+    controller.io.queue.append((conf_data,b'hi'))
+    ok, diff = controller.verify_configuration(chip_keys=chip.chip_key,
+        timeout=0.05, return_early=True)
+    assert ok == False
+    assert diff == {chip.chip_key: {5: (16, None)}}
+    assert controller.config_read_stats['missing'] == [(chip.chip_key, 5)]
+    assert controller.config_read_stats['received'] == len(conf_data)
+
+def test_controller_async_verify_registers(capfd, chip):
+    controller = Controller()
+    controller.io = FakeIO()
+    controller.chips[chip.chip_key] = chip
+    conf_data = chip.get_configuration_packets(Packet.CONFIG_WRITE_PACKET)
+    for packet in conf_data: packet.packet_type = Packet.CONFIG_READ_PACKET
+    conf_data[5].register_data = 17
+    controller.io.queue.append((conf_data,b'hi'))
+    ok, diff = asyncio.run(controller.async_verify_registers(
+        [(chip.chip_key, range(10))], timeout=0.01))
+    assert ok == False
+    assert diff == {chip.chip_key: {5: (16, 17)}}
+
+def test_controller_async_verify_registers_return_early(capfd, chip):
+    controller = Controller()
+    controller.io = FakeIO()
+    controller.chips[chip.chip_key] = chip
+    conf_data = chip.get_configuration_packets(Packet.CONFIG_WRITE_PACKET)
+    for packet in conf_data: packet.packet_type = Packet.CONFIG_READ_PACKET
+    controller.io.queue.append((conf_data[:5],b'hi'))
+    controller.io.queue.append((conf_data[5:10],b'hi'))
+    start = time.time()
+    ok, diff = asyncio.run(controller.async_verify_registers(
+        [(chip.chip_key, range(10))], timeout=10, return_early=True))
+    assert time.time() - start < 5
+    assert ok
+    assert diff == {}
+    assert controller.config_read_stats['requested'] == 10
+    assert controller.config_read_stats['received'] == 10
+    assert controller.config_read_stats['missing'] == []
+    assert len(controller.reads[-1]) == 10
+
 def test_packetcollection_getitem_int():
     expected = Packet()
     collection = PacketCollection([expected])
@@ -1878,6 +2048,130 @@ def test_packetcollection_from_dict():
     expected = collection
     assert result == expected
 
+def _random_packets_v2(n):
+    import numpy as np
+    rng = np.random.RandomState(1234)
+    packets = []
+    for i in range(n):
+        p = Packet_v2(int(rng.randint(0, 2**63, dtype='u8')).to_bytes(8, 'little'))
+        p.chip_key = Key(int(rng.randint(1, 3)), int(rng.randint(1, 3)),
+            int(rng.randint(11, 14)))
+        p.receipt_timestamp = i
+        p.direction = i % 2
+        packets.append(p)
+    return packets
+
+def test_packetarray_getitem():
+    packets = _random_packets_v2(50)
+    array = PacketArray(packets + [TimestampPacket(1)], message='hello')
+    assert len(array) == 50
+    assert array[3] == packets[3]
+    assert array[3].chip_key == packets[3].chip_key
+    assert array[3].receipt_timestamp == 3
+    assert array.packets == packets
+    assert list(array) == packets
+    assert array == PacketCollection(packets, message='hello')
+    result = array[:10]
+    assert result == PacketArray(packets[:10], message='hello'
+        ' | subset slice(None, 10, None)')
+    assert result.parent is array
+    assert array[:10, 'bits'] == PacketCollection(packets)[:10, 'bits']
+    assert array[-1, 'bits'] == PacketCollection(packets)[-1, 'bits']
+    assert array[array.mask(chip_id=12)].packets == [p for p in packets if p.chip_id == 12]
+    assert str(array)
+
+def test_packetarray_extract():
+    packets = _random_packets_v2(200)
+    array = PacketArray(packets)
+    collection = PacketCollection(packets)
+    for selection in ({}, dict(packet_type=Packet_v2.DATA_PACKET),
+            dict(chip_id=12, packet_type=Packet_v2.CONFIG_READ_PACKET),
+            dict(chip_key='1-2-13'), dict(io_channel=1)):
+        for attrs in (('chip_id',), ('timestamp', 'dataword'),
+                ('chip_key', 'local_fifo_full', 'receipt_timestamp'),
+                ('register_data',)):
+            assert array.extract(*attrs, **selection) \
+                == collection.extract(*attrs, **selection)
+    assert array.extract('not_an_attribute') == []
+
+    array.fifo_diagnostics_enabled = True
+    for packet in packets:
+        packet.fifo_diagnostics_enabled = True
+    assert array.extract('timestamp', 'shared_fifo_events') \
+        == collection.extract('timestamp', 'shared_fifo_events')
+
+def test_packetarray_group_by():
+    packets = _random_packets_v2(200)
+    array = PacketArray(packets)
+    collection = PacketCollection(packets)
+    result = array.by_chip_key()
+    expected = collection.by_chip_key()
+    assert sorted(map(str, result.keys())) == sorted(map(str, expected.keys()))
+    for chip_key in expected:
+        assert result[chip_key].packets == expected[chip_key].packets
+        assert result[chip_key].parent is array
+        assert array.with_chip_key(chip_key).packets == expected[chip_key].packets
+    result = array.by_chipid()
+    assert sorted(result.keys()) == [11, 12, 13]
+    for chipid, subset in result.items():
+        assert subset.packets == [p for p in packets if p.chip_id == chipid]
+        assert subset.origin() is array
+        assert array.with_chipid(chipid).packets == subset.packets
+
+def test_packetarray_from_dict():
+    packets = _random_packets_v2(10)
+    array = PacketArray(packets, bytestream=b'abc', message='hello')
+    d = array.to_dict()
+    assert d['packets'] == PacketCollection(packets).to_dict()['packets']
+    result = PacketArray()
+    result.from_dict(d)
+    assert result == PacketArray([Packet_v2(p.bytes()) for p in packets],
+        bytestream=b'abc', message='hello')
+
+def test_controller_run_as_array():
+    from larpix.format import pacman_msg_format
+    packets = _random_packets_v2(50)
+    for p in packets:
+        p.io_group = 1
+        p.direction = 1
+
+    class ArrayIO(FakeIO):
+        def empty_queue(self, as_array=False, raw=False, return_payload=False):
+            msgs = [pacman_msg_format.format(packets, msg_type='DATA')] if self.queue else []
+            self.queue.clear()
+            rows, payload = pacman_msg_format.parse_messages_to_array(msgs,
+                io_groups=[1]*len(msgs), return_payload=True)
+            return rows, b''.join(msgs), payload
+
+    controller = Controller()
+    controller.io = ArrayIO()
+    controller.io.queue.append(None)
+    # the packet words are kept as received, including the FIFO diagnostics
+    # bits that are not stored in the packets array columns
+    Packet_v2.fifo_diagnostics_enabled = True
+    try:
+        controller.run(0.01, 'data', as_array=True)
+    finally:
+        Packet_v2.fifo_diagnostics_enabled = False
+    result = controller.reads[-1]
+    assert isinstance(result, PacketArray)
+    assert result.message == 'data'
+    assert result.bytestream == pacman_msg_format.format(packets, msg_type='DATA')
+    assert result.packets == packets
+    assert [p.bytes() for p in result] == [p.bytes() for p in packets]
+    collection = PacketCollection(packets)
+    assert result.extract('chip_id') == collection.extract('chip_id')
+    assert (result.extract('dataword', packet_type=0)
+        == collection.extract('dataword', packet_type=0))
+    expected = collection.by_chip_key()
+    result = result.by_chip_key()
+    assert set(result) == set(expected)
+    for chip_key in expected:
+        assert result[chip_key].packets == expected[chip_key].packets
+
+    with pytest.raises(ValueError):
+        controller.store_packets(controller._empty_packet_array(), b'', 'data')
+
 def test_timestamp_init():
     t = Timestamp(ns=2**33, cpu_time=1e10 + 1e-6, adc_time=Timestamp.larpix_offset_d // 2,
                   adj_adc_time=Timestamp.larpix_offset_d * 100)
@@ -1,3 +1,4 @@
+import pytest
 from bitarray import bitarray
 import copy
 
@@ -155,3 +156,51 @@ def test_parity():
     p.assign_parity()
     assert p.has_valid_parity()
     assert p.parity == 0
+
+def test_field_range():
+    p = Packet_v2()
+    p.packet_type = Packet_v2.CONFIG_WRITE_PACKET
+    p.chip_id = 12
+    p.register_address = 64
+    p.register_data = 40
+    word = p.bytes()
+    for name, value in (('chip_id', -1), ('chip_id', 256),
+            ('channel_id', 2**6), ('timestamp', 2**40),
+            ('register_data', bitarray('1'*9))):
+        with pytest.raises(ValueError):
+            setattr(p, name, value)
+    assert p.bytes() == word
+    p.fifo_diagnostics_enabled = True
+    with pytest.raises(ValueError):
+        p.shared_fifo_events = 2**12
+    p.shared_fifo_events = 2**12 - 1
+    assert p.shared_fifo_events == 2**12 - 1
+
+def test_word_storage():
+    import pickle
+    import numpy as np
+    p = Packet_v2()
+    p.register_data = bitarray('00001000')
+    assert p.register_data == 16
+    p.chip_id = np.uint8(200)
+    assert p.chip_id == 200
+    p.channel_id = 2**6 - 1
+    assert p.channel_id == 63
+    assert p.chip_id == 200
+
+    bits = p.bits
+    bits[63] = 1
+    assert p.parity == 1
+    p.bits = bitarray('1' + '0'*63)
+    assert p.bytes() == b'\x01' + b'\x00'*7
+
+    p.io_group = 1
+    p.io_channel = 2
+    p.direction = 1
+    p.fifo_diagnostics_enabled = True
+    p2 = pickle.loads(pickle.dumps(p))
+    assert p2 == p
+    assert p2.chip_key == '1-2-0'
+    assert p2.direction == 1
+    assert p2.fifo_diagnostics_enabled
+    assert not hasattr(Packet_v2(), 'receipt_timestamp')
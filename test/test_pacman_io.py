@@ -0,0 +1,294 @@
+'''
+Tests for larpix.io.pacman_io module
+
+'''
+import pytest
+import json
+import threading
+import time
+import asyncio
+import zmq
+
+from larpix import Packet_v2
+from larpix.io.pacman_io import PACMAN_IO
+from larpix.io.async_pacman_io import AsyncPACMAN_IO
+import larpix.format.pacman_msg_format as pacman_msg_format
+
+@pytest.fixture
+def cmdserver():
+    '''
+    A minimal pacman-cmdserver that acknowledges each request and keeps a
+    copy of the received messages
+
+    '''
+    context = zmq.Context()
+    socket = context.socket(zmq.REP)
+    port = socket.bind_to_random_port('tcp://*')
+    received = list()
+    stop = threading.Event()
+    def serve():
+        while not stop.is_set():
+            if not socket.poll(10):
+                continue
+            msg = socket.recv()
+            received.append(msg)
+            header, words = pacman_msg_format.parse_msg(msg)
+            reply_words = list()
+            for word in words:
+                if word[0] == 'PING':
+                    reply_words.append(('PONG',))
+                elif word[0] == 'READ':
+                    # registers read back as their address
+                    reply_words.append(('READ', word[1], word[1]))
+                else:
+                    reply_words.append(word)
+            socket.send(pacman_msg_format.format_msg('REP', reply_words))
+    thread = threading.Thread(target=serve)
+    thread.start()
+    yield str(port), received
+    stop.set()
+    thread.join()
+    socket.close(linger=0)
+    context.term()
+
+@pytest.fixture
+def dataserver():
+    '''
+    A pacman-dataserver publisher, only reachable by io group 1
+
+    '''
+    context = zmq.Context()
+    socket = context.socket(zmq.PUB)
+    port = socket.bind_to_random_port('tcp://127.0.0.1')
+    yield str(port), socket
+    socket.close(linger=0)
+    context.term()
+
+@pytest.fixture
+def io_config(tmpdir, cmdserver, dataserver, monkeypatch):
+    filename = str(tmpdir.join('test_conf.json'))
+    config_dict = {
+            "_config_type": "io",
+            "io_class": "PACMAN_IO",
+            "io_group": [
+                [1, "127.0.0.1"],
+                [2, "127.0.0.2"]
+            ]
+        }
+    with open(filename,'w') as of:
+        json.dump(config_dict, of)
+    monkeypatch.setattr(PACMAN_IO, 'cmdserver_port', cmdserver[0])
+    monkeypatch.setattr(PACMAN_IO, 'dataserver_port', dataserver[0])
+    return filename
+
+@pytest.fixture
+def pacman_io(io_config):
+    io = PACMAN_IO(config_filepath=io_config, timeout=5000)
+    yield io
+    io.cleanup()
+
+@pytest.fixture
+def async_pacman_io(io_config):
+    io = AsyncPACMAN_IO(config_filepath=io_config, timeout=5000)
+    yield io
+    io.cleanup()
+
+def _packets(n):
+    packets = list()
+    for i in range(n):
+        for io_group in (1,2):
+            packet = Packet_v2()
+            packet.io_group = io_group
+            packet.io_channel = i % 4 + 1
+            packet.chip_id = io_group
+            packet.register_data = i % 256
+            packets.append(packet)
+    return packets
+
+@pytest.mark.parametrize('max_msgs_in_flight', [1, 4])
+def test_send(pacman_io, cmdserver, max_msgs_in_flight):
+    _, received = cmdserver
+    pacman_io.max_msg_length = 10
+    pacman_io.interleave_packets_by_io_channel = False
+    pacman_io.max_msgs_in_flight = max_msgs_in_flight
+    packets = _packets(95)
+    pacman_io.send(packets)
+
+    assert len(received) == 20
+    assert len(pacman_io._sender_replies['127.0.0.1']) == 10
+    assert len(pacman_io._sender_replies['127.0.0.2']) == 10
+    received_packets = [packet for msg in received
+        for packet in pacman_msg_format.parse(msg)[1:]]
+    for io_group in (1,2):
+        sent = [packet for packet in packets if packet.io_group == io_group]
+        recv = [packet for packet in received_packets if packet.chip_id == io_group]
+        assert recv == sent
+
+@pytest.fixture
+def slow_cmdserver():
+    '''
+    A pacman-cmdserver that echoes each request, only replying to the
+    first request after 0.5s
+
+    '''
+    context = zmq.Context()
+    socket = context.socket(zmq.REP)
+    port = socket.bind_to_random_port('tcp://*')
+    stop = threading.Event()
+    def serve():
+        delay = 0.5
+        while not stop.is_set():
+            if not socket.poll(10):
+                continue
+            msg = socket.recv()
+            time.sleep(delay)
+            delay = 0
+            socket.send(msg)
+    thread = threading.Thread(target=serve)
+    thread.start()
+    yield str(port)
+    stop.set()
+    thread.join()
+    socket.close(linger=0)
+    context.term()
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_send_timeout(io_config, slow_cmdserver, monkeypatch, use_async):
+    monkeypatch.setattr(PACMAN_IO, 'cmdserver_port', slow_cmdserver)
+    io_class = AsyncPACMAN_IO if use_async else PACMAN_IO
+    io = io_class(config_filepath=io_config, timeout=100)
+    io.max_msgs_in_flight = 4
+    packets = [packet for packet in _packets(2) if packet.io_group == 1]
+    def send(packets):
+        if use_async:
+            return asyncio.run(io.send(packets))
+        return io.send(packets)
+    try:
+        with pytest.raises(zmq.Again):
+            send(packets[:1])
+        # wait for the late reply to the first request
+        time.sleep(0.6)
+        send(packets[1:])
+        replies = io._sender_replies['127.0.0.1']
+        assert len(replies) == 1
+        assert pacman_msg_format.parse(replies[-1])[1:] == packets[1:]
+    finally:
+        io.cleanup()
+
+def _wait_for(condition, timeout=5):
+    start = time.time()
+    while not condition():
+        assert time.time() - start < timeout
+        time.sleep(0.01)
+
+def test_background_receive(pacman_io, dataserver):
+    _, publisher = dataserver
+    pacman_io.background_receive = True
+    pacman_io.receive_buffer_length = 10
+    pacman_io.start_listening()
+    # wait for the subscription to be established
+    probe = pacman_msg_format.format([], msg_type='DATA')
+    def probe_received():
+        publisher.send(probe)
+        return pacman_io.receive_buffer_stats()['buffered']
+    _wait_for(probe_received)
+    time.sleep(0.1)
+    pacman_io.empty_queue()
+    assert pacman_io.receive_buffer_stats()['buffered'] == 0
+
+    packets = _packets(4)
+    for i in range(len(packets)):
+        packets[i].io_group = 1
+        packets[i].chip_id = i
+    msg = pacman_msg_format.format(packets, msg_type='DATA')
+    for _ in range(15):
+        publisher.send(msg)
+    _wait_for(lambda: pacman_io.receive_buffer_stats()['dropped'] == 5)
+    stats = pacman_io.receive_buffer_stats()
+    assert stats['buffered'] == 10
+    assert stats['overflows'] == 1
+
+    received, bytestream = pacman_io.empty_queue()
+    assert len(received) == 10 * (len(packets) + 1)
+    assert received[1:len(packets)+1] == packets
+    assert bytestream == msg * 10
+
+    publisher.send(msg)
+    _wait_for(lambda: pacman_io.receive_buffer_stats()['buffered'] == 1)
+    received, bytestream, payload = pacman_io.empty_queue(as_array=True, return_payload=True)
+    assert len(received) == len(packets) + 1
+    assert (received['io_group'] == 1).all()
+    assert payload.tolist() == [0] + [int.from_bytes(p.bytes(), 'little') for p in packets]
+    with pytest.raises(ValueError):
+        pacman_io.empty_queue(return_payload=True)
+    pacman_io.stop_listening()
+    assert pacman_io._receiver_thread is None
+
+@pytest.mark.parametrize('as_array', [False, True])
+def test_parallel_decode(pacman_io, as_array):
+    messages = list()
+    io_groups = list()
+    for i in range(10):
+        packets = _packets(i+1)
+        for packet in packets:
+            packet.chip_id = i
+        messages.append(pacman_msg_format.format(packets, msg_type='DATA'))
+        io_groups.append(i % 2 + 1)
+    expected = pacman_io._parse_messages(io_groups, messages, as_array=as_array)
+    pacman_io.decode_workers = 2
+    pacman_io.decode_batch_size = 3
+    packets = pacman_io._parse_messages(io_groups, messages, as_array=as_array)
+    assert pacman_io._decode_pool is not None
+    if as_array:
+        assert (packets == expected).all()
+    else:
+        assert packets == expected
+        assert [p.io_group for p in packets] == [p.io_group for p in expected]
+    if as_array:
+        _, expected_payload = pacman_msg_format.parse_messages_to_array(messages,
+            io_groups=io_groups, return_payload=True)
+        packets, payload = pacman_io._parse_messages(io_groups, messages,
+            as_array=True, return_payload=True)
+        assert (packets == expected).all()
+        assert (payload == expected_payload).all()
+
+@pytest.mark.parametrize('max_msgs_in_flight', [1, 4])
+def test_async_send(async_pacman_io, cmdserver, max_msgs_in_flight):
+    _, received = cmdserver
+    async_pacman_io.max_msg_length = 10
+    async_pacman_io.max_msgs_in_flight = max_msgs_in_flight
+    packets = _packets(95)
+    async def send_and_ping():
+        return await asyncio.gather(async_pacman_io.send(packets),
+            async_pacman_io.ping(), async_pacman_io.get_reg(0x10))
+    _, ping, reg = asyncio.run(send_and_ping())
+    assert ping == {1: True, 2: True}
+    assert reg == {1: 0x10, 2: 0x10}
+
+    assert len(received) == 20 + 4
+    assert len(async_pacman_io._sender_replies['127.0.0.1']) == 10 + 2
+    received_packets = [packet for msg in received
+        for packet in pacman_msg_format.parse(msg)[1:]
+        if isinstance(packet, Packet_v2)]
+    for io_group in (1,2):
+        sent = [packet for packet in packets if packet.io_group == io_group]
+        recv = [packet for packet in received_packets if packet.chip_id == io_group]
+        assert recv == sent
+
+def test_async_empty_queue(async_pacman_io, dataserver):
+    _, publisher = dataserver
+    packets = _packets(4)
+    msg = pacman_msg_format.format(packets, msg_type='DATA')
+    async def receive():
+        async_pacman_io.start_listening()
+        received = list()
+        start = time.time()
+        while not received:
+            assert time.time() - start < 5
+            publisher.send(msg)
+            await asyncio.sleep(0.01)
+            received, bytestream = await async_pacman_io.empty_queue()
+        async_pacman_io.stop_listening()
+        return received
+    received = asyncio.run(receive())
+    assert received[1:len(packets)+1] == packets
@@ -4,6 +4,7 @@ Tests for basic logging functionality
 '''
 from __future__ import print_function
 import pytest
+import numpy as np
 from larpix.larpix import Packet, Controller, Chip
 from larpix.io.fakeio import FakeIO
 from larpix.logger.stdout_logger import StdoutLogger
@@ -58,3 +59,26 @@ def test_controller_read_capture(capfd):
     controller.logger.enable()
     controller.run(0.1,'test')
     assert len(controller.logger._buffer) == 1
+
+def test_record_array():
+    from larpix.format.hdf5format import dtypes
+    logger = StdoutLogger(buffer_length=10)
+    logger.enable()
+    rows = np.zeros((3,), dtype=dtypes['2.3']['packets'])
+    rows['chip_id'] = [1, 2, 3]
+    logger.record(rows, direction=logger.READ)
+    assert logger._buffer == ['Record: {}'.format(row) for row in rows]
+    with pytest.raises(ValueError):
+        logger.record('test')
+
+def test_controller_read_array_capture(capfd):
+    from larpix.format.hdf5format import dtypes
+    controller = Controller()
+    controller.io = FakeIO()
+    rows = np.zeros((2,), dtype=dtypes['2.3']['packets'])
+    controller.io.empty_queue = lambda as_array=False: (rows, b'')
+    controller.logger = StdoutLogger(buffer_length=100)
+    controller.logger.enable()
+    packets, _ = controller.read(as_array=True)
+    assert packets is rows
+    assert len(controller.logger._buffer) == 2